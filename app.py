@@ -1,25 +1,22 @@
 import os
-import uvicorn
+import asyncio
+import threading
 from fastapi import FastAPI
-from app.routes.stock_routes import router as stock_router
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
-import logging
 from contextlib import asynccontextmanager
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("app.log")
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# 加载环境变量
+# 加载环境变量，需在导入路由之前执行
 load_dotenv()
 
+from app.routes.stock_routes import router as stock_router
+from app.services.warmup import start_warmup, warmup_state
+from app.utils.logger import setup_logger
+from app.utils.compression import CompressionMiddleware
+
+# 配置日志
+logger = setup_logger(__name__)
+
 # 创建数据目录
 data_dir = os.getenv('DATA_DIR', './data')
 os.makedirs(data_dir, exist_ok=True)
@@ -36,8 +33,34 @@ async def lifespan(app: FastAPI):
     else:
         logger.info("Tushare Token已配置")
     
+    # 预热股票池、概率表和交易日历，完成前 /ready 返回503
+    # WARMUP_BLOCKING=true 时预热完成后才开始接收请求
+    warmup_stop = threading.Event()
+    warmup_task = start_warmup(warmup_stop)
+    if os.getenv('WARMUP_BLOCKING', 'false').lower() == 'true':
+        await warmup_task
+    
+    # 配置 PREOPEN_SCHEDULE（如 09:25:30）时，每个交易日集合竞价结束后自动生成盘前排名
+    preopen_task = None
+    preopen_schedule = os.getenv('PREOPEN_SCHEDULE')
+    if preopen_schedule:
+        from app.services.preopen import run_preopen_scheduler
+        preopen_task = asyncio.create_task(run_preopen_scheduler(preopen_schedule))
+    
     yield
     
+    if preopen_task is not None:
+        preopen_task.cancel()
+    # 预热不再开始后面的任务，最多等待 WARMUP_SHUTDOWN_TIMEOUT 秒让当前任务结束
+    warmup_stop.set()
+    shutdown_timeout = float(os.getenv('WARMUP_SHUTDOWN_TIMEOUT', '10'))
+    try:
+        await asyncio.wait_for(asyncio.shield(warmup_task), timeout=shutdown_timeout)
+    except asyncio.TimeoutError:
+        logger.warning("预热任务未在%s秒内结束，不再等待", shutdown_timeout)
+    except Exception:
+        # 异常已由 start_warmup 记录
+        pass
     # 关闭时执行
     logger.info("股票分析服务关闭")
 
@@ -51,6 +74,9 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# JSON响应按 Accept-Encoding 压缩（brotli/gzip），并带 ETag 支持304
+app.add_middleware(CompressionMiddleware)
+
 # 注册路由
 app.include_router(stock_router, prefix="/api/stocks", tags=["stocks"])
 
@@ -59,7 +85,17 @@ async def root():
     """根路由"""
     return {"message": "欢迎使用股票分析服务"}
 
+@app.get("/ready", tags=["root"])
+async def ready():
+    """就绪检查，预热完成前返回503"""
+    state = warmup_state.to_dict()
+    if not state["ready"]:
+        return JSONResponse(status_code=503, content={"status": "warming_up", "data": state})
+    return {"status": "ready", "data": state}
+
 if __name__ == "__main__":
+    import uvicorn
+    
     # 获取配置
     host = os.getenv('API_HOST', '0.0.0.0')
     port = int(os.getenv('API_PORT', '8000'))
@@ -1,25 +1,341 @@
+import os
+import asyncio
 from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 from typing import Dict, List, Any, Optional
-from app.services.stock_service import StockService
+from app.utils.lazy import lazy_object
+from app.utils.paging import paginate, parse_fields, project_records, MAX_PAGE_SIZE
+from app.utils.horizons import HORIZONS
+from app.utils.publisher import update_publisher, format_event
+
+# 服务层依赖pandas和tushare，延迟到第一次请求时再导入，加快服务启动
+StockService = lazy_object('app.services.stock_service', 'StockService')
 
 router = APIRouter()
 
+# 批量查询最多股票数
+BATCH_MAX_ITEMS = 500
+
+
+def check_horizon(horizon: int) -> None:
+    """间隔交易日必须是计算过的 HORIZONS 之一"""
+    if horizon not in HORIZONS:
+        raise HTTPException(status_code=400,
+                            detail=f"不支持的间隔交易日: {horizon}，可选 {','.join(map(str, HORIZONS))}")
+
+class BatchProbabilityItem(BaseModel):
+    """批量查询的单只股票"""
+    ts_code: str
+    pct_chg: Optional[float] = None
+
+class BatchProbabilityRequest(BaseModel):
+    """批量查询请求"""
+    items: List[BatchProbabilityItem]
+    time_period: Optional[str] = None
+    fetch_missing: bool = True
+
+# 分页获取股票列表。GET /list?limit=200&fields=ts_code,name,circ_mv，下一页传入返回的 next_cursor
 @router.get("/list")
-async def get_stock_list() -> Dict[str, Any]:
+async def get_stock_list(
+    trade_date: Optional[str] = Query(None, description="交易日，如20250307，不指定则返回最近交易日的股票池"),
+    cursor: Optional[str] = Query(None, description="分页游标，上一页返回的next_cursor"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页股票数，不指定则返回全部"),
+    fields: Optional[str] = Query(None, description="返回的字段，逗号分隔，如name,industry,circ_mv，ts_code总是返回")
+) -> Dict[str, Any]:
     """获取过滤后的股票列表
     
-    返回市值在10亿到1000亿之间的非北交所股票
+    返回总市值在30亿到222亿之间、流通市值占比大于70%的非北交所、非科创板、非ST股票，按股票代码排序
     """
-    stocks = StockService.get_filtered_stocks()
+    stocks = await run_in_threadpool(StockService.get_filtered_stocks, trade_date)
     
     if not stocks:
         return {"status": "error", "message": "获取股票列表失败", "data": []}
     
+    try:
+        page, next_cursor = paginate(stocks, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    page = project_records(page, parse_fields(fields))
+    
     return {
         "status": "success",
         "message": "获取股票列表成功",
-        "data": stocks,
-        "total": len(stocks)
+        "data": page,
+        "total": len(stocks),
+        "count": len(page),
+        "next_cursor": next_cursor
+    }
+
+# 按预计算概率筛选股票。GET /screener?time_key=auction&pct_chg=4.75&top_n=20&min_total=20
+@router.get("/screener")
+async def screen_stocks(
+    time_key: str = Query(..., description="第二天时间段，如auction, 1min, 5min, 15min, 30min, 60min"),
+    category: Optional[str] = Query(None, description="当日涨跌幅分类，如range_1_3p，与pct_chg二选一"),
+    pct_chg: Optional[float] = Query(None, description="当日涨幅百分比，用于确定涨跌幅分类"),
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, y2等"),
+    top_n: int = Query(20, ge=1, le=500, description="返回数量"),
+    min_total: int = Query(0, ge=0, description="最小样本数"),
+    industry: Optional[str] = Query(None, description="行业"),
+    market: Optional[str] = Query(None, description="板块，如主板、创业板"),
+    min_circ_mv: Optional[float] = Query(None, description="最小流通市值（万元）"),
+    max_circ_mv: Optional[float] = Query(None, description="最大流通市值（万元）")
+) -> Dict[str, Any]:
+    """按上涨概率筛选股票
+
+    从内存中的预计算概率表返回上涨概率最高的前N只股票
+    """
+    result = await run_in_threadpool(
+        StockService.screen_stocks, time_key, category=category, pct_chg=pct_chg, time_period=time_period, top_n=top_n,
+        min_total=min_total, industry=industry, market=market,
+        min_circ_mv=min_circ_mv, max_circ_mv=max_circ_mv
+    )
+
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+
+    return {
+        "status": "success",
+        "message": "筛选股票成功",
+        "data": result["items"],
+        "total": len(result["items"]),
+        "matched": result["matched"],
+        "query": {
+            "time_period": result["time_period"],
+            "category": result["category"],
+            "display_range": result["display_range"],
+            "time_key": result["time_key"]
+        }
+    }
+
+# 盘前排名。GET /preopen?top_n=50&min_total=20，refresh=true 时重新获取当天竞价数据
+@router.get("/preopen")
+async def get_preopen_ranking(
+    top_n: int = Query(50, ge=1, le=5000, description="返回数量"),
+    min_total: int = Query(0, ge=0, description="最小样本数"),
+    refresh: bool = Query(False, description="是否重新获取竞价数据生成快照"),
+    trade_date: Optional[str] = Query(None, description="竞价日期，如20250310，不指定则为最近交易日"),
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, y2等")
+) -> Dict[str, Any]:
+    """获取全市场盘前排名
+
+    集合竞价结束后批量获取全市场竞价数据，按上一交易日涨跌幅分类关联预计算概率，
+    按第二天各时间段平均上涨概率排名
+    """
+    result = await run_in_threadpool(
+        StockService.get_preopen_ranking, top_n, min_total, refresh, trade_date, time_period
+    )
+
+    if "error" in result:
+        raise HTTPException(status_code=503, detail=result["error"])
+
+    items = result.pop("items")
+    return {
+        "status": "success",
+        "message": "获取盘前排名成功",
+        "data": items,
+        "total": len(items),
+        "snapshot": result
+    }
+
+# 回测。GET /backtest?prob_window=auction&min_up_prob=60&min_total=20&entry=auction&time_period=y2&sweep=50,55,60,65
+@router.get("/backtest")
+async def run_backtest(
+    prob_window: str = Query("auction", description="产生信号的时间段，如auction, 1min, 5min, 15min, 30min, 60min"),
+    min_up_prob: float = Query(60, ge=0, le=100, description="最小上涨概率（%）"),
+    min_total: int = Query(20, ge=0, description="最小样本数"),
+    entry: str = Query("auction", description="买入价格，auction为第二天竞价，prev_close为当天收盘价"),
+    time_period: Optional[str] = Query(None, description="回测区间，如m6, y2，不指定则使用全部数据"),
+    start_date: Optional[str] = Query(None, description="开始日期，如20230101"),
+    end_date: Optional[str] = Query(None, description="结束日期，如20250307"),
+    categories: Optional[str] = Query(None, description="只在这些涨跌幅分类产生信号，逗号分隔，如range_1_3p,range_3_5p"),
+    point_in_time: bool = Query(True, description="是否只用信号日之前的数据计算概率，false时使用预计算概率表"),
+    sweep: Optional[str] = Query(None, description="另外比较的一组最小上涨概率，逗号分隔，如50,55,60,65")
+) -> Dict[str, Any]:
+    """回测概率规则
+
+    在本地行情库的全部股票、全部交易日上按规则产生信号，统计第二天各时间段卖出的胜率和收益
+    """
+    try:
+        sweep_values = [float(value) for value in sweep.split(',') if value.strip()] if sweep else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="sweep必须是逗号分隔的数字")
+
+    result = await run_in_threadpool(
+        StockService.run_backtest, prob_window=prob_window, min_up_prob=min_up_prob, min_total=min_total,
+        entry=entry, time_period=time_period, start_date=start_date, end_date=end_date,
+        categories=[c.strip() for c in categories.split(',') if c.strip()] if categories else None,
+        point_in_time=point_in_time, sweep=sweep_values
+    )
+
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+
+    return {
+        "status": "success",
+        "message": "回测成功",
+        "data": result
+    }
+
+# 按行业、板块、市值分档汇总概率。GET /rollup?group_by=industry,cap_band&pct_chg=4.75&time_key=auction
+@router.get("/rollup")
+async def get_rollup(
+    group_by: str = Query("industry", description="汇总维度，逗号分隔，可选industry, market, cap_band"),
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, y2等"),
+    category: Optional[str] = Query(None, description="当日涨跌幅分类，如range_1_3p，不指定则按分类分组"),
+    pct_chg: Optional[float] = Query(None, description="当日涨幅百分比，按所属板块的规则确定涨跌幅分类，各板块分类不同时需指定category"),
+    time_key: Optional[str] = Query(None, description="第二天时间段，如auction, 5min，不指定则按时间段分组"),
+    industry: Optional[str] = Query(None, description="只汇总该行业"),
+    market: Optional[str] = Query(None, description="只汇总该板块，如主板、创业板"),
+    cap_band: Optional[str] = Query(None, description="只汇总该流通市值分档，如50亿-100亿"),
+    min_total: int = Query(0, ge=0, description="最小样本数")
+) -> Dict[str, Any]:
+    """按行业、板块、流通市值分档汇总的涨跌概率
+
+    用各股票的上涨、下跌、持平次数合并计算，不需要重新分析股票
+    """
+    dimensions = [dim.strip() for dim in group_by.split(',') if dim.strip()]
+    result = await run_in_threadpool(
+        StockService.get_rollup, dimensions, time_period=time_period, category=category, pct_chg=pct_chg, time_key=time_key,
+        industry=industry, market=market, cap_band=cap_band, min_total=min_total
+    )
+
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+
+    items = result.pop("items")
+    return {
+        "status": "success",
+        "message": "汇总概率成功",
+        "data": items,
+        "total": len(items),
+        "query": result
+    }
+
+# 合并多只股票的涨跌幅分布。GET /distribution?pct_chg=4.75&time_key=5min&ts_codes=000001.SZ,600000.SH
+@router.get("/distribution")
+async def get_pct_distribution(
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, y2等"),
+    category: Optional[str] = Query(None, description="当日涨跌幅分类，如range_1_3p，不指定则返回所有分类"),
+    pct_chg: Optional[float] = Query(None, description="当日涨幅百分比，按所属板块的规则确定涨跌幅分类，各板块分类不同时需指定category"),
+    time_key: Optional[str] = Query(None, description="第二天时间段，如auction, 5min，不指定则返回所有时间段"),
+    ts_codes: Optional[str] = Query(None, description="股票代码，逗号分隔，不指定则合并所有已分析的股票")
+) -> Dict[str, Any]:
+    """第二天最大涨幅、最小涨幅、收盘涨幅的分布（均值、标准差、分位数）
+
+    合并各股票分析时保存的分布统计，不需要重新分析股票
+    """
+    codes = [code.strip() for code in ts_codes.split(',') if code.strip()] if ts_codes else None
+    result = await run_in_threadpool(
+        StockService.get_pct_distribution, time_period, category, pct_chg, time_key, codes
+    )
+
+    if "error" in result:
+        raise HTTPException(status_code=400, detail=result["error"])
+
+    items = result.pop("items")
+    return {
+        "status": "success",
+        "message": "获取涨跌幅分布成功",
+        "data": items,
+        "total": len(items),
+        "query": result
+    }
+
+# 订阅概率更新（Server-Sent Events）。GET /subscribe?ts_codes=000001.SZ,600000.SH&preopen=true
+@router.get("/subscribe")
+async def subscribe_updates(
+    ts_codes: Optional[str] = Query(None, description="关注的股票代码，逗号分隔"),
+    preopen: bool = Query(False, description="是否接收盘前排名快照")
+) -> StreamingResponse:
+    """订阅关注股票的概率更新和盘前快照，代替轮询 /{ts_code}/probability
+
+    股票结果重新计算后推送变化的概率（probability 事件），盘前快照生成后推送关注股票的排名，
+    没有关注股票时推送前几名（preopen 事件）。空闲时每 SUBSCRIBE_HEARTBEAT 秒发送一次心跳注释。
+    """
+    codes = [code.strip() for code in ts_codes.split(',') if code.strip()] if ts_codes else []
+    if len(codes) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"最多订阅{BATCH_MAX_ITEMS}只股票")
+    if not codes and not preopen:
+        raise HTTPException(status_code=400, detail="请指定关注的股票或订阅盘前快照")
+    heartbeat = float(os.getenv('SUBSCRIBE_HEARTBEAT', '15'))
+    subscription = update_publisher.subscribe(codes, preopen)
+
+    async def events():
+        try:
+            yield format_event('subscribed', {"ts_codes": sorted(subscription.ts_codes), "preopen": preopen})
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+        finally:
+            update_publisher.unsubscribe(subscription)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# 多进程全量刷新的任务队列进度。GET /refresh/queue?run_id=refresh_20250307
+@router.get("/refresh/queue")
+async def get_refresh_queue_status(
+    run_id: Optional[str] = Query(None, description="任务ID，默认为今天的任务 refresh_{日期}")
+) -> Dict[str, Any]:
+    """获取全量刷新任务队列的进度和各工作进程状态
+
+    任务由 python -m app.services.work_queue 入队和处理
+    """
+    result = await run_in_threadpool(StockService.get_refresh_queue_status, run_id)
+
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+
+    return {
+        "status": "success",
+        "message": "获取任务队列进度成功",
+        "data": result
+    }
+
+# Tushare请求统计。GET /tushare/stats
+@router.get("/tushare/stats")
+async def get_tushare_stats() -> Dict[str, Any]:
+    """获取Tushare请求统计，包括各接口当前的并发窗口"""
+    result = await run_in_threadpool(StockService.get_tushare_stats)
+
+    if "error" in result:
+        raise HTTPException(status_code=500, detail=result["error"])
+
+    return {
+        "status": "success",
+        "message": "获取请求统计成功",
+        "data": result
+    }
+
+# 批量查询多只股票的涨跌概率。POST /batch/probability {"items": [{"ts_code": "000001.SZ", "pct_chg": 4.75}]}
+@router.post("/batch/probability")
+async def get_batch_probability(request: BatchProbabilityRequest) -> Dict[str, Any]:
+    """批量获取多只股票的涨跌概率
+
+    指定pct_chg时返回该涨幅分类下各时间段的概率和平均概率，否则返回所有涨跌幅分类。
+    没有预计算结果的股票会并发分析（fetch_missing=false时跳过）。
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items不能为空")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"一次最多查询{BATCH_MAX_ITEMS}只股票")
+
+    items = [item.model_dump() for item in request.items]
+    # 缺失的分析可能需要较长时间，放到线程池中执行，避免阻塞其他请求
+    result = await run_in_threadpool(
+        StockService.get_batch_probability, items, request.time_period, request.fetch_missing
+    )
+
+    return {
+        "status": "success",
+        "message": "批量获取股票涨跌概率成功",
+        "data": result,
+        "total": len(result),
+        "failed": sum(1 for entry in result if "error" in entry)
     }
 
 @router.get("/{ts_code}")
@@ -29,7 +345,7 @@ async def get_stock_info(ts_code: str) -> Dict[str, Any]:
     Args:
         ts_code: 股票代码，如 000001.SZ
     """
-    result = StockService.get_stock_info(ts_code)
+    result = await run_in_threadpool(StockService.get_stock_info, ts_code)
     
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
@@ -40,42 +356,80 @@ async def get_stock_info(ts_code: str) -> Dict[str, Any]:
         "data": result
     }
 
+# 分页获取所有股票的涨跌概率。GET /all/probability?time_period=y2&limit=100&fields=up_prob,total
 @router.get("/all/probability")
 async def get_all_stocks_probability(
-    time_period: Optional[str] = Query(None, description="时间周期，如m1, m3, m6, y1等")
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, m3, m6, y1等"),
+    resume: bool = Query(True, description="是否从当天的任务日志断点继续，并补拉失败的数据"),
+    cursor: Optional[str] = Query(None, description="分页游标，上一页返回的next_cursor"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="每页股票数，不指定则返回全部"),
+    fields: Optional[str] = Query(None, description="每个时间段返回的字段，逗号分隔，如up_prob,down_prob,total")
 ) -> Dict[str, Any]:
     """获取所有股票的涨跌概率
     
+    分页时只获取当前页的股票
+    
     Args:
         time_period: 时间周期，如m1, m3, m6, y1等，不指定则返回所有时间周期
+        resume: 是否从当天的任务日志断点继续
+        cursor: 分页游标
+        limit: 每页股票数
+        fields: 每个时间段返回的字段
     """
-    result = StockService.get_all_stocks_probability(time_period)
+    ts_codes, next_cursor, total = None, None, None
+    if cursor or limit:
+        stocks = await run_in_threadpool(StockService.get_filtered_stocks)
+        total = len(stocks)
+        try:
+            page, next_cursor = paginate(stocks, cursor, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        ts_codes = [stock['ts_code'] for stock in page]
+    
+    result = await run_in_threadpool(
+        StockService.get_all_stocks_probability, time_period, resume=resume, ts_codes=ts_codes
+    )
     
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     
+    field_list = parse_fields(fields)
+    if field_list is not None:
+        result = {
+            ts_code: {"name": item["name"], "data": StockService.project_probability(item["data"], field_list)}
+            for ts_code, item in result.items()
+        }
+    
     return {
         "status": "success",
         "message": "获取所有股票涨跌概率成功",
         "data": result,
-        "total": len(result)
+        "total": total if total is not None else len(result),
+        "count": len(result),
+        "next_cursor": next_cursor
     }
 
 @router.get("/{ts_code}/probability")
 async def get_stock_probability(
     ts_code: str,
-    time_period: Optional[str] = Query(None, description="时间周期，如m1, m3, m6, y1等")
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, m3, m6, y1等"),
+    horizon: int = Query(1, description="间隔交易日，返回之后第N个交易日（T+N）的概率，1为第二天，可选值见PROBABILITY_HORIZONS"),
+    fields: Optional[str] = Query(None, description="每个时间段返回的字段，逗号分隔，如up_prob,down_prob,total")
 ) -> Dict[str, Any]:
     """获取股票涨跌概率
     
     Args:
         ts_code: 股票代码，如 000001.SZ
         time_period: 时间周期，如m1, m3, m6, y1等，不指定则返回所有时间周期
+        horizon: 间隔交易日，如 1、2、3、5
+        fields: 每个时间段返回的字段
     """
-    result = StockService.get_stock_probability(ts_code)
+    check_horizon(horizon)
+    result = await run_in_threadpool(StockService.get_stock_probability, ts_code, horizon=horizon)
     
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
+    result = StockService.project_probability(result, parse_fields(fields))
     
     # 如果指定了时间周期，只返回该时间周期的数据
     if time_period and time_period in result:
@@ -91,11 +445,38 @@ async def get_stock_probability(
         "data": result
     }
 
+# 涨跌概率画像最相似的股票。GET /{ts_code}/similar?k=10&time_period=y2
+@router.get("/{ts_code}/similar")
+async def get_similar_stocks(
+    ts_code: str,
+    time_period: Optional[str] = Query(None, description="时间周期，如m1, y2等"),
+    k: int = Query(10, ge=1, le=100, description="返回的股票数量"),
+    min_coverage: int = Query(0, ge=0, description="候选股票至少有数据的(涨跌幅分类, 时间段)数")
+) -> Dict[str, Any]:
+    """查找涨跌概率画像最相似的股票
+
+    在内存概率表上按余弦相似度计算，不需要重新分析股票
+    """
+    result = await run_in_threadpool(StockService.get_similar_stocks, ts_code, time_period, k, min_coverage)
+
+    if "error" in result:
+        raise HTTPException(status_code=404, detail=result["error"])
+
+    items = result.pop("items")
+    return {
+        "status": "success",
+        "message": "查找相似股票成功",
+        "data": items,
+        "total": len(items),
+        "query": result
+    }
+
 # 查询特定股票在特定涨幅范围内的平均概率。GET /{ts_code}/probability/pct?pct_chg=4.75
 @router.get("/{ts_code}/probability/pct")
 async def get_stock_probability_by_pct(
     ts_code: str,
-    pct_chg: float = Query(..., description="涨幅百分比")
+    pct_chg: float = Query(..., description="涨幅百分比"),
+    horizon: int = Query(1, description="间隔交易日，1为第二天，可选值见PROBABILITY_HORIZONS")
 ) -> Dict[str, Any]:
     """获取特定股票在特定涨幅范围内的平均概率
     
@@ -104,8 +485,10 @@ async def get_stock_probability_by_pct(
     Args:
         ts_code: 股票代码，如 000001.SZ
         pct_chg: 涨幅百分比
+        horizon: 间隔交易日，如 1、2、3、5
     """
-    result = StockService.get_stock_probability_by_pct(ts_code, pct_chg)
+    check_horizon(horizon)
+    result = await run_in_threadpool(StockService.get_stock_probability_by_pct, ts_code, pct_chg, horizon)
     
     if "error" in result:
         raise HTTPException(status_code=404, detail=result["error"])
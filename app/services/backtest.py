@@ -0,0 +1,290 @@
+import os
+import time
+import datetime
+import threading
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.logger import setup_logger
+from app.utils.bar_store import bar_store, BarStore
+from app.utils.day_summary import WINDOW_KEYS, WINDOW_PRICE_FIELDS
+from app.utils.tushare_utils import PCT_BUCKETS, TIME_PERIOD_MAP
+from app.services.probability_store import probability_table
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 买入价格: 第二天竞价价格，或当天收盘价
+ENTRY_TYPES = ['auction', 'prev_close']
+
+
+class BacktestPanel:
+    """回测用的全市场面板
+
+    从本地行情库读取所有股票，每行是一只股票的一个交易日（信号日），保存当天收盘价、
+    涨跌幅分档和第二天各时间段的价格，并预先计算截至信号日之前（不含当天）
+    每只股票在同一分档下各时间段的样本数和上涨次数，用于无未来函数的回测。
+    """
+
+    def __init__(self, store: Optional[BarStore] = None):
+        self.store = store or bar_store
+        self.lock = threading.Lock()
+        self.signature: Optional[Tuple] = None
+        self.ts_codes: np.ndarray = np.empty(0, dtype=object)
+        self.dates: np.ndarray = np.empty(0, dtype=object)
+        self.category_keys: List[str] = PCT_BUCKETS.keys()
+        self.columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.columns.get('stock', ()))
+
+    def _signature(self) -> Tuple:
+        store_dir = self.store.get_store_dir()
+        if not os.path.isdir(store_dir):
+            return ()
+        return tuple(sorted((entry.name, entry.stat().st_mtime) for entry in os.scandir(store_dir)
+                            if entry.name.endswith('.npz')))
+
+    def ensure_loaded(self) -> None:
+        """行情库文件有变化时重建面板"""
+        signature = self._signature()
+        if signature == self.signature:
+            return
+        with self.lock:
+            if signature != self.signature:
+                self._build()
+                self.signature = signature
+
+    def _build(self) -> None:
+        start_time = time.time()
+        category_index = {key: i for i, key in enumerate(self.category_keys)}
+        codes, parts = [], []
+        for ts_code in self.store.list_codes():
+            try:
+                loaded = self.store.load(ts_code)
+            except Exception as e:
+                logger.error("读取股票%s行情数据失败: %s", ts_code, e)
+                continue
+            if loaded is None:
+                continue
+            daily, summary = loaded
+            n = len(daily['trade_date']) - 1
+            if n <= 0:
+                continue
+            categories = PCT_BUCKETS.categorize(daily['pct_chg'][:n].astype(np.float64), ts_code)
+            # 第二天在汇总表中的行号，没有数据的为-1
+            rows = pd.Index(summary.dates).get_indexer(daily['trade_date'][1:])
+            prices = np.full((n, len(WINDOW_KEYS)), np.nan, dtype=np.float32)
+            for j, window in enumerate(WINDOW_KEYS):
+                k = summary.window_index.get(window)
+                if k is None:
+                    continue
+                found = rows >= 0
+                prices[found, j] = summary.values[rows[found], k, WINDOW_PRICE_FIELDS[window]]
+            parts.append({
+                'stock': np.full(n, len(codes), dtype=np.int32),
+                'date': daily['trade_date'][:n].astype(object),
+                'category': np.array([category_index.get(c, -1) for c in categories], dtype=np.int16),
+                'close': daily['close'][:n].astype(np.float32),
+                'prices': prices,
+            })
+            codes.append(ts_code)
+
+        self.ts_codes = np.array(codes, dtype=object)
+        if not parts:
+            self.dates, self.columns = np.empty(0, dtype=object), {}
+            return
+        columns = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        # 交易日编号，便于按日汇总
+        self.dates, columns['date'] = np.unique(columns['date'], return_inverse=True)
+        columns['date'] = columns['date'].astype(np.int32)
+        self._add_prior_counts(columns)
+        self.columns = columns
+        logger.info("回测面板重建完成，共%s只股票%s行，耗时: %.3f秒",
+                    len(codes), len(columns['stock']), time.time() - start_time)
+
+    def _add_prior_counts(self, columns: Dict[str, np.ndarray]) -> None:
+        """计算每行之前同一股票同一分档下各时间段的样本数和上涨次数"""
+        n = len(columns['stock'])
+        keys = columns['stock'].astype(np.int64) * len(self.category_keys) + columns['category']
+        # 同一股票的行按日期升序，稳定排序后每组内仍按日期升序
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        is_start = np.ones(n, dtype=bool)
+        is_start[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        start_index = np.maximum.accumulate(np.where(is_start, np.arange(n), 0))
+
+        close = columns['close']
+        prior_total = np.zeros((n, len(WINDOW_KEYS)), dtype=np.int32)
+        prior_up = np.zeros((n, len(WINDOW_KEYS)), dtype=np.int32)
+        for j in range(len(WINDOW_KEYS)):
+            price = columns['prices'][:, j]
+            valid = ~np.isnan(price)
+            up = valid & (price > close)
+            for counts, flags in ((prior_total, valid), (prior_up, up)):
+                flags = flags[order].astype(np.int32)
+                # 不含当前行的累计值，减去组起点的累计值
+                before = np.cumsum(flags) - flags
+                counts[order, j] = before - before[start_index]
+        no_category = columns['category'] < 0
+        prior_total[no_category] = 0
+        prior_up[no_category] = 0
+        columns['prior_total'] = prior_total
+        columns['prior_up'] = prior_up
+
+
+def _window_stats(returns: np.ndarray, up: np.ndarray, dates: np.ndarray) -> Dict[str, Any]:
+    """单个时间段的回测统计"""
+    trades = len(returns)
+    if trades == 0:
+        return {'trades': 0}
+    wins = returns > 0
+    # 每天等权买入所有信号股票，按天复利
+    day_ids, inverse = np.unique(dates, return_inverse=True)
+    daily_returns = np.bincount(inverse, weights=returns) / np.bincount(inverse)
+    return {
+        'trades': int(trades),
+        'days': int(len(day_ids)),
+        'hit_rate': round(float(wins.mean() * 100), 2),
+        'up_rate': round(float(up.mean() * 100), 2),
+        'avg_return': round(float(returns.mean()), 4),
+        'median_return': round(float(np.median(returns)), 4),
+        'std_return': round(float(returns.std()), 4),
+        'avg_win': round(float(returns[wins].mean()), 4) if wins.any() else 0,
+        'avg_loss': round(float(returns[~wins].mean()), 4) if (~wins).any() else 0,
+        'daily_avg_return': round(float(daily_returns.mean()), 4),
+        'cumulative_return': round(float((np.prod(1 + daily_returns / 100) - 1) * 100), 2),
+    }
+
+
+class BacktestEngine:
+    """基于本地行情库和概率的向量化回测
+
+    规则: 信号日收盘后，某只股票在当天涨跌幅分档下 prob_window 时间段的上涨概率 >= min_up_prob
+    且样本数 >= min_total 时买入（第二天竞价或当天收盘价），在第二天各时间段卖出，
+    统计各时间段的胜率和收益。所有股票、所有交易日一次用数组计算。
+    point_in_time=True 时概率只用信号日之前的数据计算；否则使用预计算概率表（包含未来数据，只用于对比）。
+    """
+
+    def __init__(self, panel: Optional[BacktestPanel] = None):
+        self.panel = panel or BacktestPanel()
+
+    def run(self, prob_window: str = 'auction', min_up_prob: float = 60, min_total: int = 20,
+            entry: str = 'auction', time_period: Optional[str] = None, start_date: Optional[str] = None,
+            end_date: Optional[str] = None, categories: Optional[List[str]] = None,
+            point_in_time: bool = True, sweep: Optional[List[float]] = None) -> Dict[str, Any]:
+        """执行回测
+
+        Args:
+            prob_window: 用哪个时间段的上涨概率产生信号
+            min_up_prob: 最小上涨概率（%）
+            min_total: 最小样本数
+            entry: 买入价格，auction 第二天竞价，prev_close 当天收盘价
+            time_period: 回测区间，如 y2，与 start_date/end_date 二选一，都不指定则使用全部数据
+            categories: 只在这些涨跌幅分档产生信号
+            point_in_time: 是否只用信号日之前的数据计算概率
+            sweep: 另外统计的一组最小上涨概率，用于比较不同阈值
+        """
+        start_time = time.time()
+        if prob_window not in WINDOW_KEYS:
+            return {"error": f"不支持的时间段: {prob_window}"}
+        if entry not in ENTRY_TYPES:
+            return {"error": f"不支持的买入价格: {entry}"}
+        if time_period and time_period[0] not in 'my':
+            return {"error": f"不支持的时间周期: {time_period}"}
+
+        self.panel.ensure_loaded()
+        panel = self.panel
+        columns = panel.columns
+        if not columns:
+            return {"error": "本地行情库没有数据，请先分析股票"}
+
+        # 回测区间，与 calculate_probability 的时间周期计算方式一致
+        dates = panel.dates
+        if time_period and not start_date:
+            end = datetime.datetime.strptime(end_date or dates[-1], '%Y%m%d')
+            days = 30 * int(time_period[1:]) if time_period[0] == 'm' else 365 * int(time_period[1:])
+            start_date = (end - datetime.timedelta(days=days)).strftime('%Y%m%d')
+        first = np.searchsorted(dates, start_date) if start_date else 0
+        last = np.searchsorted(dates, end_date, side='right') if end_date else len(dates)
+        in_range = (columns['date'] >= first) & (columns['date'] < last)
+        if categories:
+            wanted = [i for i, key in enumerate(panel.category_keys) if key in categories]
+            in_range &= np.isin(columns['category'], wanted)
+
+        window_index = WINDOW_KEYS.index(prob_window)
+        if point_in_time:
+            total = columns['prior_total'][:, window_index]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                up_prob = np.where(total > 0, columns['prior_up'][:, window_index] / np.maximum(total, 1) * 100, np.nan)
+        else:
+            up_prob, total = self._table_probabilities(prob_window, time_period)
+
+        close = columns['close']
+        prices = columns['prices']
+        entry_price = prices[:, WINDOW_KEYS.index('auction')] if entry == 'auction' else close
+        base = in_range & (total >= min_total) & ~np.isnan(entry_price)
+        # 竞价买入时竞价时间段的收益恒为0，不统计
+        exit_windows = [w for w in WINDOW_KEYS if not (entry == 'auction' and w == 'auction')]
+
+        def evaluate(threshold: float) -> Dict[str, Dict[str, Any]]:
+            with np.errstate(invalid='ignore'):
+                signal = base & (up_prob >= threshold)
+            stats = {}
+            for window in exit_windows:
+                exit_price = prices[:, WINDOW_KEYS.index(window)]
+                rows = np.flatnonzero(signal & ~np.isnan(exit_price))
+                returns = (exit_price[rows].astype(np.float64) / entry_price[rows] - 1) * 100
+                stats[window] = _window_stats(returns, exit_price[rows] > close[rows], columns['date'][rows])
+            stats['signals'] = int(signal.sum())
+            return stats
+
+        windows = evaluate(min_up_prob)
+        signals = windows.pop('signals')
+        result = {
+            "params": {
+                "prob_window": prob_window, "min_up_prob": min_up_prob, "min_total": min_total,
+                "entry": entry, "time_period": time_period, "start_date": start_date, "end_date": end_date,
+                "categories": categories, "point_in_time": point_in_time,
+            },
+            "stocks": int(len(panel.ts_codes)),
+            "samples": int(in_range.sum()),
+            "signals": signals,
+            "windows": windows,
+        }
+        if sweep:
+            result["sweep"] = []
+            for threshold in sweep:
+                stats = evaluate(threshold)
+                result["sweep"].append({
+                    "min_up_prob": threshold,
+                    "signals": stats.pop('signals'),
+                    "windows": {window: {key: value for key, value in s.items()
+                                         if key in ('trades', 'hit_rate', 'avg_return', 'cumulative_return')}
+                                for window, s in stats.items()},
+                })
+        result["elapsed"] = round(time.time() - start_time, 3)
+        return result
+
+    def _table_probabilities(self, prob_window: str, time_period: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """从预计算概率表获取每行对应的上涨概率和样本数"""
+        panel = self.panel
+        columns = panel.columns
+        category_keys = np.array(panel.category_keys + [None], dtype=object)
+        # 回测区间不是启用的时间周期时，使用第一个启用的时间周期的概率
+        table_period = time_period if time_period in TIME_PERIOD_MAP else next(iter(TIME_PERIOD_MAP))
+        probability_table.ensure_loaded()
+        snapshot = probability_table.snapshot()
+        rows = probability_table.match_rows(panel.ts_codes[columns['stock']], category_keys[columns['category']],
+                                            table_period, prob_window, snapshot)
+        matched = rows >= 0
+        up_prob = np.full(len(rows), np.nan)
+        total = np.zeros(len(rows), dtype=np.int64)
+        table_columns = snapshot[0]
+        if matched.any():
+            up_prob[matched] = table_columns['up_prob'][rows[matched]]
+            total[matched] = table_columns['total'][rows[matched]]
+        return up_prob, total
+
+
+backtest_engine = BacktestEngine()
@@ -0,0 +1,180 @@
+import os
+import time
+import asyncio
+import datetime
+import threading
+from typing import Dict, Any, Optional
+import numpy as np
+import pandas as pd
+from app.utils.logger import setup_logger
+from app.utils.tushare_utils import (
+    get_daily_by_date, get_auction_by_date, get_trade_calendar, get_latest_trade_date,
+    get_previous_trade_date, PCT_BUCKETS, LIST_RANGE_MAP, TIME_FREQ_MAP, TIME_PERIOD_MAP
+)
+from app.services.probability_store import probability_table
+from app.services.universe_store import universe_store
+from app.utils.publisher import update_publisher
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 参与打分的第二天时间段，竞价结果已经知道，不计入得分
+SCORE_TIME_KEYS = [time_key for time_key in TIME_FREQ_MAP if time_key != 'auction']
+
+
+class PreopenScorer:
+    """盘前批量打分
+
+    集合竞价结束后，一次获取全市场上一交易日的日线和当天的开盘竞价，
+    按上一交易日涨跌幅分档（各板块规则不同），与内存概率表批量关联，
+    生成全市场排名快照。得分为第二天各时间段（不含竞价）上涨概率的平均值。
+    快照保存在内存中并写入 {DATA_DIR}/preopen/{trade_date}.csv。
+    """
+
+    def __init__(self, output_dir: Optional[str] = None):
+        self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.snapshot: Optional[Dict[str, Any]] = None
+
+    def get_output_dir(self) -> str:
+        return self.output_dir or os.path.join(os.getenv('DATA_DIR', './data'), 'preopen')
+
+    def run(self, trade_date: Optional[str] = None, time_period: Optional[str] = None) -> Dict[str, Any]:
+        """生成并发布盘前排名快照
+
+        Args:
+            trade_date: 竞价日期，不指定则为今天（非交易日取最近交易日）
+            time_period: 概率表的时间周期，不指定则使用第一个启用的时间周期
+        """
+        start_time = time.time()
+        trade_date = get_latest_trade_date(trade_date)
+        if not trade_date:
+            return {"error": "获取交易日历失败"}
+        prev_date = get_previous_trade_date(trade_date)
+        if not prev_date:
+            return {"error": f"未找到{trade_date}的上一个交易日"}
+        time_period = time_period or next(iter(TIME_PERIOD_MAP))
+
+        daily = get_daily_by_date(prev_date)
+        if daily.empty:
+            return {"error": f"获取{prev_date}全市场日线行情失败"}
+        auction = get_auction_by_date(trade_date)
+        if auction.empty:
+            return {"error": f"{trade_date}的竞价数据还没有发布"}
+
+        frame = daily[['ts_code', 'close', 'pct_chg']].rename(columns={'close': 'prev_close', 'pct_chg': 'prev_pct_chg'})
+        # 只对上一交易日股票池中的股票打分
+        universe = universe_store.get_universe(prev_date)
+        if not universe.empty:
+            info_columns = [col for col in ('ts_code', 'name', 'industry', 'market', 'circ_mv') if col in universe.columns]
+            frame = frame.merge(universe[info_columns].drop_duplicates('ts_code'), on='ts_code', how='inner')
+        auction = auction[['ts_code', 'close', 'amount']].rename(columns={'close': 'auction_price', 'amount': 'auction_amount'})
+        frame = frame.merge(auction.drop_duplicates('ts_code'), on='ts_code', how='inner')
+        fetched_at = time.time()
+
+        ts_codes = frame['ts_code'].to_numpy(dtype=object)
+        categories = PCT_BUCKETS.categorize(frame['prev_pct_chg'].to_numpy(dtype=np.float64), ts_codes)
+        prev_close = frame['prev_close'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frame['auction_pct'] = np.round((frame['auction_price'].to_numpy(dtype=np.float64) / prev_close - 1) * 100, 2)
+        frame['category'] = categories
+        frame['display_range'] = [LIST_RANGE_MAP.get(category, category) for category in categories]
+
+        # 每个时间段一次批量关联，没有预计算结果的为NaN
+        probability_table.ensure_loaded()
+        snapshot = probability_table.snapshot()
+        columns = snapshot[0]
+        up_probs = {}
+        for time_key in TIME_FREQ_MAP:
+            rows = probability_table.match_rows(ts_codes, categories, time_period, time_key, snapshot)
+            matched = rows >= 0
+            up_prob = np.full(len(rows), np.nan, dtype=np.float64)
+            if matched.any():
+                up_prob[matched] = columns['up_prob'][rows[matched]]
+            up_probs[time_key] = up_prob
+            if time_key == 'auction':
+                total = np.zeros(len(rows), dtype=np.int64)
+                if matched.any():
+                    total[matched] = columns['total'][rows[matched]]
+                frame['total'] = total
+            frame[f'{time_key}_up_prob'] = np.round(up_prob, 2)
+
+        score_matrix = np.column_stack([up_probs[time_key] for time_key in SCORE_TIME_KEYS])
+        has_score = ~np.isnan(score_matrix).all(axis=1)
+        score = np.full(len(frame), np.nan)
+        score[has_score] = np.nanmean(score_matrix[has_score], axis=1)
+        frame['score'] = np.round(score, 2)
+
+        frame = frame[has_score].sort_values(['score', 'total'], ascending=False, ignore_index=True)
+        frame.insert(0, 'rank', np.arange(1, len(frame) + 1))
+
+        snapshot = {
+            "trade_date": trade_date,
+            "prev_trade_date": prev_date,
+            "time_period": time_period,
+            "generated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "elapsed": round(time.time() - start_time, 3),
+            "fetch_elapsed": round(fetched_at - start_time, 3),
+            "auction_count": int(len(ts_codes)),
+            "matched": int(len(frame)),
+            "items": frame.replace({np.nan: None}).to_dict('records'),
+        }
+        self._save(frame, trade_date)
+        with self.lock:
+            self.snapshot = snapshot
+        update_publisher.publish_preopen(snapshot)
+        logger.info("盘前排名快照%s生成完成，%s只股票有竞价数据，%s只股票有概率数据，耗时: %.3f秒",
+                    trade_date, snapshot["auction_count"], snapshot["matched"], snapshot["elapsed"])
+        return snapshot
+
+    def _save(self, frame: pd.DataFrame, trade_date: str) -> None:
+        try:
+            output_dir = self.get_output_dir()
+            os.makedirs(output_dir, exist_ok=True)
+            frame.to_csv(os.path.join(output_dir, f"{trade_date}.csv"), index=False, encoding='utf-8-sig')
+        except Exception as e:
+            logger.error("保存盘前排名快照失败: %s", e)
+
+    def get_snapshot(self) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.snapshot
+
+
+preopen_scorer = PreopenScorer()
+
+
+def _next_run_time(schedule: str, now: datetime.datetime) -> datetime.datetime:
+    run_time = datetime.datetime.combine(now.date(), datetime.time.fromisoformat(schedule))
+    if run_time <= now:
+        run_time += datetime.timedelta(days=1)
+    return run_time
+
+
+async def run_preopen_scheduler(schedule: str) -> None:
+    """每个交易日在 schedule（如 09:25:30）生成盘前快照
+
+    竞价数据可能晚几秒发布，失败后每 PREOPEN_POLL_INTERVAL 秒重试，最多 PREOPEN_POLL_TIMEOUT 秒
+    """
+    poll_interval = float(os.getenv('PREOPEN_POLL_INTERVAL', '5'))
+    poll_timeout = float(os.getenv('PREOPEN_POLL_TIMEOUT', '300'))
+    logger.info("盘前打分定时任务已启动，每个交易日%s执行", schedule)
+    while True:
+        run_time = _next_run_time(schedule, datetime.datetime.now())
+        await asyncio.sleep((run_time - datetime.datetime.now()).total_seconds())
+
+        today = run_time.strftime('%Y%m%d')
+        calendar = await asyncio.to_thread(get_trade_calendar)
+        if today not in calendar:
+            continue
+
+        deadline = time.time() + poll_timeout
+        while True:
+            try:
+                result = await asyncio.to_thread(preopen_scorer.run, today)
+            except Exception as e:
+                result = {"error": str(e)}
+            if "error" not in result or time.time() >= deadline:
+                break
+            await asyncio.sleep(poll_interval)
+        if "error" in result:
+            logger.error("盘前打分失败: %s", result["error"])
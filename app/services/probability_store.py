@@ -0,0 +1,587 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Any, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.logger import setup_logger
+from app.utils.tushare_utils import LIST_RANGE_MAP, TIME_FREQ_MAP, PCT_BUCKETS
+from app.services.universe_store import universe_store
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 概率结果文件名: {ts_code}_{time_period}_probability.csv
+PROBABILITY_FILE_PATTERN = re.compile(r'^(?P<ts_code>.+)_(?P<time_period>[my]\d+)_probability\.csv$')
+
+# CSV列名 -> 内存列名
+PROBABILITY_COLUMNS = {
+    '涨概率': 'up_prob',
+    '跌概率': 'down_prob',
+    '平概率': 'equal_prob',
+    '最大涨幅': 'max_pct',
+    '最小涨幅': 'min_pct',
+    '收盘涨幅': 'close_pct',
+    '成交量占比': 'volume_ratio',
+}
+
+# 概率表同一次重建的 (columns, groups, stock_rows)
+TableSnapshot = Tuple[Dict[str, np.ndarray], Dict[Tuple[str, str, str], slice], Dict[str, np.ndarray]]
+
+
+class ProbabilityTable:
+    """预计算概率结果的内存列式表
+
+    把数据目录下所有 {ts_code}_{time_period}_probability.csv 读入一组 numpy 列，
+    并按 (time_period, category, time_key) 排序分组，查询时只需扫描对应分组。
+    文件按修改时间增量重载，超过 ttl 秒后的首次查询会检查文件变化。
+    """
+
+    def __init__(self, data_dir: Optional[str] = None, ttl: Optional[float] = None):
+        self.data_dir = data_dir
+        self.ttl = ttl if ttl is not None else float(os.getenv('PROBABILITY_TABLE_TTL', '60'))
+        self.lock = threading.Lock()
+        self.loaded_at = 0.0
+        # 文件路径 -> (mtime, 解析后的DataFrame)
+        self.file_frames: Dict[str, Tuple[float, pd.DataFrame]] = {}
+        self.columns: Dict[str, np.ndarray] = {}
+        self.groups: Dict[Tuple[str, str, str], slice] = {}
+        self.stock_rows: Dict[str, np.ndarray] = {}
+        # 每次重建列式表加1，依赖概率表的缓存据此判断是否需要重建
+        self.version = 0
+        # 反向映射: CSV中的显示值 -> key
+        self.category_keys = {v: k for k, v in LIST_RANGE_MAP.items()}
+        self.time_keys = {v: k for k, v in TIME_FREQ_MAP.items()}
+
+    def get_data_dir(self) -> str:
+        return self.data_dir or os.getenv('DATA_DIR', './data')
+
+    def __len__(self) -> int:
+        return len(self.columns.get('ts_code', ()))
+
+    def ensure_loaded(self, force: bool = False) -> None:
+        """确保内存表是最新的，超过ttl才检查文件变化"""
+        if not force and self.loaded_at and time.time() - self.loaded_at < self.ttl:
+            return
+        with self.lock:
+            if not force and self.loaded_at and time.time() - self.loaded_at < self.ttl:
+                return
+            self._reload()
+            self.loaded_at = time.time()
+
+    def _read_file(self, file_path: str, ts_code: str, time_period: str) -> pd.DataFrame:
+        """读取单个概率文件，转换成内存表的行格式，只保留 T+1 的概率"""
+        df = pd.read_csv(file_path, encoding='utf-8-sig')
+        if '间隔交易日' in df.columns:
+            df = df[df['间隔交易日'] == 1]
+        frame = pd.DataFrame({
+            'ts_code': ts_code,
+            'name': df['股票名称'].astype(str) if '股票名称' in df.columns else '',
+            'time_period': time_period,
+            'category': df['当日涨幅'].astype(str).map(lambda v: self.category_keys.get(v, v)),
+            'time_key': df['时间段'].astype(str).map(lambda v: self.time_keys.get(v, v)),
+            'total': pd.to_numeric(df['样本数'], errors='coerce').fillna(0).astype(np.int32),
+        })
+        for csv_col, col in PROBABILITY_COLUMNS.items():
+            values = df[csv_col] if csv_col in df.columns else 0
+            frame[col] = pd.to_numeric(values, errors='coerce').fillna(0).astype(np.float32)
+        return frame
+
+    def _reload(self) -> None:
+        """增量重载概率文件，并重建列式表"""
+        data_dir = self.get_data_dir()
+        if not os.path.isdir(data_dir):
+            return
+
+        seen = set()
+        changed = False
+        for entry in os.scandir(data_dir):
+            match = PROBABILITY_FILE_PATTERN.match(entry.name)
+            if not match:
+                continue
+            seen.add(entry.path)
+            mtime = entry.stat().st_mtime
+            cached = self.file_frames.get(entry.path)
+            if cached and cached[0] == mtime:
+                continue
+            try:
+                frame = self._read_file(entry.path, match.group('ts_code'), match.group('time_period'))
+                self.file_frames[entry.path] = (mtime, frame)
+                changed = True
+            except Exception as e:
+                logger.error("读取概率文件%s失败: %s", entry.path, e)
+
+        for file_path in set(self.file_frames) - seen:
+            del self.file_frames[file_path]
+            changed = True
+
+        if not changed and self.columns:
+            return
+
+        start_time = time.time()
+        frames = [frame for _, frame in self.file_frames.values()]
+        if not frames:
+            self.columns, self.groups, self.stock_rows = {}, {}, {}
+            self.version += 1
+            return
+
+        table = pd.concat(frames, ignore_index=True)
+        table = self._join_universe(table)
+        # 所属板块分档规则的下标，不同板块的涨停分档不同
+        table['board'] = PCT_BUCKETS.board_index(table['ts_code'].to_numpy())
+        table = table.sort_values(['time_period', 'category', 'time_key', 'ts_code'], kind='stable', ignore_index=True)
+
+        columns = {col: table[col].to_numpy() for col in table.columns}
+        # 分组边界: 排序后相同 (time_period, category, time_key) 的行是连续的
+        keys = list(zip(columns['time_period'], columns['category'], columns['time_key']))
+        groups = {}
+        start = 0
+        for i in range(1, len(keys) + 1):
+            if i == len(keys) or keys[i] != keys[start]:
+                groups[keys[start]] = slice(start, i)
+                start = i
+
+        codes, inverse = np.unique(columns['ts_code'], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(codes) + 1))
+        stock_rows = {code: order[bounds[i]:bounds[i + 1]] for i, code in enumerate(codes)}
+
+        self.columns, self.groups, self.stock_rows = columns, groups, stock_rows
+        self.version += 1
+        logger.info("概率内存表重建完成，共%s个文件%s行，耗时: %.3f秒",
+                    len(frames), len(table), time.time() - start_time)
+
+    def _join_universe(self, table: pd.DataFrame) -> pd.DataFrame:
+        """关联股票池中的行业、板块、流通市值"""
+        table['industry'] = ''
+        table['market'] = ''
+        table['circ_mv'] = np.nan
+        try:
+            universe = universe_store.get_universe()
+            if universe.empty:
+                return table
+            universe = universe.drop_duplicates('ts_code').set_index('ts_code')
+            for col in ('industry', 'market'):
+                if col in universe.columns:
+                    table[col] = table['ts_code'].map(universe[col]).fillna('').astype(str)
+            if 'circ_mv' in universe.columns:
+                table['circ_mv'] = table['ts_code'].map(universe['circ_mv']).astype(np.float64)
+        except Exception as e:
+            logger.error("关联股票池数据失败: %s", e)
+        return table
+
+    def rows_to_records(self, rows: np.ndarray, columns: Optional[Dict[str, np.ndarray]] = None) -> List[Dict[str, Any]]:
+        """把行号转换成字典列表，columns 为行号所属快照的列，不指定则使用当前的表"""
+        columns = columns if columns is not None else self.columns
+        records = []
+        for i in rows:
+            circ_mv = columns['circ_mv'][i]
+            records.append({
+                'ts_code': columns['ts_code'][i],
+                'name': columns['name'][i],
+                'industry': columns['industry'][i],
+                'market': columns['market'][i],
+                'circ_mv': None if np.isnan(circ_mv) else float(circ_mv),
+                'time_period': columns['time_period'][i],
+                'category': columns['category'][i],
+                'time_key': columns['time_key'][i],
+                'up_prob': round(float(columns['up_prob'][i]), 2),
+                'down_prob': round(float(columns['down_prob'][i]), 2),
+                'equal_prob': round(float(columns['equal_prob'][i]), 2),
+                'max_pct': round(float(columns['max_pct'][i]), 2),
+                'min_pct': round(float(columns['min_pct'][i]), 2),
+                'close_pct': round(float(columns['close_pct'][i]), 2),
+                'volume_ratio': round(float(columns['volume_ratio'][i]), 2),
+                'total': int(columns['total'][i]),
+            })
+        return records
+
+    def screen(self, category: str, time_key: str, time_period: str, top_n: int = 20, min_total: int = 0,
+               industry: Optional[str] = None, market: Optional[str] = None,
+               min_circ_mv: Optional[float] = None, max_circ_mv: Optional[float] = None,
+               boards: Optional[List[int]] = None) -> Dict[str, Any]:
+        """按上涨概率筛选前N只股票
+
+        Args:
+            category: 当日涨跌幅分类，如 range_1_3p
+            time_key: 第二天时间段，如 auction, 5min
+            time_period: 时间周期，如 y2
+            top_n: 返回数量
+            min_total: 最小样本数
+            industry: 行业过滤
+            market: 板块过滤，如 主板、创业板
+            min_circ_mv: 最小流通市值（万元）
+            max_circ_mv: 最大流通市值（万元）
+            boards: 只筛选这些分档规则下标对应板块的股票
+        """
+        self.ensure_loaded()
+        columns, groups, _ = self.snapshot()
+        group = groups.get((time_period, category, time_key))
+        if group is None:
+            return {'matched': 0, 'items': []}
+
+        mask = columns['total'][group] >= min_total
+        if industry:
+            mask &= columns['industry'][group] == industry
+        if market:
+            mask &= columns['market'][group] == market
+        if min_circ_mv is not None:
+            mask &= columns['circ_mv'][group] >= min_circ_mv
+        if max_circ_mv is not None:
+            mask &= columns['circ_mv'][group] <= max_circ_mv
+        if boards is not None:
+            mask &= np.isin(columns['board'][group], boards)
+
+        rows = np.flatnonzero(mask) + group.start
+        up_prob = columns['up_prob'][rows]
+        # argpartition 取前N，再只对这N行排序
+        if 0 < top_n < len(rows):
+            top = np.argpartition(-up_prob, top_n - 1)[:top_n]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.lexsort((-columns['total'][rows[top]], -up_prob[top]))]
+
+        return {'matched': int(len(rows)), 'items': self.rows_to_records(rows[top], columns)}
+
+    def snapshot(self) -> TableSnapshot:
+        """同一次重建的 (columns, groups, stock_rows)
+
+        在锁内读取，不会拿到一次重建的列和另一次重建的行号，多次查找应使用同一个快照
+        """
+        with self.lock:
+            return self.columns, self.groups, self.stock_rows
+
+    def lookup_rows(self, ts_code: str, time_period: Optional[str] = None, category: Optional[str] = None,
+                    snapshot: Optional[TableSnapshot] = None) -> np.ndarray:
+        """获取单只股票的行号，可按时间周期和涨跌幅分类过滤
+
+        Args:
+            snapshot: snapshot() 返回的快照，返回的行号对应该快照的columns，不指定则使用当前的表
+        """
+        columns, _, stock_rows = snapshot if snapshot is not None else self.snapshot()
+        rows = stock_rows.get(ts_code)
+        if rows is None:
+            return np.empty(0, dtype=np.int64)
+        if time_period is not None:
+            rows = rows[columns['time_period'][rows] == time_period]
+        if category is not None:
+            rows = rows[columns['category'][rows] == category]
+        return rows
+
+    def match_rows(self, ts_codes: np.ndarray, categories: np.ndarray, time_period: str,
+                   time_key: str, snapshot: Optional[TableSnapshot] = None) -> np.ndarray:
+        """批量查找每只股票在其涨跌幅分类、指定时间段下的行号，没有预计算结果时为-1
+
+        Args:
+            snapshot: snapshot() 返回的快照，返回的行号对应该快照的columns，不指定则使用当前的表
+        """
+        if snapshot is None:
+            self.ensure_loaded()
+            snapshot = self.snapshot()
+        ts_codes = np.asarray(ts_codes, dtype=object)
+        categories = np.asarray(categories, dtype=object)
+        columns, groups, _ = snapshot
+        rows = np.full(len(ts_codes), -1, dtype=np.int64)
+        for category in pd.unique(categories[pd.notna(categories)]):
+            group = groups.get((time_period, category, time_key))
+            if group is None:
+                continue
+            selected = np.flatnonzero(categories == category)
+            found = pd.Index(columns['ts_code'][group]).get_indexer(ts_codes[selected])
+            matched = found >= 0
+            rows[selected[matched]] = found[matched] + group.start
+        return rows
+
+    def get_stock_rows(self, ts_code: str) -> List[Dict[str, Any]]:
+        """获取单只股票的全部预计算结果"""
+        self.ensure_loaded()
+        columns, _, stock_rows = self.snapshot()
+        rows = stock_rows.get(ts_code)
+        if rows is None:
+            return []
+        return self.rows_to_records(rows, columns)
+
+
+# 进程内共享的概率表
+probability_table = ProbabilityTable()
+
+
+# 流通市值分档边界（万元），可通过 CAP_BANDS 配置，如 500000,1000000,1500000
+DEFAULT_CAP_BANDS = [50 * 10000, 100 * 10000, 150 * 10000]
+
+# 汇总维度
+ROLLUP_DIMENSIONS = ['industry', 'market', 'cap_band']
+
+
+def _format_cap(value: float) -> str:
+    return f"{value / 10000:g}亿"
+
+
+class RollupCube:
+    """按行业、板块、流通市值分档汇总的概率立方体
+
+    把每只股票每个 (时间周期, 涨跌幅分类, 时间段) 的概率还原成上涨、下跌、持平次数
+    （概率 × 样本数 / 100），按 (time_period, category, time_key, industry, market, cap_band)
+    累加成最细粒度的立方体。查询时在立方体上按需要的维度再汇总，用合并后的次数计算概率，
+    样本少的小市值股票也能得到稳定的组合概率。概率表重建后首次查询时重建立方体。
+    """
+
+    def __init__(self, table: ProbabilityTable, cap_bands: Optional[List[float]] = None):
+        self.table = table
+        if cap_bands is None:
+            env_bands = os.getenv('CAP_BANDS')
+            cap_bands = [float(v) for v in env_bands.split(',')] if env_bands else DEFAULT_CAP_BANDS
+        self.cap_bands = sorted(cap_bands)
+        self.cap_labels = self._cap_labels()
+        self.lock = threading.Lock()
+        self.version = -1
+        self.cube = pd.DataFrame()
+
+    def _cap_labels(self) -> List[str]:
+        edges = self.cap_bands
+        labels = [f"<{_format_cap(edges[0])}"] if edges else []
+        labels += [f"{_format_cap(lo)}-{_format_cap(hi)}" for lo, hi in zip(edges[:-1], edges[1:])]
+        labels += [f">={_format_cap(edges[-1])}"] if edges else ['全部']
+        return labels
+
+    def cap_band(self, circ_mv: np.ndarray) -> np.ndarray:
+        """流通市值分档，没有市值数据的为 未知"""
+        index = np.searchsorted(self.cap_bands, circ_mv, side='right')
+        labels = np.array(self.cap_labels, dtype=object)[np.minimum(index, len(self.cap_labels) - 1)]
+        return np.where(np.isnan(circ_mv), '未知', labels)
+
+    def ensure_built(self) -> None:
+        self.table.ensure_loaded()
+        if self.version == self.table.version:
+            return
+        with self.lock:
+            if self.version != self.table.version:
+                version = self.table.version
+                self._build(self.table.columns)
+                self.version = version
+
+    def _build(self, columns: Dict[str, np.ndarray]) -> None:
+        start_time = time.time()
+        if not columns:
+            self.cube = pd.DataFrame()
+            return
+        total = columns['total'].astype(np.int64)
+        frame = pd.DataFrame({
+            'time_period': columns['time_period'],
+            'category': columns['category'],
+            'time_key': columns['time_key'],
+            'industry': np.where(columns['industry'] == '', '未知', columns['industry']),
+            'market': np.where(columns['market'] == '', '未知', columns['market']),
+            'cap_band': self.cap_band(columns['circ_mv'].astype(np.float64)),
+            'stocks': (total > 0).astype(np.int64),
+            'total': total,
+            'up': np.rint(columns['up_prob'] * total / 100).astype(np.int64),
+            'down': np.rint(columns['down_prob'] * total / 100).astype(np.int64),
+            'equal': np.rint(columns['equal_prob'] * total / 100).astype(np.int64),
+            # 按样本数加权的收盘涨幅，汇总后除以样本数得到加权平均
+            'close_pct_sum': columns['close_pct'].astype(np.float64) * total,
+        })
+        # 板块分档规则下标不对外汇总，只用于确定涨跌幅在筛选范围内对应的分类
+        frame['board'] = columns['board']
+        keys = ['time_period', 'category', 'time_key'] + ROLLUP_DIMENSIONS + ['board']
+        self.cube = frame.groupby(keys, sort=False, observed=True).sum().reset_index()
+        logger.info("概率汇总立方体重建完成，共%s个单元格，耗时: %.3f秒", len(self.cube), time.time() - start_time)
+
+    def boards(self, time_period: str, industry: Optional[str] = None, market: Optional[str] = None,
+               cap_band: Optional[str] = None) -> List[int]:
+        """筛选范围内的股票用到的板块分档规则下标"""
+        self.ensure_built()
+        cube = self.cube
+        if cube.empty:
+            return []
+        mask = cube['time_period'] == time_period
+        for column, value in (('industry', industry), ('market', market), ('cap_band', cap_band)):
+            if value is not None:
+                mask &= cube[column] == value
+        return sorted(int(board) for board in cube.loc[mask, 'board'].unique())
+
+    def query(self, time_period: str, group_by: List[str], category: Optional[str] = None,
+              time_key: Optional[str] = None, industry: Optional[str] = None, market: Optional[str] = None,
+              cap_band: Optional[str] = None, min_total: int = 0) -> List[Dict[str, Any]]:
+        """按维度汇总概率
+
+        Args:
+            time_period: 时间周期
+            group_by: 汇总维度，industry、market、cap_band 的子集，为空时汇总成一组
+            category: 当日涨跌幅分类，不指定则按分类分组
+            time_key: 第二天时间段，不指定则按时间段分组
+            industry / market / cap_band: 只汇总该行业、板块、市值分档
+            min_total: 最小样本数
+        """
+        self.ensure_built()
+        cube = self.cube
+        if cube.empty:
+            return []
+        mask = cube['time_period'] == time_period
+        for column, value in (('category', category), ('time_key', time_key), ('industry', industry),
+                              ('market', market), ('cap_band', cap_band)):
+            if value is not None:
+                mask &= cube[column] == value
+        cube = cube[mask]
+        if cube.empty:
+            return []
+
+        keys = [key for key, value in (('category', category), ('time_key', time_key)) if value is None]
+        keys += [dim for dim in ROLLUP_DIMENSIONS if dim in group_by]
+        sums = ['stocks', 'total', 'up', 'down', 'equal', 'close_pct_sum']
+        if keys:
+            grouped = cube.groupby(keys, sort=False, observed=True)[sums].sum().reset_index()
+        else:
+            grouped = cube[sums].sum().to_frame().T
+        grouped = grouped[grouped['total'] >= max(min_total, 1)]
+
+        total = grouped['total'].to_numpy(dtype=np.float64)
+        records = []
+        up_prob = np.round(grouped['up'].to_numpy() / total * 100, 2)
+        down_prob = np.round(grouped['down'].to_numpy() / total * 100, 2)
+        equal_prob = np.round(grouped['equal'].to_numpy() / total * 100, 2)
+        close_pct = np.round(grouped['close_pct_sum'].to_numpy() / total, 2)
+        for i in range(len(grouped)):
+            row = {key: grouped[key].iat[i] for key in keys}
+            for column in ('stocks', 'total', 'up', 'down', 'equal'):
+                row[column] = int(grouped[column].iat[i])
+            row.update({
+                'time_period': time_period,
+                'up_prob': float(up_prob[i]),
+                'down_prob': float(down_prob[i]),
+                'equal_prob': float(equal_prob[i]),
+                'close_pct': float(close_pct[i]),
+            })
+            records.append(row)
+        records.sort(key=lambda record: (-record['up_prob'], -record['total']))
+        return records
+
+
+# 进程内共享的汇总立方体
+rollup_cube = RollupCube(probability_table)
+
+
+# 股票概率画像使用的特征
+PROFILE_FEATURES = ['up_prob', 'down_prob', 'close_pct']
+
+
+class ProfileIndex:
+    """股票概率画像的相似度索引
+
+    每只股票在一个时间周期下的画像是 (涨跌幅分类 × 时间段 × 特征) 的定长向量。
+    各维度按全市场标准化（缺失的维度记为均值），再按行归一化成 float32 矩阵，
+    余弦相似度就是一次矩阵乘法，argpartition 取前k个。
+    概率文件变化时只重新计算变化文件的画像，标准化和归一化在全部画像上重做（只需几毫秒）。
+    """
+
+    def __init__(self, table: ProbabilityTable):
+        self.table = table
+        self.lock = threading.Lock()
+        self.version = -1
+        self.dimensions: List[Tuple[str, str]] = [
+            (category, time_key) for category in PCT_BUCKETS.keys() for time_key in TIME_FREQ_MAP
+        ]
+        self.dimension_index = {dimension: i for i, dimension in enumerate(self.dimensions)}
+        # 文件路径 -> (mtime, ts_code, time_period, 原始画像 [维度, 特征]，缺失为NaN)
+        self.profiles: Dict[str, Tuple[float, str, str, np.ndarray]] = {}
+        # 时间周期 -> (股票代码, 归一化后的画像矩阵, 每只股票有数据的维度数)
+        self.matrices: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    def _profile(self, frame: pd.DataFrame) -> np.ndarray:
+        """单个概率文件的原始画像"""
+        profile = np.full((len(self.dimensions), len(PROFILE_FEATURES)), np.nan, dtype=np.float32)
+        frame = frame[frame['total'] > 0]
+        index = np.array([self.dimension_index.get(key, -1) for key in zip(frame['category'], frame['time_key'])],
+                         dtype=np.int64)
+        found = index >= 0
+        profile[index[found]] = frame[PROFILE_FEATURES].to_numpy(dtype=np.float32)[found]
+        return profile
+
+    def ensure_built(self) -> None:
+        self.table.ensure_loaded()
+        if self.version == self.table.version:
+            return
+        with self.lock:
+            if self.version == self.table.version:
+                return
+            with self.table.lock:
+                version = self.table.version
+                file_frames = dict(self.table.file_frames)
+            self._update(file_frames)
+            self.version = version
+
+    def _update(self, file_frames: Dict[str, Tuple[float, pd.DataFrame]]) -> None:
+        start_time = time.time()
+        changed = 0
+        for file_path, (mtime, frame) in file_frames.items():
+            cached = self.profiles.get(file_path)
+            if cached and cached[0] == mtime:
+                continue
+            if frame.empty:
+                self.profiles.pop(file_path, None)
+                continue
+            self.profiles[file_path] = (mtime, frame['ts_code'].iat[0], frame['time_period'].iat[0], self._profile(frame))
+            changed += 1
+        for file_path in set(self.profiles) - set(file_frames):
+            del self.profiles[file_path]
+            changed += 1
+
+        by_period: Dict[str, List[Tuple[str, np.ndarray]]] = {}
+        for _, ts_code, time_period, profile in self.profiles.values():
+            by_period.setdefault(time_period, []).append((ts_code, profile))
+        matrices = {}
+        for time_period, items in by_period.items():
+            items.sort(key=lambda item: item[0])
+            raw = np.stack([profile for _, profile in items]).reshape(len(items), -1)
+            present = ~np.isnan(raw)
+            filled = np.where(present, raw, 0).astype(np.float64)
+            counts = np.maximum(present.sum(axis=0), 1)
+            mean = filled.sum(axis=0) / counts
+            std = np.sqrt(np.maximum(np.square(filled).sum(axis=0) / counts - mean * mean, 0))
+            scaled = np.where(present, (filled - mean) / np.where(std > 0, std, 1), 0).astype(np.float32)
+            norms = np.linalg.norm(scaled, axis=1, keepdims=True)
+            matrix = scaled / np.where(norms > 0, norms, 1)
+            coverage = present.reshape(len(items), len(self.dimensions), -1).any(axis=2).sum(axis=1)
+            matrices[time_period] = (np.array([ts_code for ts_code, _ in items], dtype=object), matrix, coverage)
+        self.matrices = matrices
+        logger.info("相似股票索引更新完成，重新计算%s个画像，共%s个时间周期，耗时: %.3f秒",
+                    changed, len(matrices), time.time() - start_time)
+
+    def similar(self, ts_codes: List[str], time_period: str, k: int = 10,
+                min_coverage: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+        """批量查找画像最相似的k只股票
+
+        Args:
+            ts_codes: 查询的股票，没有画像的股票不在返回结果中
+            time_period: 时间周期
+            k: 每只股票返回的数量
+            min_coverage: 候选股票至少有数据的 (分类, 时间段) 数
+        """
+        self.ensure_built()
+        entry = self.matrices.get(time_period)
+        if entry is None:
+            return {}
+        codes, matrix, coverage = entry
+        positions = pd.Index(codes).get_indexer(ts_codes)
+        query = positions[positions >= 0]
+        if not len(query):
+            return {}
+        scores = matrix[query] @ matrix.T
+        scores[:, coverage < min_coverage] = -np.inf
+        scores[np.arange(len(query)), query] = -np.inf
+        k = max(0, min(k, len(codes) - 1))
+        result = {}
+        for i, position in enumerate(query):
+            row = scores[i]
+            top = np.argpartition(-row, k - 1)[:k] if 0 < k < len(row) else np.arange(len(row))
+            top = top[np.argsort(-row[top], kind='stable')]
+            result[codes[position]] = [
+                {'ts_code': codes[j], 'similarity': round(float(row[j]), 4), 'coverage': int(coverage[j])}
+                for j in top if np.isfinite(row[j])
+            ]
+        return result
+
+
+# 进程内共享的相似股票索引
+profile_index = ProfileIndex(probability_table)
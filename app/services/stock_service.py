@@ -1,62 +1,83 @@
 import os
 import pandas as pd
-from typing import Dict, List, Any, Optional
-import logging
+from typing import Dict, List, Any, Optional, Sequence
+from app.utils.logger import setup_logger, ProgressLogger
 from app.utils.tushare_utils import (
-    get_stock_list, filter_stocks, analyze_stock,
+    analyze_stock,
     TIME_PERIOD_MAP, LIST_RANGE_MAP, TIME_FREQ_MAP
 )
+from app.utils.run_journal import RunJournal
+from app.utils.tushare_client import request_priority
+from app.utils.pct_stats import DISTRIBUTION_FIELDS
+from app.services.universe_store import universe_store
 import datetime
+import time
+import concurrent.futures
 
 # 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+logger = setup_logger(__name__)
 
 class StockService:
     """股票服务类"""
     
+    # 最近交易日股票池内存缓存: (检查时间, 股票列表, ts_code -> 股票)
+    _universe_cache: Optional[tuple] = None
+    # 股票池缓存有效期（秒），过期后检查是否有新交易日的快照
+    UNIVERSE_CHECK_INTERVAL = float(os.getenv('UNIVERSE_CHECK_INTERVAL', '60'))
+    
     @staticmethod
-    def get_filtered_stocks() -> List[Dict[str, Any]]:
-        """获取过滤后的股票列表"""
+    def get_filtered_stocks(trade_date: Optional[str] = None) -> List[Dict[str, Any]]:
+        """获取过滤后的股票列表
+        
+        Args:
+            trade_date: 交易日，不指定则返回最近交易日的股票池
+        """
         try:
-            # 检查本地是否已有缓存
-            data_dir = os.getenv('DATA_DIR', './data')
-            cache_file = os.path.join(data_dir, 'filtered_stocks.csv')
-            
-            if os.path.exists(cache_file):
-                # 读取缓存
-                df = pd.read_csv(cache_file, encoding='utf-8-sig')
-                return df.to_dict('records')
+            if trade_date:
+                return universe_store.get_universe(trade_date).to_dict('records')
             
-            # 获取所有股票
-            stocks = get_stock_list()
+            cached = StockService._universe_cache
+            if cached and time.time() - cached[0] < StockService.UNIVERSE_CHECK_INTERVAL:
+                return cached[1]
             
-            if stocks.empty:
-                return []
-            
-            # 过滤股票
-            filtered_stocks = filter_stocks(stocks)
-            
-            if filtered_stocks.empty:
-                return []
-            
-            # 保存到缓存
-            os.makedirs(data_dir, exist_ok=True)
-            filtered_stocks.to_csv(cache_file, index=False, encoding='utf-8-sig')
-            
-            return filtered_stocks.to_dict('records')
+            # 最近交易日的快照不存在时会生成，每天只需一次接口请求
+            stocks = universe_store.get_universe().to_dict('records')
+            if stocks:
+                StockService._universe_cache = (time.time(), stocks, {stock['ts_code']: stock for stock in stocks})
+            return stocks
         except Exception as e:
             logger.error(f"获取过滤后的股票列表失败: {e}")
             return []
     
     @staticmethod
-    def get_stock_probability(ts_code: str) -> Dict[str, Any]:
-        """获取股票涨跌概率"""
+    def get_stock_index() -> Dict[str, Dict[str, Any]]:
+        """获取股票池索引 ts_code -> 股票信息"""
+        stocks = StockService.get_filtered_stocks()
+        cached = StockService._universe_cache
+        if cached and cached[1] is stocks:
+            return cached[2]
+        return {stock['ts_code']: stock for stock in stocks}
+    
+    @staticmethod
+    def get_stock_probability(ts_code: str, journal: Optional[RunJournal] = None,
+                              reuse_existing: bool = False, horizon: int = 1,
+                              progress: Optional[ProgressLogger] = None) -> Dict[str, Any]:
+        """获取股票涨跌概率
+        
+        Args:
+            ts_code: 股票代码
+            journal: 全量刷新任务日志，用于记录和补拉缺口
+            reuse_existing: 是否直接复用已有的分析结果
+            horizon: 间隔交易日，返回 T+horizon 的概率，1为第二天
+            progress: 批量获取时循环的进度日志限流器
+        """
         try:
             # 先通过ts_code获取股票名称 
             stock_info = StockService.get_stock_info(ts_code)
             # 分析股票
-            result = analyze_stock(ts_code, stock_info['name'], stock_info['circ_mv'])
+            result = analyze_stock(ts_code, stock_info['name'], stock_info['circ_mv'],
+                                   journal=journal, reuse_existing=reuse_existing, horizon=horizon,
+                                   progress=progress)
             
             if "error" in result:
                 return {"error": result["error"]}
@@ -89,6 +110,7 @@ class StockService:
                             "max_pct": prob_data.get("max_pct", 0),
                             "min_pct": prob_data.get("min_pct", 0),
                             "close_pct": prob_data.get("close_pct", 0),
+                            **{field: prob_data.get(field, 0) for field in DISTRIBUTION_FIELDS},
                             "desc": {
                                 'up_prob': "上涨概率",
                                 'down_prob': "下跌概率",
@@ -98,6 +120,7 @@ class StockService:
                                 'max_pct': "最大涨幅",
                                 'min_pct': "最小涨幅",
                                 'close_pct': "收盘涨幅",
+                                **DISTRIBUTION_FIELDS,
                             }
                         }
             
@@ -106,12 +129,37 @@ class StockService:
             logger.error(f"获取股票{ts_code}涨跌概率失败: {e}")
             return {"error": str(e)}
     
+    @staticmethod
+    def project_probability(result: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+        """只保留每个时间段的指定概率字段（如 up_prob,total），time_name 总是保留
+        
+        Args:
+            result: get_stock_probability 格式化后的结果 {时间周期: {categories: {分类: {time_periods: ...}}}}
+            fields: 字段列表，为None时原样返回
+        """
+        if fields is None:
+            return result
+        selected = list(dict.fromkeys(['time_name', *fields]))
+        projected = {}
+        for time_period, period_data in result.items():
+            categories = {}
+            for category, category_data in period_data.get("categories", {}).items():
+                categories[category] = {
+                    "category_name": category_data.get("category_name"),
+                    "time_periods": {
+                        time_key: {field: prob_data[field] for field in selected if field in prob_data}
+                        for time_key, prob_data in category_data.get("time_periods", {}).items()
+                    }
+                }
+            projected[time_period] = {"period_name": period_data.get("period_name"), "categories": categories}
+        return projected
+    
     @staticmethod
     def get_stock_info(ts_code: str) -> Dict[str, Any]:
         """获取股票基本信息"""
         try:
             # 首先尝试从过滤后的股票列表中查找
-            stocks = StockService.get_filtered_stocks()
+            stock_index = StockService.get_stock_index()
             """
             名称	类型	描述
             ts_code	str	TS股票代码
@@ -134,35 +182,35 @@ class StockService:
             circ_mv	float	流通市值（万元）
             """
             # 查找指定股票
-            for stock in stocks:
-                if stock['ts_code'] == ts_code:
-                    return {
-                        "ts_code": stock['ts_code'],
-                        "name": stock['name'],
-                        "industry": stock.get('industry', ''),
-                        "market": stock.get('market', ''),
-                        "total_mv": stock.get('total_mv', 0),
-                        "circ_mv": stock.get('circ_mv', 0),
-                        "trade_date": stock.get('trade_date', ''),
-                        "close": stock.get('close', 0),
-                        "turnover_rate": stock.get('turnover_rate', 0),
-                        "turnover_rate_f": stock.get('turnover_rate_f', 0),
-                        "volume_ratio": stock.get('volume_ratio', 0),
-                        "pe": stock.get('pe', 0),
-                        "pe_ttm": stock.get('pe_ttm', 0),
-                        "pb": stock.get('pb', 0),
-                        "ps": stock.get('ps', 0),
-                        "ps_ttm": stock.get('ps_ttm', 0),
-                        "dv_ratio": stock.get('dv_ratio', 0),
-                        "dv_ttm": stock.get('dv_ttm', 0),
-                        
+            stock = stock_index.get(ts_code)
+            if stock:
+                return {
+                    "ts_code": stock['ts_code'],
+                    "name": stock['name'],
+                    "industry": stock.get('industry', ''),
+                    "market": stock.get('market', ''),
+                    "total_mv": stock.get('total_mv', 0),
+                    "circ_mv": stock.get('circ_mv', 0),
+                    "trade_date": stock.get('trade_date', ''),
+                    "close": stock.get('close', 0),
+                    "turnover_rate": stock.get('turnover_rate', 0),
+                    "turnover_rate_f": stock.get('turnover_rate_f', 0),
+                    "volume_ratio": stock.get('volume_ratio', 0),
+                    "pe": stock.get('pe', 0),
+                    "pe_ttm": stock.get('pe_ttm', 0),
+                    "pb": stock.get('pb', 0),
+                    "ps": stock.get('ps', 0),
+                    "ps_ttm": stock.get('ps_ttm', 0),
+                    "dv_ratio": stock.get('dv_ratio', 0),
+                    "dv_ttm": stock.get('dv_ttm', 0),
+                    
 
-                    }
+                }
             
             # 如果在过滤后的列表中找不到，直接从Tushare获取
             logger.info(f"在过滤后的列表中未找到股票{ts_code}，尝试直接从Tushare获取")
             try:
-                from app.utils.tushare_utils import pro
+                from app.utils.tushare_utils import pro, get_latest_trade_date
                 
                 # 获取股票基本信息
                 stock_info = pro.stock_basic(ts_code=ts_code, fields='ts_code,symbol,name,area,industry,market,list_date')
@@ -175,8 +223,7 @@ class StockService:
                 # 尝试获取市值信息
                 try:
                     # 获取最新交易日期
-                    latest_trade_date = pro.trade_cal(exchange='', end_date=datetime.datetime.now().strftime('%Y%m%d'), 
-                                                    is_open='1')['cal_date'].iloc[-1]
+                    latest_trade_date = get_latest_trade_date()
                     
                     # 获取市值数据
                     mv_data = pro.daily_basic(ts_code=ts_code, trade_date=latest_trade_date, 
@@ -215,11 +262,19 @@ class StockService:
             return {"error": str(e)}
     
     @staticmethod
-    def get_all_stocks_probability(time_period: Optional[str] = None) -> Dict[str, Any]:
+    def get_all_stocks_probability(time_period: Optional[str] = None, resume: bool = True,
+                                   run_id: Optional[str] = None,
+                                   ts_codes: Optional[List[str]] = None) -> Dict[str, Any]:
         """获取所有股票的涨跌概率
         
+        刷新进度和请求失败的缺口记录在任务日志中，进程中断后重新调用会从断点继续，
+        已完成的股票直接复用结果，有缺口的股票只补拉缺口数据。
+        
         Args:
             time_period: 时间周期，如m1, m3, m6, y1等，不指定则返回所有时间周期
+            resume: 是否从同一个任务日志的断点继续，为False时开始新的任务日志
+            run_id: 任务日志ID，默认按日期生成，同一天的刷新共用一个任务日志
+            ts_codes: 只获取股票池中的这些股票（如分页时的一页），不指定则获取全部
         
         Returns:
             包含所有股票概率数据的字典
@@ -230,39 +285,60 @@ class StockService:
             
             if not stocks:
                 return {"error": "获取股票列表失败"}
+            if ts_codes is not None:
+                selected = set(ts_codes)
+                stocks = [stock for stock in stocks if stock['ts_code'] in selected]
+            
+            if not resume:
+                run_id = run_id or f"refresh_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            journal = RunJournal(run_id)
             
             # 存储所有股票的概率数据
             all_probabilities = {}
             total_stocks = len(stocks)
             
-            logger.info("开始获取%s只股票的涨跌概率数据", total_stocks)
+            logger.info("开始获取%s只股票的涨跌概率数据，任务日志: %s", total_stocks, journal.run_id)
+            # 逐只股票的进度日志限流输出
+            progress = ProgressLogger(logger)
             
-            # 遍历所有股票，获取概率数据
-            for i, stock in enumerate(stocks):
-                ts_code = stock['ts_code']
-                stock_name = stock['name']
+            # 全量刷新以后台批量优先级请求接口，交互请求优先
+            with request_priority('bulk'):
+                # 遍历所有股票，获取概率数据
+                for i, stock in enumerate(stocks):
+                    ts_code = stock['ts_code']
+                    stock_name = stock['name']
                 
-                logger.info(f"==========正在处理第{i+1}/{total_stocks}只股票: {ts_code} {stock_name}==========")
+                    # 已完成且没有缺口的股票直接复用结果
+                    resumed = journal.is_done(ts_code) and not journal.gaps_for(ts_code)
+                    if not resumed:
+                        progress.info("==========正在处理第%s/%s只股票: %s %s==========", i + 1, total_stocks, ts_code, stock_name)
                 
-                # 获取股票概率数据
-                result = StockService.get_stock_probability(ts_code)
+                    # 获取股票概率数据
+                    result = StockService.get_stock_probability(ts_code, journal=journal, reuse_existing=resumed,
+                                                                progress=progress)
                 
-                if "error" not in result:
-                    # 如果指定了时间周期，只保存该时间周期的数据
-                    if time_period and time_period in result:
-                        all_probabilities[ts_code] = {
-                            "name": stock_name,
-                            "data": {time_period: result[time_period]}
-                        }
+                    if "error" not in result:
+                        if not resumed:
+                            journal.mark_done(ts_code)
+                        # 如果指定了时间周期，只保存该时间周期的数据
+                        if time_period and time_period in result:
+                            all_probabilities[ts_code] = {
+                                "name": stock_name,
+                                "data": {time_period: result[time_period]}
+                            }
+                        else:
+                            all_probabilities[ts_code] = {
+                                "name": stock_name,
+                                "data": result
+                            }
                     else:
-                        all_probabilities[ts_code] = {
-                            "name": stock_name,
-                            "data": result
-                        }
-                else:
-                    logger.warning(f"获取股票{ts_code} {stock_name}的概率数据失败: {result['error']}")
+                        logger.warning(f"获取股票{ts_code} {stock_name}的概率数据失败: {result['error']}")
             
-            logger.info(f"==========成功获取{len(all_probabilities)}/{total_stocks}只股票的涨跌概率数据==========")
+            progress.info("==========成功获取%s/%s只股票的涨跌概率数据==========", len(all_probabilities), total_stocks,
+                          force=True)
+            summary = journal.summary()
+            if summary['gaps']:
+                logger.warning(f"任务日志{journal.run_id}中{summary['stocks_with_gaps']}只股票还有{summary['gaps']}个缺口，重新调用会补拉缺口")
             
             return all_probabilities
         except Exception as e:
@@ -270,12 +346,13 @@ class StockService:
             return {"error": str(e)}
     
     @staticmethod
-    def get_stock_probability_by_pct(ts_code: str, pct_chg: float) -> Dict[str, Any]:
+    def get_stock_probability_by_pct(ts_code: str, pct_chg: float, horizon: int = 1) -> Dict[str, Any]:
         """获取特定股票在特定涨幅范围内的平均概率
         
         Args:
             ts_code: 股票代码
             pct_chg: 涨跌幅百分比
+            horizon: 间隔交易日，1为第二天
             
         Returns:
             平均概率数据
@@ -284,19 +361,20 @@ class StockService:
             from app.utils.tushare_utils import get_stock_probability_by_pct, categorize_pct_change
             
             # 获取概率数据
-            result = get_stock_probability_by_pct(ts_code, pct_chg)
+            result = get_stock_probability_by_pct(ts_code, pct_chg, horizon)
             
             if not result:
                 return {"error": f"未找到股票{ts_code}在涨幅{pct_chg}下的概率数据"}
             
             # 获取涨跌幅分类
-            category = categorize_pct_change(pct_chg)
+            category = categorize_pct_change(pct_chg, ts_code)
             display_range = LIST_RANGE_MAP.get(category, category)
             
             # 格式化结果
             formatted_result = {
                 "ts_code": ts_code,
                 "pct_chg": pct_chg,
+                "horizon": horizon,
                 "category": category,
                 "display_range": display_range,
                 "up_prob": result.get("up_prob", 0),
@@ -311,4 +389,386 @@ class StockService:
             return formatted_result
         except Exception as e:
             logger.error(f"获取股票{ts_code}在涨幅{pct_chg}下的平均概率失败: {e}")
-            return {"error": str(e)}
\ No newline at end of file
+            return {"error": str(e)}
+    
+    @staticmethod
+    def screen_stocks(time_key: str, category: Optional[str] = None, pct_chg: Optional[float] = None,
+                      time_period: Optional[str] = None, top_n: int = 20, min_total: int = 0,
+                      industry: Optional[str] = None, market: Optional[str] = None,
+                      min_circ_mv: Optional[float] = None, max_circ_mv: Optional[float] = None) -> Dict[str, Any]:
+        """按预计算的概率筛选股票
+        
+        Args:
+            time_key: 第二天时间段，如 auction, 5min
+            category: 当日涨跌幅分类，与pct_chg二选一
+            pct_chg: 当日涨跌幅百分比，用于确定分类
+            time_period: 时间周期，不指定则使用第一个启用的时间周期
+            top_n: 返回数量
+            min_total: 最小样本数
+            
+        Returns:
+            按上涨概率降序排列的股票列表
+        """
+        try:
+            from app.utils.tushare_utils import PCT_BUCKETS
+            from app.services.probability_store import probability_table
+            
+            if time_key not in TIME_FREQ_MAP:
+                return {"error": f"不支持的时间段: {time_key}"}
+            if time_period is None:
+                time_period = next(iter(TIME_PERIOD_MAP))
+            
+            # 指定涨幅时，不同板块的涨停规则不同，分档可能不同，按板块分别筛选后合并
+            if category is not None:
+                board_categories = {category: None}
+            elif pct_chg is not None:
+                board_categories = PCT_BUCKETS.categorize_boards(pct_chg)
+                if len(board_categories) == 1:
+                    board_categories = {key: None for key in board_categories}
+            else:
+                return {"error": "category和pct_chg必须指定一个"}
+            
+            result = {"matched": 0, "items": []}
+            for board_category, boards in board_categories.items():
+                board_result = probability_table.screen(
+                    board_category, time_key, time_period, top_n=top_n, min_total=min_total,
+                    industry=industry, market=market, min_circ_mv=min_circ_mv, max_circ_mv=max_circ_mv,
+                    boards=boards
+                )
+                result["matched"] += board_result["matched"]
+                result["items"].extend(board_result["items"])
+            if len(board_categories) > 1:
+                result["items"].sort(key=lambda item: (-item["up_prob"], -item["total"]))
+                result["items"] = result["items"][:top_n]
+            category = next(iter(board_categories)) if len(board_categories) == 1 else ",".join(board_categories)
+            result.update({
+                "time_period": time_period,
+                "category": category,
+                "display_range": LIST_RANGE_MAP.get(category, category),
+                "time_key": time_key,
+            })
+            return result
+        except Exception as e:
+            logger.error(f"筛选股票失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def _board_category(pct_chg: float, boards: Optional[Sequence[int]] = None) -> Optional[str]:
+        """涨跌幅在这些板块规则下的分类，各板块分类不同时返回None"""
+        from app.utils.tushare_utils import PCT_BUCKETS
+        
+        board_categories = PCT_BUCKETS.categorize_boards(pct_chg, boards)
+        if len(board_categories) == 1:
+            return next(iter(board_categories))
+        # 筛选范围内没有股票时，所有板块分类相同才使用
+        if not board_categories:
+            return StockService._board_category(pct_chg)
+        return None
+    
+    @staticmethod
+    def get_rollup(group_by: List[str], time_period: Optional[str] = None, category: Optional[str] = None,
+                   pct_chg: Optional[float] = None, time_key: Optional[str] = None,
+                   industry: Optional[str] = None, market: Optional[str] = None,
+                   cap_band: Optional[str] = None, min_total: int = 0) -> Dict[str, Any]:
+        """按行业、板块、流通市值分档汇总的概率
+        
+        Args:
+            group_by: 汇总维度，industry、market、cap_band 的子集
+            pct_chg: 当日涨跌幅百分比，按筛选范围内股票所属板块的分档规则确定分类，与category二选一，
+                各板块分类不同时需指定category
+        """
+        try:
+            from app.services.probability_store import rollup_cube, ROLLUP_DIMENSIONS
+            
+            unknown = [dim for dim in group_by if dim not in ROLLUP_DIMENSIONS]
+            if unknown:
+                return {"error": f"不支持的汇总维度: {','.join(unknown)}"}
+            if time_key is not None and time_key not in TIME_FREQ_MAP:
+                return {"error": f"不支持的时间段: {time_key}"}
+            if time_period is None:
+                time_period = next(iter(TIME_PERIOD_MAP))
+            if category is None and pct_chg is not None:
+                boards = rollup_cube.boards(time_period, industry=industry, market=market, cap_band=cap_band)
+                category = StockService._board_category(pct_chg, boards)
+                if category is None:
+                    return {"error": f"涨跌幅{pct_chg}%在筛选范围内不同板块的分类不同，请指定category"}
+            
+            items = rollup_cube.query(time_period, group_by, category=category, time_key=time_key,
+                                      industry=industry, market=market, cap_band=cap_band, min_total=min_total)
+            for item in items:
+                item_category = item.get("category", category)
+                item["category"] = item_category
+                item["display_range"] = LIST_RANGE_MAP.get(item_category, item_category)
+                item["time_key"] = item.get("time_key", time_key)
+            return {
+                "time_period": time_period,
+                "group_by": group_by,
+                "cap_bands": rollup_cube.cap_labels,
+                "items": items,
+            }
+        except Exception as e:
+            logger.error(f"汇总概率失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def get_pct_distribution(time_period: Optional[str] = None, category: Optional[str] = None,
+                             pct_chg: Optional[float] = None, time_key: Optional[str] = None,
+                             ts_codes: Optional[List[str]] = None) -> Dict[str, Any]:
+        """合并多只股票的涨跌幅分布统计，得到均值、标准差和分位数
+        
+        Args:
+            pct_chg: 当日涨跌幅百分比，按合并的股票所属板块的分档规则确定分类，与category二选一，
+                各板块分类不同时需指定category
+            ts_codes: 只合并这些股票，不指定则合并所有已分析的股票
+        """
+        try:
+            from app.utils.pct_stats import merge_stats_files
+            from app.utils.tushare_utils import PCT_BUCKETS
+            
+            if time_key is not None and time_key not in TIME_FREQ_MAP:
+                return {"error": f"不支持的时间段: {time_key}"}
+            if time_period is None:
+                time_period = next(iter(TIME_PERIOD_MAP))
+            if category is None and pct_chg is not None:
+                boards = PCT_BUCKETS.board_index(ts_codes) if ts_codes else None
+                category = StockService._board_category(pct_chg, boards)
+                if category is None:
+                    return {"error": f"涨跌幅{pct_chg}%在不同板块的分类不同，请指定category或只合并同一板块的股票"}
+            
+            merged, stocks = merge_stats_files(time_period, ts_codes)
+            category_order = {key: i for i, key in enumerate(PCT_BUCKETS.keys())}
+            time_order = {key: i for i, key in enumerate(TIME_FREQ_MAP)}
+            items = []
+            for (item_category, item_time_key), stats in merged.cells.items():
+                if (category is not None and item_category != category) or \
+                        (time_key is not None and item_time_key != time_key):
+                    continue
+                items.append({
+                    "category": item_category,
+                    "display_range": LIST_RANGE_MAP.get(item_category, item_category),
+                    "time_key": item_time_key,
+                    "time_name": TIME_FREQ_MAP.get(item_time_key, item_time_key),
+                    **stats.summary(),
+                })
+            items.sort(key=lambda item: (category_order.get(item["category"], len(category_order)),
+                                         time_order.get(item["time_key"], len(time_order))))
+            return {
+                "time_period": time_period,
+                "stocks": stocks,
+                "items": items,
+            }
+        except Exception as e:
+            logger.error(f"合并涨跌幅分布失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def get_similar_stocks(ts_code: str, time_period: Optional[str] = None, k: int = 10,
+                           min_coverage: int = 0) -> Dict[str, Any]:
+        """查找涨跌概率画像最相似的股票
+        
+        画像由各涨跌幅分类、各时间段的涨概率、跌概率和收盘涨幅组成，按余弦相似度排序
+        
+        Args:
+            ts_code: 股票代码
+            time_period: 时间周期，不指定则使用第一个时间周期
+            k: 返回的股票数量
+            min_coverage: 候选股票至少有数据的 (涨跌幅分类, 时间段) 数
+        """
+        try:
+            from app.services.probability_store import profile_index
+            
+            if time_period is None:
+                time_period = next(iter(TIME_PERIOD_MAP))
+            if time_period not in TIME_PERIOD_MAP:
+                return {"error": f"不支持的时间周期: {time_period}"}
+            
+            similar = profile_index.similar([ts_code], time_period, k=k, min_coverage=min_coverage)
+            if ts_code not in similar:
+                return {"error": f"股票{ts_code}没有{time_period}的概率结果"}
+            
+            stock_index = StockService.get_stock_index()
+            items = []
+            for item in similar[ts_code]:
+                stock = stock_index.get(item["ts_code"], {})
+                items.append({
+                    **item,
+                    "name": stock.get("name", ""),
+                    "industry": stock.get("industry", ""),
+                    "market": stock.get("market", ""),
+                })
+            return {
+                "ts_code": ts_code,
+                "time_period": time_period,
+                "dimensions": len(profile_index.dimensions),
+                "items": items,
+            }
+        except Exception as e:
+            logger.error(f"查找相似股票失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def get_batch_probability(items: List[Dict[str, Any]], time_period: Optional[str] = None,
+                              fetch_missing: bool = True) -> List[Dict[str, Any]]:
+        """批量获取多只股票的涨跌概率
+        
+        先从内存概率表中一次性查找所有股票，没有预计算结果的股票并发分析，
+        分析过程共用竞价和分钟数据接口的请求限制器。
+        
+        Args:
+            items: [{"ts_code": "000001.SZ", "pct_chg": 4.75}, ...]，pct_chg可选
+            time_period: 时间周期，不指定则使用第一个启用的时间周期
+            fetch_missing: 是否分析没有预计算结果的股票
+            
+        Returns:
+            与items顺序一致的结果列表
+        """
+        from app.utils.tushare_utils import categorize_pct_change
+        from app.services.probability_store import probability_table
+        
+        if time_period is None:
+            time_period = next(iter(TIME_PERIOD_MAP))
+        
+        probability_table.ensure_loaded()
+        snapshot = probability_table.snapshot()
+        ts_codes = list(dict.fromkeys(item['ts_code'] for item in items))
+        missing = [ts_code for ts_code in ts_codes
+                   if not len(probability_table.lookup_rows(ts_code, time_period, snapshot=snapshot))]
+        errors = {}
+        
+        if missing and fetch_missing:
+            max_workers = int(os.getenv('BATCH_FETCH_WORKERS', '4'))
+            logger.info(f"批量查询中{len(missing)}只股票没有预计算结果，开始并发分析")
+            
+            def analyze_missing(ts_code: str) -> Optional[str]:
+                stock_info = StockService.get_stock_info(ts_code)
+                if "error" in stock_info:
+                    return stock_info["error"]
+                result = analyze_stock(ts_code, stock_info['name'], stock_info['circ_mv'])
+                return result.get("error")
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+                future_to_code = {executor.submit(analyze_missing, ts_code): ts_code for ts_code in missing}
+                for future in concurrent.futures.as_completed(future_to_code):
+                    ts_code = future_to_code[future]
+                    try:
+                        error = future.result()
+                    except Exception as e:
+                        error = str(e)
+                    if error:
+                        errors[ts_code] = error
+            
+            probability_table.ensure_loaded(force=True)
+            snapshot = probability_table.snapshot()
+        
+        # 所有股票使用同一个快照查找，查找期间概率表重建也不会错位
+        columns = snapshot[0]
+        stock_index = StockService.get_stock_index()
+        results = []
+        for item in items:
+            ts_code = item['ts_code']
+            pct_chg = item.get('pct_chg')
+            category = categorize_pct_change(pct_chg, ts_code) if pct_chg is not None else None
+            rows = probability_table.lookup_rows(ts_code, time_period, category, snapshot=snapshot)
+            stock = stock_index.get(ts_code, {})
+            entry = {
+                "ts_code": ts_code,
+                "name": stock.get('name', columns['name'][rows[0]] if len(rows) else ''),
+                "time_period": time_period,
+            }
+            
+            if not len(rows):
+                entry["error"] = errors.get(ts_code) or f"未找到股票{ts_code}的概率数据"
+                results.append(entry)
+                continue
+            
+            categories = {}
+            for row in rows:
+                row_category = columns['category'][row]
+                categories.setdefault(row_category, {})[columns['time_key'][row]] = {
+                    "up_prob": round(float(columns['up_prob'][row]), 2),
+                    "down_prob": round(float(columns['down_prob'][row]), 2),
+                    "equal_prob": round(float(columns['equal_prob'][row]), 2),
+                    "max_pct": round(float(columns['max_pct'][row]), 2),
+                    "min_pct": round(float(columns['min_pct'][row]), 2),
+                    "close_pct": round(float(columns['close_pct'][row]), 2),
+                    "total": int(columns['total'][row]),
+                }
+            
+            if category is None:
+                entry["categories"] = categories
+            else:
+                # 与单只股票的 /probability/pct 一致，返回所有时间段的平均概率
+                entry.update({
+                    "pct_chg": pct_chg,
+                    "category": category,
+                    "display_range": LIST_RANGE_MAP.get(category, category),
+                    "up_prob": round(float(columns['up_prob'][rows].mean()), 2),
+                    "down_prob": round(float(columns['down_prob'][rows].mean()), 2),
+                    "equal_prob": round(float(columns['equal_prob'][rows].mean()), 2),
+                    "avg_total": round(float(columns['total'][rows].mean()), 2),
+                    "time_periods": categories[category],
+                })
+            results.append(entry)
+        
+        return results
+    
+    @staticmethod
+    def get_preopen_ranking(top_n: int = 50, min_total: int = 0, refresh: bool = False,
+                            trade_date: Optional[str] = None, time_period: Optional[str] = None) -> Dict[str, Any]:
+        """获取盘前排名快照
+        
+        Args:
+            top_n: 返回数量
+            min_total: 最小样本数
+            refresh: 是否重新获取竞价数据生成快照
+            trade_date: 竞价日期，不指定则为最近交易日
+            time_period: 概率表的时间周期
+        """
+        try:
+            from app.services.preopen import preopen_scorer
+            
+            snapshot = preopen_scorer.get_snapshot()
+            stale = snapshot is None or (trade_date and snapshot["trade_date"] != trade_date) or \
+                (time_period and snapshot["time_period"] != time_period)
+            if refresh or stale:
+                snapshot = preopen_scorer.run(trade_date, time_period)
+                if "error" in snapshot:
+                    return snapshot
+            
+            items = [item for item in snapshot["items"] if item["total"] >= min_total][:top_n]
+            result = {key: value for key, value in snapshot.items() if key != "items"}
+            result["items"] = items
+            return result
+        except Exception as e:
+            logger.error(f"获取盘前排名失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def run_backtest(**params) -> Dict[str, Any]:
+        """在本地行情库上回测概率规则，参数见 BacktestEngine.run"""
+        try:
+            from app.services.backtest import backtest_engine
+            return backtest_engine.run(**params)
+        except Exception as e:
+            logger.error(f"回测失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def get_refresh_queue_status(run_id: Optional[str] = None) -> Dict[str, Any]:
+        """获取全量刷新任务队列的进度，run_id 默认为今天的任务"""
+        try:
+            from app.services.work_queue import work_queue, default_run_id
+            return work_queue.status(run_id or default_run_id())
+        except Exception as e:
+            logger.error(f"获取刷新任务队列状态失败: {e}")
+            return {"error": str(e)}
+    
+    @staticmethod
+    def get_tushare_stats() -> Dict[str, Any]:
+        """获取Tushare请求统计: 各token的请求数和暂停状态、各优先级的排队情况、各接口的并发窗口"""
+        try:
+            from app.utils.tushare_utils import pro
+            return pro.stats()
+        except Exception as e:
+            logger.error(f"获取Tushare请求统计失败: {e}")
+            return {"error": str(e)}
@@ -0,0 +1,215 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+import pandas as pd
+from app.utils.logger import setup_logger
+from app.utils.tushare_utils import (
+    get_stock_list, get_name_changes, get_daily_basic_by_date, get_trade_calendar, get_latest_trade_date,
+    universe_mask
+)
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 快照文件名: {trade_date}.csv.gz
+SNAPSHOT_FILE_PATTERN = re.compile(r'^(?P<trade_date>\d{8})\.csv\.gz$')
+
+# 股票基本信息缓存，超过该天数或出现新股票时刷新
+STOCK_BASIC_MAX_AGE_DAYS = 7
+
+
+class UniverseStore:
+    """按交易日保存的股票池快照
+
+    每个交易日一个快照文件 {DATA_DIR}/universe/{trade_date}.csv.gz，保存当天全市场的
+    股票基本信息和每日指标，以及按 UNIVERSE_RULES 计算的 selected 列。
+    快照只需一次全市场 daily_basic 请求，已有的快照不会重新生成，历史股票池直接读取快照。
+    股票基本信息缓存在 stock_basic.csv 中，不必每天请求。快照中的股票名称是该交易日当时的名称
+    （按 namechange 历史名称还原，缓存在 namechange.csv 中），排除ST股票时不会用到之后才出现的ST名称。
+    """
+
+    def __init__(self, store_dir: Optional[str] = None, cache_size: int = 8):
+        self.store_dir = store_dir
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        # trade_date -> 快照DataFrame，最近使用的在最后
+        self.snapshots: 'OrderedDict[str, pd.DataFrame]' = OrderedDict()
+        self.stock_basic: Optional[pd.DataFrame] = None
+        self.name_changes: Optional[pd.DataFrame] = None
+        # 最近一次生成失败的时间，盘前当天的每日指标还没有发布，避免每次查询都请求接口
+        self.failed_at: Dict[str, float] = {}
+        self.retry_interval = float(os.getenv('UNIVERSE_RETRY_INTERVAL', '600'))
+
+    def get_store_dir(self) -> str:
+        return self.store_dir or os.path.join(os.getenv('DATA_DIR', './data'), 'universe')
+
+    def snapshot_path(self, trade_date: str) -> str:
+        return os.path.join(self.get_store_dir(), f"{trade_date}.csv.gz")
+
+    def list_dates(self) -> List[str]:
+        """已有快照的交易日，升序"""
+        store_dir = self.get_store_dir()
+        if not os.path.isdir(store_dir):
+            return []
+        dates = []
+        for file_name in os.listdir(store_dir):
+            match = SNAPSHOT_FILE_PATTERN.match(file_name)
+            if match:
+                dates.append(match.group('trade_date'))
+        return sorted(dates)
+
+    def _load_stock_basic(self, codes: Optional[pd.Series] = None) -> pd.DataFrame:
+        """读取股票基本信息缓存，缓存过期或缺少codes中的股票时重新获取"""
+        cache_file = os.path.join(self.get_store_dir(), 'stock_basic.csv')
+        if self.stock_basic is None and os.path.exists(cache_file):
+            self.stock_basic = pd.read_csv(cache_file, dtype={'symbol': str, 'list_date': str}, encoding='utf-8-sig')
+
+        stale = self.stock_basic is None or not os.path.exists(cache_file) or (
+            time.time() - os.path.getmtime(cache_file) > STOCK_BASIC_MAX_AGE_DAYS * 86400)
+        missing = codes is not None and self.stock_basic is not None and \
+            not codes.isin(self.stock_basic['ts_code']).all()
+        if stale or missing:
+            # 包含退市和暂停上市的股票，历史快照也能关联到基本信息
+            frames = [get_stock_list(status) for status in ('L', 'D', 'P')]
+            frames = [df for df in frames if not df.empty]
+            if frames:
+                self.stock_basic = pd.concat(frames, ignore_index=True).drop_duplicates('ts_code')
+                os.makedirs(self.get_store_dir(), exist_ok=True)
+                self.stock_basic.to_csv(cache_file, index=False, encoding='utf-8-sig')
+        return self.stock_basic if self.stock_basic is not None else pd.DataFrame()
+
+    def _load_name_changes(self, trade_date: str) -> pd.DataFrame:
+        """读取历史名称缓存，缓存过期或早于trade_date（可能缺少之后的名称变更）时重新获取"""
+        cache_file = os.path.join(self.get_store_dir(), 'namechange.csv')
+        if self.name_changes is None and os.path.exists(cache_file):
+            self.name_changes = pd.read_csv(cache_file, dtype=str, encoding='utf-8-sig')
+
+        stale = self.name_changes is None or not os.path.exists(cache_file) or (
+            time.time() - os.path.getmtime(cache_file) > STOCK_BASIC_MAX_AGE_DAYS * 86400) or (
+            time.strftime('%Y%m%d', time.localtime(os.path.getmtime(cache_file))) < trade_date)
+        if stale:
+            changes = get_name_changes()
+            if not changes.empty:
+                self.name_changes = changes.drop_duplicates()
+                os.makedirs(self.get_store_dir(), exist_ok=True)
+                self.name_changes.to_csv(cache_file, index=False, encoding='utf-8-sig')
+        return self.name_changes if self.name_changes is not None else pd.DataFrame()
+
+    def _names_as_of(self, snapshot: pd.DataFrame, trade_date: str) -> pd.Series:
+        """股票在trade_date当天使用的名称，没有历史名称记录的股票使用当前名称"""
+        changes = self._load_name_changes(trade_date)
+        if changes.empty:
+            logger.warning("没有股票历史名称，%s股票池按当前名称排除ST股票", trade_date)
+            return snapshot['name']
+        end_date = changes['end_date'].fillna('')
+        active = changes[(changes['start_date'] <= trade_date) & ((end_date == '') | (end_date >= trade_date))]
+        names = active.sort_values('start_date').drop_duplicates('ts_code', keep='last').set_index('ts_code')['name']
+        return snapshot['ts_code'].map(names).fillna(snapshot['name'])
+
+    def build_snapshot(self, trade_date: str) -> pd.DataFrame:
+        """生成某个交易日的快照，已存在时直接读取"""
+        snapshot = self.get_snapshot(trade_date)
+        if snapshot is not None:
+            return snapshot
+
+        daily_basic = get_daily_basic_by_date(trade_date)
+        if daily_basic.empty:
+            self.failed_at[trade_date] = time.time()
+            return pd.DataFrame()
+
+        stock_basic = self._load_stock_basic(daily_basic['ts_code'])
+        if stock_basic.empty:
+            self.failed_at[trade_date] = time.time()
+            return pd.DataFrame()
+
+        snapshot = pd.merge(stock_basic, daily_basic, on='ts_code', how='inner')
+        # 股票基本信息中是当前名称，按交易日当时的名称判断是否ST，避免用到未来信息
+        snapshot['name'] = self._names_as_of(snapshot, trade_date)
+        snapshot['selected'] = universe_mask(snapshot)
+
+        os.makedirs(self.get_store_dir(), exist_ok=True)
+        # 先写临时文件再替换，避免读到写了一半的快照
+        file_path = self.snapshot_path(trade_date)
+        tmp_path = f"{file_path}.tmp"
+        snapshot.to_csv(tmp_path, index=False, encoding='utf-8-sig', compression='gzip')
+        os.replace(tmp_path, file_path)
+        logger.info("生成%s股票池快照，全市场%s只股票，股票池%s只股票",
+                    trade_date, len(snapshot), int(snapshot['selected'].sum()))
+        self._remember(trade_date, snapshot)
+        return snapshot
+
+    def get_snapshot(self, trade_date: str) -> Optional[pd.DataFrame]:
+        """读取某个交易日的快照，不存在时返回None"""
+        with self.lock:
+            if trade_date in self.snapshots:
+                self.snapshots.move_to_end(trade_date)
+                return self.snapshots[trade_date]
+        file_path = self.snapshot_path(trade_date)
+        if not os.path.exists(file_path):
+            return None
+        snapshot = pd.read_csv(file_path, dtype={'symbol': str, 'list_date': str, 'trade_date': str},
+                               encoding='utf-8-sig', compression='gzip')
+        self._remember(trade_date, snapshot)
+        return snapshot
+
+    def _remember(self, trade_date: str, snapshot: pd.DataFrame) -> None:
+        with self.lock:
+            self.snapshots[trade_date] = snapshot
+            self.snapshots.move_to_end(trade_date)
+            while len(self.snapshots) > self.cache_size:
+                self.snapshots.popitem(last=False)
+
+    def refresh(self) -> Optional[str]:
+        """确保最近交易日的快照存在，返回可用的最近快照日期
+
+        当天的每日指标在收盘后才发布，生成失败时使用之前最近的快照，retry_interval秒后再重试
+        """
+        latest = get_latest_trade_date()
+        if latest and not os.path.exists(self.snapshot_path(latest)):
+            if time.time() - self.failed_at.get(latest, 0) >= self.retry_interval:
+                self.build_snapshot(latest)
+        dates = [date for date in self.list_dates() if not latest or date <= latest]
+        return dates[-1] if dates else None
+
+    def backfill(self, start_date: str, end_date: Optional[str] = None) -> List[str]:
+        """补齐区间内缺少的历史快照，每个交易日一次请求，返回新生成的日期"""
+        end_date = end_date or get_latest_trade_date()
+        existing = set(self.list_dates())
+        built = []
+        for trade_date in get_trade_calendar():
+            if trade_date < start_date or (end_date and trade_date > end_date) or trade_date in existing:
+                continue
+            if not self.build_snapshot(trade_date).empty:
+                built.append(trade_date)
+        return built
+
+    def get_universe(self, trade_date: Optional[str] = None) -> pd.DataFrame:
+        """获取股票池，trade_date为空时返回最近交易日的股票池
+
+        指定日期没有快照时按该日期生成，非交易日取之前最近的交易日。
+        一个快照都没有（比如没有Tushare积分）时使用旧版的 filtered_stocks.csv
+        """
+        if trade_date:
+            trade_date = get_latest_trade_date(trade_date) or trade_date
+            snapshot = self.build_snapshot(trade_date)
+        else:
+            trade_date = self.refresh()
+            if not trade_date:
+                return self._load_legacy()
+            snapshot = self.get_snapshot(trade_date)
+        if snapshot is None or snapshot.empty:
+            return pd.DataFrame()
+        return snapshot[snapshot['selected'].astype(bool)].drop(columns=['selected'])
+
+    def _load_legacy(self) -> pd.DataFrame:
+        legacy_file = os.path.join(os.path.dirname(self.get_store_dir()), 'filtered_stocks.csv')
+        if not os.path.exists(legacy_file):
+            return pd.DataFrame()
+        logger.warning("没有股票池快照，使用%s", legacy_file)
+        return pd.read_csv(legacy_file, encoding='utf-8-sig')
+
+
+universe_store = UniverseStore()
@@ -0,0 +1,160 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, List, Any, Callable, Optional
+from app.utils.logger import setup_logger
+from app.utils.tushare_client import request_priority
+
+# 配置日志
+logger = setup_logger(__name__)
+
+
+def _warm_universe() -> str:
+    from app.services.stock_service import StockService
+    stocks = StockService.get_filtered_stocks()
+    StockService.get_stock_index()
+    return f"股票池{len(stocks)}只股票"
+
+
+def _warm_probabilities() -> str:
+    from app.services.probability_store import probability_table
+    probability_table.ensure_loaded(force=True)
+    return f"概率表{len(probability_table)}行"
+
+
+def _warm_trade_calendar() -> str:
+    from app.utils.tushare_utils import get_trade_calendar
+    dates = get_trade_calendar()
+    if not dates:
+        raise RuntimeError("交易日历为空")
+    return f"交易日历{len(dates)}个交易日"
+
+
+# 预热任务，按顺序执行，可通过 WARMUP_TASKS 配置启用哪些任务
+WARMUP_TASKS: Dict[str, Callable[[], str]] = {
+    'universe': _warm_universe,
+    'probabilities': _warm_probabilities,
+    'trade_cal': _warm_trade_calendar,
+}
+
+
+class WarmupState:
+    """预热状态，用于就绪检查"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = True
+        self.started_at = None
+        self.finished_at = None
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+
+    @property
+    def ready(self) -> bool:
+        return not self.enabled or self.finished_at is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            elapsed = None
+            if self.started_at is not None:
+                elapsed = round((self.finished_at or time.time()) - self.started_at, 3)
+            return {
+                "ready": self.ready,
+                "enabled": self.enabled,
+                "elapsed": elapsed,
+                "tasks": {name: dict(task) for name, task in self.tasks.items()},
+            }
+
+
+warmup_state = WarmupState()
+
+
+def get_enabled_tasks() -> List[str]:
+    """读取需要执行的预热任务，WARMUP_ENABLED=false 时不预热"""
+    if os.getenv('WARMUP_ENABLED', 'true').lower() != 'true':
+        return []
+    names = os.getenv('WARMUP_TASKS', ','.join(WARMUP_TASKS))
+    tasks = []
+    for name in names.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in WARMUP_TASKS:
+            logger.warning("未知的预热任务: %s", name)
+            continue
+        tasks.append(name)
+    return tasks
+
+
+def run_warmup(stop: Optional[threading.Event] = None) -> Dict[str, Any]:
+    """执行预热任务，单个任务失败不影响其他任务
+
+    stop 被设置后（服务关闭）不再开始后面的任务，正在执行的任务无法中断
+    """
+    tasks = get_enabled_tasks()
+    with warmup_state.lock:
+        warmup_state.enabled = bool(tasks)
+        warmup_state.started_at = time.time()
+        warmup_state.finished_at = None
+        warmup_state.tasks = {name: {"status": "pending"} for name in tasks}
+
+    for name in tasks:
+        if stop is not None and stop.is_set():
+            warmup_state.tasks[name]["status"] = "skipped"
+            continue
+        warmup_state.tasks[name]["status"] = "running"
+        start_time = time.time()
+        try:
+            # 预热请求的优先级低于交互请求，高于后台批量刷新
+            with request_priority('warmup'):
+                detail = WARMUP_TASKS[name]()
+            warmup_state.tasks[name].update(status="done", detail=detail)
+            logger.info("预热任务%s完成: %s，耗时: %.3f秒", name, detail, time.time() - start_time)
+        except Exception as e:
+            warmup_state.tasks[name].update(status="failed", detail=str(e))
+            logger.error("预热任务%s失败: %s", name, e)
+        warmup_state.tasks[name]["elapsed"] = round(time.time() - start_time, 3)
+
+    if stop is not None and stop.is_set():
+        logger.info("服务关闭，停止预热")
+    with warmup_state.lock:
+        warmup_state.finished_at = time.time()
+    return warmup_state.to_dict()
+
+
+def start_warmup(stop: threading.Event) -> 'asyncio.Future[Dict[str, Any]]':
+    """在守护线程中预热，返回预热结果，需在事件循环中调用
+
+    不使用默认线程池: 退出时会等待线程池的线程，关闭服务时会一直等到正在执行的预热任务结束。
+    预热抛出的异常记录到日志。
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(result: Optional[Dict[str, Any]], error: Optional[BaseException]) -> None:
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def log_error(done: 'asyncio.Future[Dict[str, Any]]') -> None:
+        if not done.cancelled() and done.exception() is not None:
+            logger.error("预热失败: %s", done.exception())
+
+    def target() -> None:
+        result, error = None, None
+        try:
+            result = run_warmup(stop)
+        except Exception as e:
+            error = e
+        try:
+            loop.call_soon_threadsafe(settle, result, error)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    future.add_done_callback(log_error)
+    threading.Thread(target=target, name='warmup', daemon=True).start()
+    return future
@@ -0,0 +1,350 @@
+import os
+import time
+import socket
+import sqlite3
+import datetime
+import argparse
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+from app.utils.logger import setup_logger, ProgressLogger
+from app.utils.tushare_client import request_priority
+
+# 配置日志
+logger = setup_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    run_id TEXT NOT NULL,
+    ts_code TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker_id TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated_at REAL,
+    PRIMARY KEY (run_id, ts_code)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (run_id, status, lease_until);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    host TEXT,
+    pid INTEGER,
+    started_at REAL,
+    heartbeat_at REAL,
+    done INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class WorkQueue:
+    """全量刷新的共享任务队列
+
+    队列保存在共享目录下的 SQLite 文件 {DATA_DIR}/queue/refresh.db 中，
+    同一台机器的多个进程或挂载同一文件系统的多台机器都可以领取任务。
+    每个任务是一只股票，状态为 pending / leased / done / failed:
+    - 领取时在事务中把任务标记为 leased 并设置租约到期时间
+    - 工作进程定时发送心跳，延长自己持有任务的租约
+    - 租约过期（进程退出或机器宕机）的任务在下次领取时回到 pending，由其他进程重做
+    - 领取次数达到 max_attempts 仍未完成的任务标记为 failed，可以手动重新入队
+    """
+
+    def __init__(self, db_path: Optional[str] = None, lease_seconds: Optional[float] = None,
+                 max_attempts: Optional[int] = None):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds if lease_seconds is not None else \
+            float(os.getenv('QUEUE_LEASE_SECONDS', '300'))
+        self.max_attempts = max_attempts if max_attempts is not None else \
+            int(os.getenv('QUEUE_MAX_ATTEMPTS', '3'))
+        self._initialized = False
+
+    def get_db_path(self) -> str:
+        return self.db_path or os.getenv('QUEUE_DB') or \
+            os.path.join(os.getenv('DATA_DIR', './data'), 'queue', 'refresh.db')
+
+    @contextmanager
+    def _connect(self):
+        db_path = self.get_db_path()
+        if not self._initialized:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 不使用WAL，网络文件系统上WAL的共享内存不可靠
+        conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        try:
+            if not self._initialized:
+                conn.executescript(SCHEMA)
+                self._initialized = True
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务，BEGIN IMMEDIATE 保证同一时间只有一个进程在修改队列"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def enqueue(self, run_id: str, ts_codes: List[str]) -> int:
+        """添加任务，已存在的任务不变，返回新增任务数"""
+        now = time.time()
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (run_id, ts_code, updated_at) VALUES (?, ?, ?)",
+                [(run_id, ts_code, now) for ts_code in ts_codes])
+            return conn.total_changes - before
+
+    def _expire_leases(self, conn: sqlite3.Connection, run_id: str, now: float) -> None:
+        """租约过期的任务重新入队，领取次数用完的标记为失败"""
+        conn.execute(
+            "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+            "worker_id = NULL, lease_until = NULL, error = '租约过期', updated_at = ? "
+            "WHERE run_id = ? AND status = 'leased' AND lease_until < ?",
+            (self.max_attempts, now, run_id, now))
+
+    def lease(self, run_id: str, worker_id: str, limit: int = 1) -> List[Dict[str, Any]]:
+        """领取最多limit个任务，返回 [{'ts_code', 'attempts'}]"""
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, run_id, now)
+            rows = conn.execute(
+                "SELECT ts_code, attempts FROM tasks WHERE run_id = ? AND status = 'pending' "
+                "ORDER BY attempts, rowid LIMIT ?", (run_id, limit)).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = 'leased', worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                "updated_at = ? WHERE run_id = ? AND ts_code = ?",
+                [(worker_id, now + self.lease_seconds, now, run_id, ts_code) for ts_code, _ in rows])
+        return [{'ts_code': ts_code, 'attempts': attempts + 1} for ts_code, attempts in rows]
+
+    def register(self, run_id: str, worker_id: str) -> None:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, run_id, host, pid, started_at, heartbeat_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (worker_id, run_id, socket.gethostname(), os.getpid(), now, now))
+
+    def heartbeat(self, run_id: str, worker_id: str) -> int:
+        """延长工作进程持有任务的租约，返回延长的任务数"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE workers SET heartbeat_at = ? WHERE worker_id = ?", (now, worker_id))
+            return conn.execute(
+                "UPDATE tasks SET lease_until = ? WHERE run_id = ? AND worker_id = ? AND status = 'leased'",
+                (now + self.lease_seconds, run_id, worker_id)).rowcount
+
+    def complete(self, run_id: str, ts_code: str, worker_id: str) -> None:
+        """任务完成，租约已被其他进程接手时同样标记完成（结果已写入共享目录）"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = 'done', worker_id = ?, lease_until = NULL, error = NULL, updated_at = ? "
+                "WHERE run_id = ? AND ts_code = ?", (worker_id, now, run_id, ts_code))
+            conn.execute("UPDATE workers SET done = done + 1 WHERE worker_id = ?", (worker_id,))
+
+    def fail(self, run_id: str, ts_code: str, worker_id: str, error: str) -> None:
+        """任务失败，领取次数没用完时重新入队"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "worker_id = NULL, lease_until = NULL, error = ?, updated_at = ? "
+                "WHERE run_id = ? AND ts_code = ? AND worker_id = ? AND status = 'leased'",
+                (self.max_attempts, error, now, run_id, ts_code, worker_id))
+            conn.execute("UPDATE workers SET failed = failed + 1 WHERE worker_id = ?", (worker_id,))
+
+    def requeue(self, run_id: str, include_failed: bool = True) -> int:
+        """过期租约和失败任务重新入队，失败任务的领取次数清零，返回重新入队的任务数"""
+        now = time.time()
+        with self._transaction() as conn:
+            self._expire_leases(conn, run_id, now)
+            if not include_failed:
+                return 0
+            return conn.execute(
+                "UPDATE tasks SET status = 'pending', attempts = 0, updated_at = ? "
+                "WHERE run_id = ? AND status = 'failed'", (now, run_id)).rowcount
+
+    def is_finished(self, run_id: str) -> bool:
+        """没有待领取和进行中的任务"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE run_id = ? AND status IN ('pending', 'leased')",
+                (run_id,)).fetchone()
+        return row[0] == 0
+
+    def status(self, run_id: str) -> Dict[str, Any]:
+        """任务进度、失败任务和工作进程状态"""
+        now = time.time()
+        with self._connect() as conn:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM tasks WHERE run_id = ? GROUP BY status", (run_id,)).fetchall())
+            failed = conn.execute(
+                "SELECT ts_code, attempts, error FROM tasks WHERE run_id = ? AND status = 'failed' "
+                "ORDER BY ts_code LIMIT 100", (run_id,)).fetchall()
+            workers = conn.execute(
+                "SELECT worker_id, host, pid, heartbeat_at, done, failed FROM workers WHERE run_id = ? "
+                "ORDER BY started_at", (run_id,)).fetchall()
+        return {
+            "run_id": run_id,
+            "total": sum(counts.values()),
+            **{state: counts.get(state, 0) for state in ('pending', 'leased', 'done', 'failed')},
+            "failed_tasks": [{"ts_code": ts_code, "attempts": attempts, "error": error}
+                             for ts_code, attempts, error in failed],
+            "workers": [{
+                "worker_id": worker_id,
+                "host": host,
+                "pid": pid,
+                "alive": now - heartbeat_at < self.lease_seconds,
+                "heartbeat_ago": round(now - heartbeat_at, 1),
+                "done": done,
+                "failed": failed_count,
+            } for worker_id, host, pid, heartbeat_at, done, failed_count in workers],
+        }
+
+
+# 进程内共享的任务队列
+work_queue = WorkQueue()
+
+
+def default_run_id() -> str:
+    return f"refresh_{datetime.datetime.now().strftime('%Y%m%d')}"
+
+
+def enqueue_universe(run_id: Optional[str] = None, trade_date: Optional[str] = None) -> Dict[str, Any]:
+    """把股票池中的所有股票加入任务队列"""
+    from app.services.stock_service import StockService
+
+    run_id = run_id or default_run_id()
+    stocks = StockService.get_filtered_stocks(trade_date)
+    if not stocks:
+        return {"error": "获取股票列表失败"}
+    added = work_queue.enqueue(run_id, [stock['ts_code'] for stock in stocks])
+    logger.info("任务队列%s新增%s个任务，股票池共%s只股票", run_id, added, len(stocks))
+    return {"run_id": run_id, "added": added, "universe": len(stocks)}
+
+
+def run_worker(run_id: Optional[str] = None, worker_id: Optional[str] = None,
+               poll_interval: Optional[float] = None) -> Dict[str, int]:
+    """工作进程主循环: 领取股票、分析并把结果写入共享数据目录，直到队列中没有未完成的任务
+
+    分析结果仍写到 {DATA_DIR}/{ts_code}_{time_period}_probability.csv，
+    概率内存表按文件修改时间增量重载，各进程的结果自然合并。
+    缺口记录写入同一个任务日志，重做的任务会先读取其他进程追加的记录，只补拉缺口。
+    """
+    from app.services.stock_service import StockService
+    from app.utils.run_journal import RunJournal
+
+    run_id = run_id or default_run_id()
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    poll_interval = poll_interval if poll_interval is not None else float(os.getenv('QUEUE_POLL_INTERVAL', '10'))
+    heartbeat_interval = work_queue.lease_seconds / 3
+
+    work_queue.register(run_id, worker_id)
+    journal = RunJournal(run_id)
+    stop = threading.Event()
+
+    def send_heartbeats() -> None:
+        while not stop.wait(heartbeat_interval):
+            try:
+                work_queue.heartbeat(run_id, worker_id)
+            except Exception as e:
+                logger.error("工作进程%s发送心跳失败: %s", worker_id, e)
+
+    heartbeat_thread = threading.Thread(target=send_heartbeats, name=f"heartbeat-{worker_id}", daemon=True)
+    heartbeat_thread.start()
+    progress = ProgressLogger(logger)
+    counts = {"done": 0, "failed": 0}
+    logger.info("工作进程%s开始领取任务队列%s的任务", worker_id, run_id)
+    try:
+        # 工作进程只做后台刷新，以批量优先级请求接口
+        with request_priority('bulk'):
+            while True:
+                tasks = work_queue.lease(run_id, worker_id)
+                if not tasks:
+                    if work_queue.is_finished(run_id):
+                        break
+                    # 其他进程持有的任务可能因租约过期回到队列
+                    time.sleep(poll_interval)
+                    continue
+
+                for task in tasks:
+                    ts_code = task['ts_code']
+                    if task['attempts'] > 1:
+                        journal.refresh()
+                    resumed = journal.is_done(ts_code) and not journal.gaps_for(ts_code)
+                    progress.info("工作进程%s处理股票%s（第%s次），已完成%s只", worker_id, ts_code,
+                                  task['attempts'], counts["done"])
+                    try:
+                        result = StockService.get_stock_probability(ts_code, journal=journal, reuse_existing=resumed,
+                                                                    progress=progress)
+                        error = result.get("error")
+                    except Exception as e:
+                        error = str(e)
+                    if error is None and journal.gaps_for(ts_code):
+                        error = f"有{len(journal.gaps_for(ts_code))}个缺口未补齐"
+                    if error is None:
+                        if not resumed:
+                            journal.mark_done(ts_code)
+                        work_queue.complete(run_id, ts_code, worker_id)
+                        counts["done"] += 1
+                    else:
+                        logger.warning("工作进程%s处理股票%s失败: %s", worker_id, ts_code, error)
+                        work_queue.fail(run_id, ts_code, worker_id, error)
+                        counts["failed"] += 1
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+    progress.info("工作进程%s结束，完成%s只股票，失败%s次", worker_id, counts["done"], counts["failed"], force=True)
+    return counts
+
+
+def _worker_main(run_id: str) -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    run_worker(run_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='全量刷新任务队列')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('enqueue', '把股票池加入任务队列'), ('work', '启动工作进程'),
+                            ('status', '查看任务进度'), ('requeue', '过期和失败任务重新入队')):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument('--run-id', default=None, help='任务ID，默认 refresh_{今天}')
+    subparsers.choices['enqueue'].add_argument('--trade-date', default=None, help='股票池交易日')
+    subparsers.choices['work'].add_argument('--processes', type=int, default=1, help='本机启动的工作进程数')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    run_id = args.run_id or default_run_id()
+    if args.command == 'enqueue':
+        print(enqueue_universe(run_id, args.trade_date))
+    elif args.command == 'work':
+        if args.processes <= 1:
+            run_worker(run_id)
+        else:
+            context = multiprocessing.get_context('spawn')
+            processes = [context.Process(target=_worker_main, args=(run_id,)) for _ in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+        print(work_queue.status(run_id))
+    elif args.command == 'status':
+        print(work_queue.status(run_id))
+    elif args.command == 'requeue':
+        print({"run_id": run_id, "requeued": work_queue.requeue(run_id)})
+
+
+if __name__ == '__main__':
+    main()
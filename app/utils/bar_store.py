@@ -0,0 +1,109 @@
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.logger import setup_logger
+from app.utils.day_summary import DaySummaryTable
+from app.utils.fetch_planner import Interval, merge_intervals
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 保存的日线字段
+DAILY_FIELDS = ['open', 'high', 'low', 'close', 'pre_close', 'pct_chg', 'vol', 'amount']
+# 保存的每日指标字段，旧文件中没有的读取为NaN
+BASIC_FIELDS = ['change', 'turnover_rate', 'volume_ratio', 'pe', 'pb', 'total_mv', 'circ_mv']
+
+
+class BarStore:
+    """本地行情库
+
+    每只股票一个文件 {DATA_DIR}/bars/{ts_code}.npz，保存升序的日线数组、
+    已请求过的日线日期区间（covered，停牌日没有日线但区间已覆盖）和
+    按交易日汇总的竞价、分钟数据（DaySummaryTable），供回测等离线计算使用，不需要再请求接口。
+    新数据与已有数据合并，同一交易日以新数据为准。
+    """
+
+    def __init__(self, store_dir: Optional[str] = None):
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+
+    def get_store_dir(self) -> str:
+        return self.store_dir or os.path.join(os.getenv('DATA_DIR', './data'), 'bars')
+
+    def path(self, ts_code: str) -> str:
+        return os.path.join(self.get_store_dir(), f"{ts_code}.npz")
+
+    def list_codes(self) -> List[str]:
+        store_dir = self.get_store_dir()
+        if not os.path.isdir(store_dir):
+            return []
+        return sorted(name[:-4] for name in os.listdir(store_dir) if name.endswith('.npz'))
+
+    def save(self, ts_code: str, daily: pd.DataFrame, summary: Optional[DaySummaryTable] = None,
+             covered: Optional[List[Interval]] = None) -> None:
+        """保存日线和汇总数据，与已有数据合并
+
+        Args:
+            covered: 本次请求过的日线日期区间，没有指定时不改变已覆盖的区间
+        """
+        fields = DAILY_FIELDS + BASIC_FIELDS
+        summary = summary if summary is not None else DaySummaryTable([])
+        try:
+            with self.lock:
+                existing = self.load(ts_code)
+                daily = daily.drop_duplicates('trade_date').set_index('trade_date')
+                daily = daily.reindex(columns=fields)
+                covered = list(covered or [])
+                if existing is not None:
+                    old_daily, old_summary = existing
+                    old = pd.DataFrame({field: old_daily[field] for field in fields},
+                                       index=old_daily['trade_date'])
+                    daily = daily.combine_first(old)
+                    old_summary.merge(summary)
+                    summary = old_summary
+                    covered += [tuple(interval) for interval in old_daily['covered']]
+                daily = daily.sort_index()
+                covered = merge_intervals(covered)
+
+                arrays = {field: daily[field].to_numpy(dtype=np.float64) for field in fields}
+                os.makedirs(self.get_store_dir(), exist_ok=True)
+                file_path = self.path(ts_code)
+                # 先写临时文件再替换，避免读到写了一半的文件
+                tmp_path = f"{file_path}.tmp.npz"
+                np.savez_compressed(tmp_path, trade_date=daily.index.to_numpy(dtype=str),
+                                    summary_dates=np.array(summary.dates), windows=np.array(summary.windows),
+                                    values=summary.values, fetched=summary.fetched,
+                                    covered=np.array(covered, dtype=str).reshape(-1, 2), **arrays)
+                os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error("保存股票%s行情数据失败: %s", ts_code, e)
+
+    def load(self, ts_code: str) -> Optional[Tuple[Dict[str, np.ndarray], DaySummaryTable]]:
+        """读取日线数组和汇总表，不存在时返回None
+
+        日线字典中 covered 为已请求过的日期区间，形状 (n, 2)
+        """
+        file_path = self.path(ts_code)
+        if not os.path.exists(file_path):
+            return None
+        with np.load(file_path) as data:
+            trade_dates = data['trade_date']
+            daily = {'trade_date': trade_dates}
+            daily.update({field: data[field] if field in data.files else np.full(len(trade_dates), np.nan)
+                          for field in DAILY_FIELDS + BASIC_FIELDS})
+            if 'covered' in data.files:
+                daily['covered'] = data['covered']
+            else:
+                # 旧文件是一次请求的连续区间
+                daily['covered'] = np.array([[trade_dates[0], trade_dates[-1]]] if len(trade_dates) else [],
+                                            dtype=str).reshape(-1, 2)
+            summary = DaySummaryTable(data['summary_dates'].tolist(), data['windows'].tolist())
+            summary.values = data['values']
+            summary.fetched = data['fetched']
+        return daily, summary
+
+
+# 进程内共享的本地行情库
+bar_store = BarStore()
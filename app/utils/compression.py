@@ -0,0 +1,150 @@
+import os
+import gzip
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.utils.logger import setup_logger
+
+# brotli 是可选依赖，未安装时只使用gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 配置日志
+logger = setup_logger(__name__)
+
+
+def parse_accept_encoding(value: str) -> List[str]:
+    """客户端接受的压缩格式，排除 q=0 的格式"""
+    encodings = []
+    for item in value.split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        quality = params.strip()
+        if not name or quality.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.append(name)
+    return encodings
+
+
+class CompressedBodyCache:
+    """压缩后响应体的LRU缓存
+
+    按 (未压缩响应体的哈希, 压缩格式) 缓存，内容没有变化的页面直接返回上次压缩的结果。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: 'OrderedDict[Tuple[str, str], bytes]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[bytes]:
+        body = self.entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def set(self, key: Tuple[str, str], body: bytes) -> None:
+        self.entries[key] = body
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6, mtime=0)
+
+
+class CompressionMiddleware:
+    """JSON响应的 gzip/brotli 压缩和 ETag
+
+    只处理 application/json 响应，流式响应（如 text/event-stream）原样透传。
+    响应带弱 ETag（响应体的哈希），请求的 If-None-Match 匹配时返回304，不传输响应体；
+    否则按 Accept-Encoding 优先使用 br，其次 gzip，压缩结果按响应体哈希缓存。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: Optional[int] = None, cache_size: Optional[int] = None):
+        self.app = app
+        self.minimum_size = minimum_size if minimum_size is not None else int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+        cache_size = cache_size if cache_size is not None else int(os.getenv('COMPRESSION_CACHE_SIZE', '256'))
+        self.cache = CompressedBodyCache(cache_size)
+
+    def choose_encoding(self, request_headers: Headers) -> Optional[str]:
+        accepted = parse_accept_encoding(request_headers.get('accept-encoding', ''))
+        if 'br' in accepted and brotli is not None:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = Headers(scope=scope)
+        start_message: Optional[Message] = None
+        chunks: List[bytes] = []
+        passthrough = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if message['type'] == 'http.response.start':
+                content_type = Headers(raw=message['headers']).get('content-type', '')
+                if not content_type.startswith('application/json') or \
+                        'content-encoding' in Headers(raw=message['headers']):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start_message = message
+                return
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body', False):
+                await self.send_buffered(start_message, b''.join(chunks), request_headers, send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def send_buffered(self, start_message: Message, body: bytes, request_headers: Headers, send: Send) -> None:
+        headers = MutableHeaders(raw=list(start_message['headers']))
+        digest = hashlib.sha1(body).hexdigest()[:20]
+        etag = f'W/"{digest}"'
+        status = start_message['status']
+        # 304 也要带上 Vary，缓存才会按压缩格式区分验证结果
+        headers.add_vary_header('Accept-Encoding')
+        if status == 200:
+            headers['etag'] = etag
+            if_none_match = request_headers.get('if-none-match', '')
+            if etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+                del headers['content-length']
+                await send({'type': 'http.response.start', 'status': 304, 'headers': headers.raw})
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+
+        encoding = self.choose_encoding(request_headers) if len(body) >= self.minimum_size else None
+        if encoding is not None:
+            compressed = self.cache.get((digest, encoding))
+            if compressed is None:
+                # 大响应体压缩耗时较长，放到线程池执行，不阻塞事件循环
+                compressed = await run_in_threadpool(compress, body, encoding)
+                self.cache.set((digest, encoding), compressed)
+            body = compressed
+            headers['content-encoding'] = encoding
+        headers['content-length'] = str(len(body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers.raw})
+        await send({'type': 'http.response.body', 'body': body})
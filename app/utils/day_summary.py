@@ -0,0 +1,130 @@
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.intraday_windows import INTRADAY_WINDOWS
+
+# 第二天的时间段: 竞价 + 配置的分钟数据时间段
+WINDOW_KEYS = ['auction'] + INTRADAY_WINDOWS.keys()
+
+# 每个时间段保存的汇总字段
+# 竞价只有一行数据，first_close 和 last_close 都是竞价收盘价
+SUMMARY_FIELDS = ['open', 'high', 'low', 'first_close', 'last_close', 'amount']
+OPEN, HIGH, LOW, FIRST_CLOSE, LAST_CLOSE, AMOUNT = range(len(SUMMARY_FIELDS))
+
+# 各时间段判断涨跌使用的价格: 竞价用开盘价，close 为 first 的时间段用第一条收盘价，其余用最后一条收盘价
+WINDOW_PRICE_FIELDS = {window: LAST_CLOSE for window in WINDOW_KEYS}
+WINDOW_PRICE_FIELDS.update({window: FIRST_CLOSE for window in INTRADAY_WINDOWS.first_close_keys()})
+WINDOW_PRICE_FIELDS['auction'] = OPEN
+
+
+class DaySummaryTable:
+    """按交易日汇总的竞价和分钟数据
+
+    用 float32 数组 (交易日 × 时间段 × 字段) 保存计算需要的汇总值，
+    数据到达时立即汇总，不再保留原始的分钟数据DataFrame。
+    fetched 记录每个 (交易日, 时间段) 是否已请求过，请求成功但没有数据时汇总值为 NaN。
+    failures 记录本次请求失败的 (交易日, 时间段)，没有任务日志时也可以判断结果是否完整，不保存到文件。
+    """
+
+    def __init__(self, dates: Sequence[str], windows: Sequence[str] = WINDOW_KEYS):
+        self.dates: List[str] = list(dates)
+        self.windows: List[str] = list(windows)
+        self.date_index: Dict[str, int] = {date: i for i, date in enumerate(self.dates)}
+        self.window_index: Dict[str, int] = {window: i for i, window in enumerate(self.windows)}
+        self.values = np.full((len(self.dates), len(self.windows), len(SUMMARY_FIELDS)), np.nan, dtype=np.float32)
+        self.fetched = np.zeros((len(self.dates), len(self.windows)), dtype=bool)
+        self.failures: Set[Tuple[str, str]] = set()
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.fetched.nbytes
+
+    def add_dates(self, dates: Sequence[str]) -> None:
+        """追加新的交易日"""
+        new_dates = [date for date in dates if date not in self.date_index]
+        if not new_dates:
+            return
+        for date in new_dates:
+            self.date_index[date] = len(self.dates)
+            self.dates.append(date)
+        extra = np.full((len(new_dates), len(self.windows), len(SUMMARY_FIELDS)), np.nan, dtype=np.float32)
+        self.values = np.concatenate([self.values, extra])
+        self.fetched = np.concatenate([self.fetched, np.zeros((len(new_dates), len(self.windows)), dtype=bool)])
+
+    def record(self, date: str, window: str, data: pd.DataFrame) -> None:
+        """汇总一个交易日一个时间段的数据，data 是竞价或分钟行情"""
+        i, j = self.date_index[date], self.window_index[window]
+        self.fetched[i, j] = True
+        if data is None or data.empty:
+            return
+        summary = self.values[i, j]
+        summary[OPEN] = data['open'].iloc[0]
+        summary[HIGH] = data['high'].max()
+        summary[LOW] = data['low'].min()
+        summary[FIRST_CLOSE] = data['close'].iloc[0]
+        summary[LAST_CLOSE] = data['close'].iloc[-1]
+        summary[AMOUNT] = data['amount'].sum() if 'amount' in data.columns else np.nan
+
+    def record_many(self, dates: Sequence[str], window: str, values: np.ndarray,
+                    fetched_dates: Sequence[str]) -> None:
+        """批量写入一个时间段的汇总值
+
+        Args:
+            dates: 有数据的交易日，与 values 的行对应
+            values: 汇总值 [len(dates), len(SUMMARY_FIELDS)]
+            fetched_dates: 已请求过的交易日（包括没有数据的）
+        """
+        j = self.window_index[window]
+        fetched_rows = [self.date_index[date] for date in fetched_dates if date in self.date_index]
+        self.fetched[fetched_rows, j] = True
+        self.values[fetched_rows, j] = np.nan
+        rows = np.array([self.date_index.get(date, -1) for date in dates], dtype=np.int64)
+        found = rows >= 0
+        self.values[rows[found], j] = values[found]
+
+    def record_failures(self, dates: Sequence[str], window: str) -> None:
+        """记录请求失败的交易日，失败的交易日仍记为已请求（没有数据）"""
+        self.record_many([], window, np.empty((0, len(SUMMARY_FIELDS)), dtype=np.float32), dates)
+        self.failures.update((date, window) for date in dates)
+
+    def merge(self, other: 'DaySummaryTable') -> None:
+        """合并另一个汇总表，other中已请求过的 (交易日, 时间段) 覆盖当前的值"""
+        self.add_dates(other.dates)
+        rows = np.array([self.date_index[date] for date in other.dates], dtype=np.int64)
+        for j, window in enumerate(other.windows):
+            k = self.window_index.get(window)
+            if k is None or not len(rows):
+                continue
+            fetched = other.fetched[:, j]
+            self.values[rows[fetched], k] = other.values[fetched, j]
+            self.fetched[rows[fetched], k] = True
+
+    def is_fetched(self, date: str, window: str) -> bool:
+        i = self.date_index.get(date)
+        return i is not None and bool(self.fetched[i, self.window_index[window]])
+
+    def get(self, date: str, window: str) -> Optional[np.ndarray]:
+        """获取汇总值，没有数据时返回 None"""
+        i = self.date_index.get(date)
+        if i is None:
+            return None
+        summary = self.values[i, self.window_index[window]]
+        if np.isnan(summary[LAST_CLOSE]):
+            return None
+        return summary
+
+    def count(self, window: str) -> int:
+        """有数据的交易日数量"""
+        return int((~np.isnan(self.values[:, self.window_index[window], LAST_CLOSE])).sum())
+
+    def save(self, file_path: str) -> None:
+        np.savez_compressed(file_path, dates=np.array(self.dates), windows=np.array(self.windows),
+                            values=self.values, fetched=self.fetched)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'DaySummaryTable':
+        with np.load(file_path) as data:
+            table = cls(data['dates'].tolist(), data['windows'].tolist())
+            table.values = data['values']
+            table.fetched = data['fetched']
+        return table
@@ -0,0 +1,118 @@
+import os
+import bisect
+import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from app.utils.logger import setup_logger
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 按股票、日期范围请求的日线接口
+DAILY_ENDPOINTS = ('daily_basic', 'daily')
+
+# 单次请求最多返回的行数，超过时拆成多次请求
+MAX_ROWS_PER_CALL = 5000
+
+Interval = Tuple[str, str]
+
+
+def period_start_date(end_date: str, time_period: str) -> Optional[str]:
+    """时间周期的开始日期，如 y2 为 end_date 往前365*2天，不支持的时间周期返回None"""
+    try:
+        count = int(time_period[1:])
+    except ValueError:
+        return None
+    if time_period.startswith('m'):
+        days = 30 * count
+    elif time_period.startswith('y'):
+        days = 365 * count
+    else:
+        return None
+    return (datetime.datetime.strptime(end_date, '%Y%m%d') - datetime.timedelta(days=days)).strftime('%Y%m%d')
+
+
+def required_start_date(end_date: str, time_periods: Iterable[str]) -> Optional[str]:
+    """启用的时间周期中最早的开始日期"""
+    starts = [start for start in (period_start_date(end_date, period) for period in time_periods) if start]
+    return min(starts) if starts else None
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """合并重叠的日期区间（闭区间，YYYYMMDD）"""
+    merged: List[List[str]] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+class FetchPlanner:
+    """按需请求日线数据的计划
+
+    根据启用时间周期需要的日期范围、交易日历和本地行情库已覆盖的区间，
+    计算需要请求的最少 (接口, ts_code, 开始日期, 结束日期)。
+    缺失的交易日按日历连续分段，相隔不超过 merge_gap 个交易日的分段合并成一次请求
+    （多取几天已有的数据比多一次请求便宜），单次超过 MAX_ROWS_PER_CALL 个交易日时拆分。
+    """
+
+    def __init__(self, merge_gap: Optional[int] = None):
+        self.merge_gap = merge_gap if merge_gap is not None else int(os.getenv('FETCH_MERGE_GAP', '20'))
+
+    def missing_ranges(self, start_date: str, end_date: str, calendar: Sequence[str],
+                       covered: Iterable[Interval] = ()) -> List[Interval]:
+        """[start_date, end_date] 中没有被 covered 覆盖的交易日，合并成最少的日期区间"""
+        lo = bisect.bisect_left(calendar, start_date)
+        hi = bisect.bisect_right(calendar, end_date)
+        if lo >= hi:
+            return []
+        # 缺失的交易日在日历中的下标区间 [a, b)
+        runs: List[List[int]] = []
+        position = lo
+        for cover_start, cover_end in merge_intervals(covered):
+            a = bisect.bisect_left(calendar, cover_start, lo, hi)
+            b = bisect.bisect_right(calendar, cover_end, lo, hi)
+            if a > position:
+                runs.append([position, a])
+            position = max(position, b)
+        if position < hi:
+            runs.append([position, hi])
+
+        merged: List[List[int]] = []
+        for run in runs:
+            if merged and run[0] - merged[-1][1] <= self.merge_gap:
+                merged[-1][1] = run[1]
+            else:
+                merged.append(run)
+
+        ranges = []
+        for a, b in merged:
+            for chunk in range(a, b, MAX_ROWS_PER_CALL):
+                ranges.append((calendar[chunk], calendar[min(chunk + MAX_ROWS_PER_CALL, b) - 1]))
+        return ranges
+
+    def plan(self, ts_code: str, end_date: str, time_periods: Iterable[str], calendar: Sequence[str],
+             covered: Iterable[Interval] = (), start_date: Optional[str] = None) -> List[Dict[str, str]]:
+        """计算股票需要请求的日线接口和日期范围
+
+        Args:
+            ts_code: 股票代码
+            end_date: 需要的最后一个交易日
+            time_periods: 启用的时间周期，决定最早需要的日期
+            calendar: 升序的交易日历
+            covered: 本地已覆盖的日期区间
+            start_date: 指定开始日期时不按时间周期计算
+        """
+        start_date = start_date or required_start_date(end_date, time_periods)
+        if not start_date:
+            return []
+        return [
+            {'endpoint': endpoint, 'ts_code': ts_code, 'start_date': start, 'end_date': end}
+            for start, end in self.missing_ranges(start_date, end_date, calendar, covered)
+            for endpoint in DAILY_ENDPOINTS
+        ]
+
+
+# 进程内共享的请求计划
+fetch_planner = FetchPlanner()
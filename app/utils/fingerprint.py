@@ -0,0 +1,76 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Sequence
+import pandas as pd
+from app.utils.logger import setup_logger
+
+# 配置日志
+logger = setup_logger(__name__)
+
+
+def config_hash(config: Any) -> str:
+    """配置（可JSON序列化）的哈希"""
+    return hashlib.sha1(json.dumps(config, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def frame_hash(frame: pd.DataFrame, columns: Sequence[str]) -> str:
+    """DataFrame 指定列内容的哈希，与行的索引无关"""
+    values = pd.util.hash_pandas_object(frame[list(columns)], index=False).to_numpy()
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+
+def make_fingerprint(**inputs: Any) -> str:
+    """计算结果的输入指纹，输入相同时指纹相同"""
+    return config_hash(inputs)
+
+
+class FingerprintStore:
+    """分析结果的输入指纹
+
+    每只股票一个文件 {DATA_DIR}/fingerprints/{ts_code}.json，保存 {时间周期: 指纹}。
+    结果文件存在且指纹不变时直接复用结果，不重新计算。
+    """
+
+    def __init__(self, store_dir: Optional[str] = None):
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+
+    def get_store_dir(self) -> str:
+        return self.store_dir or os.path.join(os.getenv('DATA_DIR', './data'), 'fingerprints')
+
+    def _file_path(self, ts_code: str) -> str:
+        return os.path.join(self.get_store_dir(), f"{ts_code}.json")
+
+    def _load(self, ts_code: str) -> Dict[str, str]:
+        file_path = self._file_path(ts_code)
+        if not os.path.exists(file_path):
+            return {}
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error("读取股票%s的结果指纹失败: %s", ts_code, e)
+            return {}
+
+    def get(self, ts_code: str, time_period: str) -> Optional[str]:
+        return self._load(ts_code).get(time_period)
+
+    def set(self, ts_code: str, time_period: str, fingerprint: str) -> None:
+        with self.lock:
+            try:
+                fingerprints = self._load(ts_code)
+                fingerprints[time_period] = fingerprint
+                os.makedirs(self.get_store_dir(), exist_ok=True)
+                file_path = self._file_path(ts_code)
+                tmp_path = f"{file_path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(fingerprints, f, sort_keys=True)
+                os.replace(tmp_path, file_path)
+            except Exception as e:
+                logger.error("保存股票%s的结果指纹失败: %s", ts_code, e)
+
+
+# 进程内共享的结果指纹
+fingerprint_store = FingerprintStore()
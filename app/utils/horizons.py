@@ -0,0 +1,6 @@
+import os
+
+# 计算概率的间隔交易日（T+N），PROBABILITY_HORIZONS 逗号分隔，T+1 总是计算
+# 不依赖pandas，接口层校验参数时不需要导入计算模块
+HORIZONS = sorted({1} | {int(item) for item in os.getenv('PROBABILITY_HORIZONS', '1,2,3,5').split(',')
+                         if item.strip().isdigit() and int(item) > 0})
@@ -0,0 +1,108 @@
+import os
+import json
+from typing import Any, Dict, List, Tuple
+
+# 分钟偏移从 09:30 开始按自然时间计算，午休没有数据，13:00 为 210，15:00 为 330
+SESSION_START_MINUTES = 9 * 60 + 30
+SESSION_MINUTES = 330
+
+# 默认的分钟时间段
+# start/end 为闭区间的时间，close 为判断涨跌使用的收盘价: first 为时间段内第一条，last 为最后一条，
+# close 为 first 的时间段只统计涨跌次数，不统计最大、最小和收盘涨幅
+DEFAULT_WINDOW_CONFIG = {
+    'windows': [
+        {'key': '1min', 'name': '1分钟', 'start': '09:30', 'end': '09:30', 'close': 'first'},
+        {'key': '5min', 'name': '5分钟', 'start': '09:30', 'end': '09:35'},
+        {'key': '15min', 'name': '15分钟', 'start': '09:35', 'end': '09:45'},
+        {'key': '30min', 'name': '30分钟', 'start': '09:45', 'end': '10:15'},
+        {'key': '60min', 'name': '1小时', 'start': '10:15', 'end': '11:30'},
+    ],
+}
+
+
+def parse_minute(text: str) -> int:
+    """HH:MM 转为 09:30 起的分钟偏移"""
+    hour, minute = text.split(':')
+    offset = int(hour) * 60 + int(minute) - SESSION_START_MINUTES
+    if not 0 <= offset <= SESSION_MINUTES:
+        raise ValueError(f"时间{text}不在交易时间内")
+    return offset
+
+
+def format_minute(offset: int) -> str:
+    """分钟偏移转为 HH:MM:SS"""
+    minutes = SESSION_START_MINUTES + offset
+    return f"{minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+class WindowSpec:
+    """单个分钟时间段"""
+
+    def __init__(self, key: str, name: str, start: str, end: str, close: str = 'last'):
+        if key == 'auction':
+            raise ValueError("auction 是竞价时间段，不能用作分钟时间段")
+        if close not in ('first', 'last'):
+            raise ValueError(f"时间段{key}的close只能是first或last")
+        self.key = key
+        self.name = name
+        self.start = parse_minute(start)
+        self.end = parse_minute(end)
+        if self.start > self.end:
+            raise ValueError(f"时间段{key}的开始时间晚于结束时间")
+        self.close = close
+
+
+class IntradayWindows:
+    """第二天的分钟时间段定义
+
+    所有时间段都从同一份1分钟线汇总，增加时间段不增加接口请求。
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.specs: List[WindowSpec] = [
+            WindowSpec(window['key'], window.get('name', window['key']), window['start'], window['end'],
+                       window.get('close', 'last'))
+            for window in config['windows']
+        ]
+        if not self.specs:
+            raise ValueError("至少需要一个分钟时间段")
+        keys = [spec.key for spec in self.specs]
+        if len(set(keys)) != len(keys):
+            raise ValueError("分钟时间段的key不能重复")
+
+    @classmethod
+    def from_env(cls) -> 'IntradayWindows':
+        """从 INTRADAY_WINDOWS_FILE 指定的JSON文件加载，未配置则使用默认时间段"""
+        config_file = os.getenv('INTRADAY_WINDOWS_FILE')
+        if config_file and os.path.exists(config_file):
+            with open(config_file, 'r', encoding='utf-8') as f:
+                return cls(json.load(f))
+        return cls(DEFAULT_WINDOW_CONFIG)
+
+    def keys(self) -> List[str]:
+        return [spec.key for spec in self.specs]
+
+    def get(self, key: str) -> WindowSpec:
+        return next(spec for spec in self.specs if spec.key == key)
+
+    def offsets(self) -> Dict[str, Tuple[int, int]]:
+        """时间段key -> (开始分钟偏移, 结束分钟偏移)"""
+        return {spec.key: (spec.start, spec.end) for spec in self.specs}
+
+    def display_map(self) -> Dict[str, str]:
+        """时间段key -> 概率文件中"时间段"列的显示值"""
+        return {spec.key: spec.name for spec in self.specs}
+
+    def first_close_keys(self) -> List[str]:
+        """用第一条收盘价判断涨跌的时间段"""
+        return [spec.key for spec in self.specs if spec.close == 'first']
+
+    @property
+    def fetch_end(self) -> int:
+        """需要请求到的最后一个分钟偏移"""
+        return max(spec.end for spec in self.specs)
+
+
+# 进程内共享的分钟时间段定义，可通过 INTRADAY_WINDOWS_FILE 配置
+INTRADAY_WINDOWS = IntradayWindows.from_env()
@@ -0,0 +1,55 @@
+import importlib
+import threading
+from types import ModuleType
+from typing import Optional
+
+
+class LazyModule(ModuleType):
+    """延迟导入的模块代理
+
+    第一次访问属性时才真正导入模块，用于推迟 pandas、tushare 等重量级依赖的导入，
+    加快服务启动。
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module: Optional[ModuleType] = None
+
+    def _load(self) -> ModuleType:
+        if self._lazy_module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self.__name__)
+        return self._lazy_module
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._lazy_module is not None
+
+    def __getattr__(self, name: str):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str) -> LazyModule:
+    """返回模块的延迟导入代理"""
+    return LazyModule(name)
+
+
+class LazyObject:
+    """延迟导入的对象代理，第一次访问属性时才导入 module 并取出 attr"""
+
+    def __init__(self, module: str, attr: str):
+        self._lazy_module = lazy_import(module)
+        self._lazy_attr = attr
+
+    def __getattr__(self, name: str):
+        return getattr(getattr(self._lazy_module, self._lazy_attr), name)
+
+
+def lazy_object(module: str, attr: str) -> LazyObject:
+    """返回模块属性的延迟导入代理，如 lazy_object('app.services.stock_service', 'StockService')"""
+    return LazyObject(module, attr)
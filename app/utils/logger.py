@@ -1,31 +1,89 @@
 import os
+import time
+import queue
+import atexit
 import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# 所有logger共用一个队列，由后台线程统一写文件和控制台，业务线程只负责入队
+_log_queue = queue.Queue(-1)
+_listener = None
+_listener_lock = threading.Lock()
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def _start_listener():
+    """启动后台写日志线程，只启动一次"""
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        # 创建日志目录
+        log_dir = os.getenv('LOG_DIR', './logs')
+        os.makedirs(log_dir, exist_ok=True)
+        formatter = logging.Formatter(LOG_FORMAT)
+
+        # 添加文件处理器，按大小滚动
+        file_handler = RotatingFileHandler(
+            os.path.join(log_dir, 'app.log'),
+            maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+            backupCount=int(os.getenv('LOG_BACKUP_COUNT', '5')),
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+
+        # 添加控制台处理器
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+
+        _listener = QueueListener(_log_queue, file_handler, console_handler, respect_handler_level=True)
+        _listener.start()
+        # 退出时把队列中剩余的日志写完
+        atexit.register(_listener.stop)
+
 
 def setup_logger(name):
-    # 创建日志目录
-    log_dir = os.getenv('LOG_DIR', './logs')
-    os.makedirs(log_dir, exist_ok=True)
-    
-    # 配置日志格式
-    log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    
+    _start_listener()
+
     # 获取logger
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
     # 防止重复添加处理器
     if not logger.handlers:
-        # 添加文件处理器
-        file_handler = logging.FileHandler(os.path.join(log_dir, 'app.log'))
-        file_handler.setFormatter(logging.Formatter(log_format))
-        logger.addHandler(file_handler)
-        
-        # 添加控制台处理器
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter(log_format))
-        logger.addHandler(console_handler)
-    
+        logger.addHandler(QueueHandler(_log_queue))
+
     # 确保日志不会被重复输出
     logger.propagate = False
-    
-    return logger 
\ No newline at end of file
+
+    return logger
+
+
+class ProgressLogger:
+    """进度日志限流
+
+    循环中的进度日志最多每 interval 秒输出一次（首条总是输出），
+    被跳过的条数会附在下一条输出中，避免逐条写日志拖慢工作线程。
+    """
+
+    def __init__(self, logger: logging.Logger, interval: float = None):
+        self.logger = logger
+        self.interval = interval if interval is not None else float(os.getenv('LOG_PROGRESS_INTERVAL', '10'))
+        self.last_time = 0.0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def info(self, msg, *args, force: bool = False):
+        """输出进度日志，force=True 时不限流（如最后一条）"""
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_time < self.interval:
+                self.skipped += 1
+                return
+            skipped, self.skipped = self.skipped, 0
+            self.last_time = now
+        if skipped:
+            msg = f"{msg}（省略{skipped}条进度日志）"
+        self.logger.info(msg, *args)
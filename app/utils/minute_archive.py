@@ -0,0 +1,289 @@
+import os
+import zlib
+import struct
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from app.utils.logger import setup_logger
+from app.utils.intraday_windows import SESSION_START_MINUTES, SESSION_MINUTES
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 1分钟线按 09:30 起的分钟偏移保存，上午为 0..120（11:30）
+MORNING_MINUTES = 120
+# 价格按0.01元取整为int32
+PRICE_SCALE = 100
+
+# MBA2 在块头后保存每个交易日已请求到的分钟偏移，MBA1 只有上午的数据
+MAGIC = b'MBA2'
+MAGIC_V1 = b'MBA1'
+# 块头: 魔数、交易日数、行数
+HEADER = struct.Struct('<4sII')
+# 按差分保存的int32列，相邻分钟的差值很小，压缩率高
+DELTA_COLUMNS = ['minute', 'open', 'high', 'low', 'close']
+# 不差分的int64列
+RAW_COLUMNS = ['vol', 'amount']
+
+
+def _encode_block(days: np.ndarray, counts: np.ndarray, until: np.ndarray, columns: Dict[str, np.ndarray]) -> bytes:
+    """块格式: 块头 + 交易日(int32) + 每天行数(int32) + 每天已请求到的分钟偏移(int32)，之后是 zlib 压缩的各列
+
+    交易日、行数和请求范围不压缩，只读块头就能知道块里有哪些交易日
+    """
+    parts = []
+    for name in DELTA_COLUMNS:
+        values = columns[name].astype(np.int32)
+        parts.append(np.diff(values, prepend=np.int32(0)).astype('<i4').tobytes())
+    for name in RAW_COLUMNS:
+        parts.append(columns[name].astype('<i8').tobytes())
+    level = int(os.getenv('MINUTE_ARCHIVE_COMPRESS_LEVEL', '6'))
+    payload = zlib.compress(b''.join(parts), level)
+    return (HEADER.pack(MAGIC, len(days), int(counts.sum())) + days.astype('<i4').tobytes() +
+            counts.astype('<i4').tobytes() + until.astype('<i4').tobytes() + payload)
+
+
+def _read_header(data: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int, int]:
+    """返回 (交易日, 每天行数, 每天已请求到的分钟偏移, 行数, 压缩数据开始位置)"""
+    magic, n_days, n_rows = HEADER.unpack_from(data)
+    if magic not in (MAGIC, MAGIC_V1):
+        raise ValueError("分钟线归档格式错误")
+    offset = HEADER.size
+    days = np.frombuffer(data, dtype='<i4', count=n_days, offset=offset)
+    counts = np.frombuffer(data, dtype='<i4', count=n_days, offset=offset + 4 * n_days)
+    if magic == MAGIC_V1:
+        return days, counts, np.full(n_days, MORNING_MINUTES, dtype=np.int32), n_rows, offset + 8 * n_days
+    until = np.frombuffer(data, dtype='<i4', count=n_days, offset=offset + 8 * n_days)
+    return days, counts, until, n_rows, offset + 12 * n_days
+
+
+def _decode_block(data: bytes) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    days, counts, until, n_rows, offset = _read_header(data)
+    raw = zlib.decompress(data[offset:])
+    columns = {}
+    position = 0
+    for name in DELTA_COLUMNS:
+        # np.frombuffer 直接引用解压后的内存，再累加还原差分
+        columns[name] = np.cumsum(np.frombuffer(raw, dtype='<i4', count=n_rows, offset=position), dtype=np.int32)
+        position += 4 * n_rows
+    for name in RAW_COLUMNS:
+        columns[name] = np.frombuffer(raw, dtype='<i8', count=n_rows, offset=position)
+        position += 8 * n_rows
+    return days, counts, until, columns
+
+
+class MinuteBars:
+    """一只股票若干交易日的1分钟线，按 (交易日, 分钟) 升序排列的列式数组
+
+    days/starts/counts 描述每个交易日在列中的行范围，价格为 int32（单位0.01元），
+    minute 为 09:30 起的分钟偏移。
+    """
+
+    def __init__(self, days: np.ndarray, counts: np.ndarray, columns: Dict[str, np.ndarray]):
+        self.days = days
+        self.counts = counts
+        self.starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64) if len(counts) else \
+            np.empty(0, dtype=np.int64)
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns['minute'])
+
+    @property
+    def row_day(self) -> np.ndarray:
+        """每行所属交易日在 days 中的下标"""
+        return np.repeat(np.arange(len(self.days)), self.counts)
+
+    def prices(self, name: str) -> np.ndarray:
+        return self.columns[name] / PRICE_SCALE
+
+
+def window_summary(bars: MinuteBars, start: int, end: int,
+                   row_day: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """一次计算所有交易日 [start, end] 分钟偏移内的汇总值
+
+    Returns:
+        (有数据的交易日下标, 汇总值 float32 [n, 6]，字段顺序同 day_summary.SUMMARY_FIELDS)
+    """
+    minute = bars.columns['minute']
+    selected = np.flatnonzero((minute >= start) & (minute <= end))
+    if not len(selected):
+        return np.empty(0, dtype=np.int64), np.empty((0, 6), dtype=np.float32)
+    row_day = (bars.row_day if row_day is None else row_day)[selected]
+    # 行按 (交易日, 分钟) 升序，每个交易日的选中行是连续的一段
+    first = np.flatnonzero(np.r_[True, row_day[1:] != row_day[:-1]])
+    last = np.r_[first[1:], len(selected)] - 1
+    columns = bars.columns
+    values = np.empty((len(first), 6), dtype=np.float32)
+    values[:, 0] = columns['open'][selected[first]] / PRICE_SCALE
+    values[:, 1] = np.maximum.reduceat(columns['high'][selected], first) / PRICE_SCALE
+    values[:, 2] = np.minimum.reduceat(columns['low'][selected], first) / PRICE_SCALE
+    values[:, 3] = columns['close'][selected[first]] / PRICE_SCALE
+    values[:, 4] = columns['close'][selected[last]] / PRICE_SCALE
+    values[:, 5] = np.add.reduceat(columns['amount'][selected], first)
+    return row_day[first], values
+
+
+def window_summaries(bars: MinuteBars, windows: Dict[str, Tuple[int, int]]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """对同一份1分钟线计算多个时间段的汇总值 {时间段: (有数据的交易日下标, 汇总值)}
+
+    每行所属的交易日只计算一次，每个时间段只是对分钟列的一次筛选和 reduceat，
+    增加时间段几乎不增加计算量。
+    """
+    row_day = bars.row_day
+    return {key: window_summary(bars, start, end, row_day) for key, (start, end) in windows.items()}
+
+
+class MinuteArchive:
+    """1分钟线的本地压缩归档
+
+    每只股票每月一个块文件 {DATA_DIR}/minutes/{ts_code}/{YYYYMM}.mba。
+    价格转为 int32（0.01元），时间转为 int32 分钟偏移，价格和分钟按差分保存后 zlib 压缩，
+    成交量和成交额为 int64。读取时解压后用 np.frombuffer 直接得到数组。
+    每个交易日记录已请求到的分钟偏移，配置的时间段超出时只重新请求这些交易日。
+    上午约121行、每行36字节，压缩后5年全市场的上午分钟线只需几个GB。
+    """
+
+    def __init__(self, archive_dir: Optional[str] = None):
+        self.archive_dir = archive_dir
+        self.lock = threading.Lock()
+
+    def get_archive_dir(self) -> str:
+        return self.archive_dir or os.path.join(os.getenv('DATA_DIR', './data'), 'minutes')
+
+    def _stock_dir(self, ts_code: str) -> str:
+        return os.path.join(self.get_archive_dir(), ts_code)
+
+    def _block_path(self, ts_code: str, month: int) -> str:
+        return os.path.join(self._stock_dir(ts_code), f"{month}.mba")
+
+    def _months(self, ts_code: str) -> List[int]:
+        stock_dir = self._stock_dir(ts_code)
+        if not os.path.isdir(stock_dir):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(stock_dir) if name.endswith('.mba'))
+
+    def archived_days(self, ts_code: str, until: int = 0) -> set:
+        """已归档且请求到 until 分钟偏移的交易日（YYYYMMDD字符串），只读取块头"""
+        days = set()
+        for month in self._months(ts_code):
+            with open(self._block_path(ts_code, month), 'rb') as f:
+                header = f.read(HEADER.size)
+                _, n_days, _ = HEADER.unpack(header)
+                block_days, _, block_until, _, _ = _read_header(header + f.read(12 * n_days))
+                days.update(str(day) for day in block_days[block_until >= until])
+        return days
+
+    def _read_month(self, ts_code: str, month: int):
+        file_path = self._block_path(ts_code, month)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'rb') as f:
+            return _decode_block(f.read())
+
+    def read(self, ts_code: str, days: Optional[Iterable[str]] = None) -> MinuteBars:
+        """读取归档的分钟线，days 为需要的交易日，不指定则读取全部"""
+        wanted = None if days is None else {int(day) for day in days}
+        months = self._months(ts_code)
+        if wanted is not None:
+            wanted_months = {day // 100 for day in wanted}
+            months = [month for month in months if month in wanted_months]
+        day_parts, count_parts, column_parts = [], [], {name: [] for name in DELTA_COLUMNS + RAW_COLUMNS}
+        for month in months:
+            block = self._read_month(ts_code, month)
+            if block is None:
+                continue
+            block_days, block_counts, _, columns = block
+            if wanted is not None:
+                keep = np.isin(block_days, list(wanted))
+                rows = np.repeat(keep, block_counts)
+                block_days, block_counts = block_days[keep], block_counts[keep]
+                columns = {name: values[rows] for name, values in columns.items()}
+            day_parts.append(block_days)
+            count_parts.append(block_counts)
+            for name, values in columns.items():
+                column_parts[name].append(values)
+        if not day_parts:
+            return MinuteBars(np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32),
+                              {name: np.empty(0, dtype=np.int32 if name in DELTA_COLUMNS else np.int64)
+                               for name in column_parts})
+        return MinuteBars(np.concatenate(day_parts), np.concatenate(count_parts),
+                          {name: np.concatenate(parts) for name, parts in column_parts.items()})
+
+    @staticmethod
+    def _to_columns(frame: pd.DataFrame) -> pd.DataFrame:
+        """接口返回的分钟线转为整数列，只保留交易时间内的数据"""
+        times = pd.to_datetime(frame['trade_time'], format='%Y-%m-%d %H:%M:%S')
+        result = pd.DataFrame({
+            'day': (times.dt.year * 10000 + times.dt.month * 100 + times.dt.day).astype(np.int32),
+            'minute': (times.dt.hour * 60 + times.dt.minute - SESSION_START_MINUTES).astype(np.int32),
+        })
+        for name in ('open', 'high', 'low', 'close'):
+            result[name] = np.rint(frame[name].to_numpy(dtype=np.float64) * PRICE_SCALE).astype(np.int32)
+        for name in RAW_COLUMNS:
+            values = frame[name].to_numpy(dtype=np.float64) if name in frame.columns else np.zeros(len(frame))
+            result[name] = np.rint(np.nan_to_num(values)).astype(np.int64)
+        result = result[(result['minute'] >= 0) & (result['minute'] <= SESSION_MINUTES)]
+        # 接口返回的分钟线不一定按时间升序
+        return result.drop_duplicates(['day', 'minute'], keep='last').sort_values(['day', 'minute'], ignore_index=True)
+
+    def write(self, ts_code: str, frames: Dict[str, pd.DataFrame], until: int = MORNING_MINUTES) -> None:
+        """写入若干交易日的分钟线 {trade_date: 接口返回的DataFrame}，同一交易日以新数据为准
+
+        until 为请求的最后一个分钟偏移。没有数据的交易日也会记录（0行），之后不再重复请求
+        """
+        if not frames:
+            return
+        try:
+            parts = [frame for frame in frames.values() if frame is not None and not frame.empty]
+            new = self._to_columns(pd.concat(parts, ignore_index=True)) if parts else pd.DataFrame(columns=['day'])
+            new_days = np.array(sorted(int(day) for day in frames), dtype=np.int32)
+            with self.lock:
+                os.makedirs(self._stock_dir(ts_code), exist_ok=True)
+                for month in np.unique(new_days // 100):
+                    month_days = new_days[new_days // 100 == month]
+                    month_rows = new[new['day'] // 100 == month] if len(new) else new
+                    self._write_month(ts_code, int(month), month_days, month_rows, until)
+        except Exception as e:
+            logger.error("归档股票%s分钟线失败: %s", ts_code, e)
+
+    def _write_month(self, ts_code: str, month: int, days: np.ndarray, rows: pd.DataFrame, until: int) -> None:
+        columns = {name: (rows[name].to_numpy() if len(rows) else np.empty(0, dtype=np.int64))
+                   for name in DELTA_COLUMNS + RAW_COLUMNS}
+        row_days = rows['day'].to_numpy(dtype=np.int32) if len(rows) else np.empty(0, dtype=np.int32)
+        # 行已按交易日排序
+        counts = (np.searchsorted(row_days, days, side='right') - np.searchsorted(row_days, days, side='left')).astype(np.int32)
+        day_until = np.full(len(days), until, dtype=np.int32)
+
+        existing = self._read_month(ts_code, month)
+        if existing is not None:
+            old_days, old_counts, old_until, old_columns = existing
+            keep = ~np.isin(old_days, days)
+            old_rows = np.repeat(keep, old_counts)
+            all_days = np.concatenate([old_days[keep], days])
+            all_counts = np.concatenate([old_counts[keep], counts])
+            all_until = np.concatenate([old_until[keep], day_until])
+            all_columns = {name: np.concatenate([old_columns[name][old_rows], columns[name]]) for name in columns}
+            # 按交易日重新排序
+            order = np.argsort(all_days, kind='stable')
+            starts = np.concatenate([[0], np.cumsum(all_counts)[:-1]]).astype(np.int64)
+            rows_order = np.concatenate([np.arange(starts[i], starts[i] + all_counts[i]) for i in order]) \
+                if len(order) else np.empty(0, dtype=np.int64)
+            days, counts, day_until = all_days[order], all_counts[order], all_until[order]
+            columns = {name: values[rows_order] for name, values in all_columns.items()}
+
+        file_path = self._block_path(ts_code, month)
+        tmp_path = f"{file_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(_encode_block(days, counts, day_until, columns))
+        os.replace(tmp_path, file_path)
+
+    def nbytes(self, ts_code: Optional[str] = None) -> int:
+        """归档占用的磁盘空间"""
+        codes = [ts_code] if ts_code else (os.listdir(self.get_archive_dir()) if os.path.isdir(self.get_archive_dir()) else [])
+        return sum(os.path.getsize(self._block_path(code, month)) for code in codes for month in self._months(code))
+
+
+# 进程内共享的分钟线归档
+minute_archive = MinuteArchive()
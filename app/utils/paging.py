@@ -0,0 +1,58 @@
+import json
+import base64
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# 每页最多返回的记录数
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(after: str) -> str:
+    """游标: 上一页最后一条记录的排序键"""
+    return base64.urlsafe_b64encode(json.dumps({'after': after}).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> str:
+    """解析游标，格式不正确时抛出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        after = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))['after']
+    except Exception:
+        raise ValueError(f"无效的游标: {cursor}")
+    if not isinstance(after, str):
+        raise ValueError(f"无效的游标: {cursor}")
+    return after
+
+
+def paginate(records: Sequence[Any], cursor: Optional[str] = None, limit: Optional[int] = None,
+             key: Callable[[Any], str] = lambda record: record['ts_code']) -> Tuple[List[Any], Optional[str]]:
+    """按排序键分页，游标是上一页最后一条记录的键
+
+    新增或删除记录不会导致跳过或重复，limit 为空时返回游标之后的全部记录。
+
+    Returns:
+        (当前页记录, 下一页游标，没有下一页时为None)
+    """
+    ordered = sorted(records, key=key)
+    if cursor:
+        after = decode_cursor(cursor)
+        ordered = [record for record in ordered if key(record) > after]
+    if limit is None or len(ordered) <= limit:
+        return ordered, None
+    page = ordered[:limit]
+    return page, encode_cursor(key(page[-1]))
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """解析逗号分隔的字段列表，未指定时返回None（返回全部字段）"""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+
+def project_records(records: Iterable[Dict[str, Any]], fields: Optional[List[str]],
+                    keep: Sequence[str] = ('ts_code',)) -> List[Dict[str, Any]]:
+    """只保留指定字段，keep 中的字段总是保留"""
+    if fields is None:
+        return list(records)
+    selected = list(dict.fromkeys([*keep, *fields]))
+    return [{field: record[field] for field in selected if field in record} for record in records]
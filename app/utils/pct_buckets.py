@@ -0,0 +1,260 @@
+import os
+import json
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+import numpy as np
+
+# 默认的涨跌幅分档
+# 每个板块一组规则: up_edges/down_edges 是涨幅/跌幅绝对值的分档边界，
+# 区间在靠近0的一侧闭合，即上涨 [1, 3)，下跌 (-3, -1]，0 单独归为 flat。
+# 板块按 ts_code 前缀匹配，第一个匹配的规则生效，最后一个规则不写前缀作为默认规则。
+# 一个分档key只对应一个区间，多个板块共用的key在各板块的区间必须相同，区间不同的分档使用各自的key。
+# labels 中的 display 可以使用 {low}/{high} 占位，按所在板块的分档边界取整填入。
+DEFAULT_BUCKET_CONFIG = {
+    'flat': 'flat',
+    'labels': {
+        'micro_up': {'name': '微涨'},
+        'range_1_3p': {'name': '小涨', 'display': '{low}-{high}'},
+        'range_3_5p': {'name': '中涨', 'display': '{low}-{high}'},
+        'range_5_7p': {'name': '大涨', 'display': '{low}-{high}'},
+        'range_7_9p': {'name': '急涨', 'display': '{low}-{high}'},
+        'range_7_10p': {'name': '急涨', 'display': '{low}-{high}'},
+        'range_10_19p': {'name': '急涨', 'display': '{low}-{high}'},
+        'limit_up': {'name': '涨停', 'display': '涨停'},
+        'limit_up_20p': {'name': '涨停', 'display': '涨停(20%)'},
+        'flat': {'name': '平盘'},
+        'small_down': {'name': '小跌'},
+        'medium_down': {'name': '中跌'},
+        'large_down': {'name': '大跌'},
+        'limit_down': {'name': '跌停'},
+        'sharp_down_5_7p': {'name': '急跌'},
+        'sharp_down_7_10p': {'name': '急跌'},
+        'sharp_down_10_19p': {'name': '急跌'},
+        'limit_down_20p': {'name': '跌停'},
+    },
+    'boards': [
+        {
+            # 创业板、科创板涨跌幅限制为20%，涨跌停按19.5%计
+            'name': '创业板/科创板',
+            'prefixes': ['300', '301', '688', '689'],
+            'up_edges': [1, 3, 5, 7, 10, 19.5],
+            'up_keys': ['micro_up', 'range_1_3p', 'range_3_5p', 'range_5_7p', 'range_7_10p', 'range_10_19p',
+                        'limit_up_20p'],
+            'down_edges': [1, 3, 5, 7, 10, 19.5],
+            'down_keys': ['small_down', 'medium_down', 'large_down', 'sharp_down_5_7p', 'sharp_down_7_10p',
+                          'sharp_down_10_19p', 'limit_down_20p'],
+        },
+        {
+            # 主板涨跌幅限制为10%，涨停按9.5%计，考虑四舍五入误差
+            'name': '主板',
+            'prefixes': [],
+            'up_edges': [1, 3, 5, 7, 9.5],
+            'up_keys': ['micro_up', 'range_1_3p', 'range_3_5p', 'range_5_7p', 'range_7_9p', 'limit_up'],
+            'down_edges': [1, 3, 5],
+            'down_keys': ['small_down', 'medium_down', 'large_down', 'limit_down'],
+        },
+    ],
+}
+
+
+def _format_edge(value: float) -> str:
+    return f"{value:g}%"
+
+
+class BoardRule:
+    """单个板块的分档规则"""
+
+    def __init__(self, name: str, prefixes: Sequence[str], up_edges: Sequence[float], up_keys: Sequence[str],
+                 down_edges: Sequence[float], down_keys: Sequence[str]):
+        if len(up_keys) != len(up_edges) + 1 or len(down_keys) != len(down_edges) + 1:
+            raise ValueError(f"板块{name}的分档数量必须比边界数量多1")
+        if list(up_edges) != sorted(up_edges) or list(down_edges) != sorted(down_edges):
+            raise ValueError(f"板块{name}的分档边界必须递增")
+        self.name = name
+        self.prefixes = tuple(prefixes)
+        self.up_edges = np.asarray(up_edges, dtype=np.float64)
+        self.up_keys = np.asarray(up_keys, dtype=object)
+        self.down_edges = np.asarray(down_edges, dtype=np.float64)
+        self.down_keys = np.asarray(down_keys, dtype=object)
+
+    def matches(self, ts_code: str) -> bool:
+        return not self.prefixes or ts_code.startswith(self.prefixes)
+
+    def categorize(self, values: np.ndarray, flat_key: str) -> np.ndarray:
+        """对整个数组分档，NaN 返回 None"""
+        abs_values = np.abs(values)
+        # side='right' 保证边界值落在远离0的一档，如 1 -> [1, 3)，-1 -> (-3, -1]
+        up = self.up_keys[np.searchsorted(self.up_edges, abs_values, side='right')]
+        down = self.down_keys[np.searchsorted(self.down_edges, abs_values, side='right')]
+        result = np.where(values > 0, up, np.where(values < 0, down, flat_key))
+        result[np.isnan(values)] = None
+        return result
+
+    def bounds(self) -> Dict[str, Tuple[float, Optional[float]]]:
+        """每个分档对应的涨跌幅绝对值区间 (下界, 上界)，最后一档上界为None"""
+        result = {}
+        for keys, edges in ((self.up_keys, self.up_edges), (self.down_keys, self.down_edges)):
+            edges = [0.0] + list(edges)
+            for i, key in enumerate(keys):
+                result[key] = (edges[i], edges[i + 1] if i + 1 < len(edges) else None)
+        return result
+
+    def displays(self, labels: Dict[str, Dict[str, str]]) -> Dict[str, str]:
+        """每个分档的显示值，display 中的 {low}/{high} 按本板块的分档边界取整填入"""
+        texts = {}
+        for key, (low, high) in self.bounds().items():
+            display = labels.get(key, {}).get('display', key)
+            texts[key] = display.format(low=int(low), high=int(high) if high is not None else '')
+        return texts
+
+    def intervals(self) -> Dict[str, str]:
+        """每个分档对应的区间文字，如 1% ~ 3%"""
+        texts = {}
+        edges = [0.0] + list(self.up_edges)
+        for i, key in enumerate(self.up_keys):
+            if i + 1 < len(edges):
+                texts[key] = f"{_format_edge(edges[i]) if i else '0'} ~ {_format_edge(edges[i + 1])}"
+            else:
+                texts[key] = f">={_format_edge(edges[i])}"
+        edges = [0.0] + list(self.down_edges)
+        for i, key in enumerate(self.down_keys):
+            if i + 1 < len(edges):
+                texts[key] = f"{_format_edge(-edges[i + 1])} ~ {_format_edge(-edges[i]) if i else '0'}"
+            else:
+                texts[key] = f"<={_format_edge(-edges[i])}"
+        return texts
+
+
+class PctBuckets:
+    """涨跌幅分档定义
+
+    同时用于计算（把涨跌幅数组分档）和展示（分档名称、区间、场景描述）。
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.flat_key = config.get('flat', 'flat')
+        self.labels: Dict[str, Dict[str, str]] = config.get('labels', {})
+        self.boards: List[BoardRule] = [
+            BoardRule(
+                board.get('name', ''), board.get('prefixes', []),
+                board['up_edges'], board['up_keys'], board['down_edges'], board['down_keys']
+            )
+            for board in config['boards']
+        ]
+        if not self.boards or self.boards[-1].prefixes:
+            raise ValueError("最后一个板块规则不能指定前缀，作为默认规则")
+        self._check_keys()
+
+    def _check_keys(self) -> None:
+        """多个板块共用的key区间必须相同，不同key的显示值不能重复（概率文件按显示值还原key）"""
+        seen: Dict[str, Tuple[str, str]] = {}
+        for board in self.boards:
+            intervals = board.intervals()
+            for key, display in board.displays(self.labels).items():
+                if key in seen and seen[key] != (intervals[key], display):
+                    raise ValueError(f"分档{key}在板块{board.name}的区间与其他板块不同，需使用单独的key")
+                seen[key] = (intervals[key], display)
+        displays = [display for _, display in seen.values()]
+        if len(set(displays)) != len(displays):
+            raise ValueError("不同分档的显示值不能重复")
+
+    @classmethod
+    def from_env(cls) -> 'PctBuckets':
+        """从 PCT_BUCKETS_FILE 指定的JSON文件加载，未配置则使用默认分档"""
+        config_file = os.getenv('PCT_BUCKETS_FILE')
+        if config_file and os.path.exists(config_file):
+            with open(config_file, 'r', encoding='utf-8') as f:
+                return cls(json.load(f))
+        return cls(DEFAULT_BUCKET_CONFIG)
+
+    def board_for(self, ts_code: Optional[str]) -> BoardRule:
+        """根据股票代码匹配板块规则"""
+        if ts_code:
+            for board in self.boards:
+                if board.matches(ts_code):
+                    return board
+        return self.boards[-1]
+
+    def board_index(self, ts_codes: Sequence[str]) -> np.ndarray:
+        """批量匹配板块规则，返回每只股票对应规则的下标"""
+        codes = np.asarray(ts_codes, dtype=str)
+        index = np.full(len(codes), len(self.boards) - 1, dtype=np.int16)
+        assigned = np.zeros(len(codes), dtype=bool)
+        for i, board in enumerate(self.boards[:-1]):
+            matched = np.zeros(len(codes), dtype=bool)
+            for prefix in board.prefixes:
+                matched |= np.char.startswith(codes, prefix)
+            matched &= ~assigned
+            index[matched] = i
+            assigned |= matched
+        return index
+
+    def categorize(self, values, ts_codes=None) -> np.ndarray:
+        """对涨跌幅数组分档
+
+        Args:
+            values: 涨跌幅数组（%）
+            ts_codes: 单个股票代码，或与values等长的股票代码数组，不指定则使用默认规则
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if ts_codes is None or isinstance(ts_codes, str):
+            return self.board_for(ts_codes).categorize(values, self.flat_key)
+
+        board_index = self.board_index(ts_codes)
+        result = np.empty(len(values), dtype=object)
+        for i in np.unique(board_index):
+            mask = board_index == i
+            result[mask] = self.boards[i].categorize(values[mask], self.flat_key)
+        return result
+
+    def categorize_one(self, pct_chg: float, ts_code: Optional[str] = None) -> str:
+        return self.categorize(np.array([pct_chg]), ts_code)[0]
+
+    def categorize_boards(self, pct_chg: float, boards: Optional[Sequence[int]] = None) -> Dict[str, List[int]]:
+        """同一涨跌幅在各板块规则下的分档
+
+        Args:
+            boards: 只计算这些规则下标对应的板块，不指定则计算所有板块
+
+        Returns:
+            {分档key: 分到该档的板块规则下标}，只有一个key时各板块分档相同
+        """
+        indexes = range(len(self.boards)) if boards is None else sorted(set(int(i) for i in boards))
+        result: Dict[str, List[int]] = {}
+        for i in indexes:
+            category = self.boards[i].categorize(np.array([pct_chg], dtype=np.float64), self.flat_key)[0]
+            result.setdefault(category, []).append(i)
+        return result
+
+    def keys(self) -> List[str]:
+        """所有分档key，按从涨停到跌停的顺序，不同板块的分档按区间大小穿插排列"""
+        order: Dict[str, Tuple[float, ...]] = {self.flat_key: (1,)}
+        for board in self.boards:
+            up_keys = set(board.up_keys)
+            for key, (low, high) in board.bounds().items():
+                high = high if high is not None else np.inf
+                order[key] = (0, -low, -high) if key in up_keys else (2, low, high)
+        return sorted(order, key=lambda key: order[key])
+
+    def intervals(self) -> Dict[str, str]:
+        """分档区间文字，共用的key在各板块的区间相同"""
+        texts = {self.flat_key: '0'}
+        for board in self.boards:
+            texts.update(board.intervals())
+        return texts
+
+    def display_map(self) -> Dict[str, str]:
+        """分档key -> 概率文件中"当日涨幅"列的显示值，按各板块的分档边界生成"""
+        texts = {self.flat_key: self.labels.get(self.flat_key, {}).get('display', self.flat_key)}
+        for board in self.boards:
+            texts.update(board.displays(self.labels))
+        return {key: texts[key] for key in self.keys()}
+
+    def category_names(self) -> Dict[str, str]:
+        """分档key -> 名称和区间，如 小涨(1% ~ 3%)"""
+        intervals = self.intervals()
+        return {key: f"{self.labels.get(key, {}).get('name', key)}({intervals.get(key, '')})" for key in self.keys()}
+
+    def scenario_descriptions(self) -> Dict[str, str]:
+        """分档key -> 场景描述"""
+        return {key: f"今天{name}，明天概率情况" for key, name in self.category_names().items()}
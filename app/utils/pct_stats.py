@@ -0,0 +1,214 @@
+import os
+import glob
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from app.utils.logger import setup_logger
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 统计分布的涨跌幅指标: 时间段内最大涨幅、最小涨幅、收盘涨幅（%）
+PCT_METRICS = ['max_pct', 'min_pct', 'close_pct']
+
+# 固定直方图: -20% ~ 20% 每 0.1% 一档，两端各有一个溢出档（超出范围的值用最小值/最大值插值）
+HIST_EDGES = np.round(np.arange(-200, 201) * 0.1, 1)
+N_BINS = len(HIST_EDGES) + 1
+
+# 默认输出的分位数
+DEFAULT_QUANTILES = {'p10': 0.1, 'p25': 0.25, 'median': 0.5, 'p75': 0.75, 'p90': 0.9}
+
+# 概率结果中保存的分布字段 -> 显示名称（概率文件的列名）
+DISTRIBUTION_FIELDS = {
+    'max_pct_median': '最大涨幅中位数',
+    'min_pct_median': '最小涨幅中位数',
+    'close_pct_median': '收盘涨幅中位数',
+    'close_pct_p10': '收盘涨幅P10',
+    'close_pct_p90': '收盘涨幅P90',
+    'close_pct_std': '收盘涨幅标准差',
+}
+
+Key = Tuple[str, str]
+
+
+class PctStats:
+    """一个 (涨跌幅分类, 时间段) 下各涨跌幅指标的可合并统计
+
+    保存样本数、和、平方和、最小值、最大值和固定直方图，两个统计相加就是合并后的统计，
+    与样本顺序和分几批计算无关，不需要保留原始样本就能得到均值、标准差和分位数。
+    """
+
+    def __init__(self):
+        metrics = len(PCT_METRICS)
+        self.count = np.zeros(metrics, dtype=np.int64)
+        self.sum = np.zeros(metrics, dtype=np.float64)
+        self.sumsq = np.zeros(metrics, dtype=np.float64)
+        self.min = np.full(metrics, np.inf, dtype=np.float64)
+        self.max = np.full(metrics, -np.inf, dtype=np.float64)
+        self.hist = np.zeros((metrics, N_BINS), dtype=np.int64)
+
+    def add(self, values: Sequence[float]) -> None:
+        """加入一个样本，values 按 PCT_METRICS 顺序，NaN 跳过"""
+        self.add_many(np.asarray(values, dtype=np.float64).reshape(1, -1))
+
+    def add_many(self, values: np.ndarray) -> None:
+        """加入多个样本 [n, len(PCT_METRICS)]"""
+        for j in range(len(PCT_METRICS)):
+            column = values[:, j]
+            column = column[~np.isnan(column)]
+            if not len(column):
+                continue
+            self.count[j] += len(column)
+            self.sum[j] += column.sum()
+            self.sumsq[j] += np.square(column).sum()
+            self.min[j] = min(self.min[j], column.min())
+            self.max[j] = max(self.max[j], column.max())
+            self.hist[j] += np.bincount(np.searchsorted(HIST_EDGES, column, side='right'), minlength=N_BINS)
+
+    def merge(self, other: 'PctStats') -> None:
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.hist += other.hist
+
+    def mean(self, metric: str) -> float:
+        j = PCT_METRICS.index(metric)
+        return float(self.sum[j] / self.count[j]) if self.count[j] else 0.0
+
+    def std(self, metric: str) -> float:
+        j = PCT_METRICS.index(metric)
+        if not self.count[j]:
+            return 0.0
+        mean = self.sum[j] / self.count[j]
+        return float(np.sqrt(max(self.sumsq[j] / self.count[j] - mean * mean, 0.0)))
+
+    def quantile(self, metric: str, q: float) -> float:
+        """按直方图线性插值估计分位数，误差不超过一档（0.1%）"""
+        j = PCT_METRICS.index(metric)
+        n = self.count[j]
+        if not n:
+            return 0.0
+        cumulative = np.cumsum(self.hist[j])
+        target = q * n
+        b = int(np.searchsorted(cumulative, target, side='left'))
+        b = min(b, N_BINS - 1)
+        # 档 b 的范围，溢出档用最小值/最大值作为边界
+        low = HIST_EDGES[b - 1] if b > 0 else self.min[j]
+        high = HIST_EDGES[b] if b < len(HIST_EDGES) else self.max[j]
+        low, high = max(low, self.min[j]), min(high, self.max[j])
+        before = cumulative[b - 1] if b > 0 else 0
+        in_bin = self.hist[j, b]
+        fraction = (target - before) / in_bin if in_bin else 0.0
+        return float(low + (high - low) * min(max(fraction, 0.0), 1.0))
+
+    def summary(self, quantiles: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        """各指标的样本数、均值、标准差、最小值、最大值和分位数，如 close_pct_median"""
+        quantiles = DEFAULT_QUANTILES if quantiles is None else quantiles
+        result = {}
+        for j, metric in enumerate(PCT_METRICS):
+            if not self.count[j]:
+                continue
+            result[f"{metric}_count"] = int(self.count[j])
+            result[f"{metric}_mean"] = round(self.mean(metric), 2)
+            result[f"{metric}_std"] = round(self.std(metric), 2)
+            result[f"{metric}_min"] = round(float(self.min[j]), 2)
+            result[f"{metric}_max"] = round(float(self.max[j]), 2)
+            for name, q in quantiles.items():
+                result[f"{metric}_{name}"] = round(self.quantile(metric, q), 2)
+        return result
+
+
+class PctStatsTable:
+    """按 (涨跌幅分类, 时间段) 保存的涨跌幅分布统计
+
+    不同时间周期、股票或工作进程的结果可以直接合并，合并的代价与样本数无关。
+    """
+
+    def __init__(self):
+        self.cells: Dict[Key, PctStats] = {}
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def cell(self, category: str, time_key: str) -> PctStats:
+        key = (category, time_key)
+        if key not in self.cells:
+            self.cells[key] = PctStats()
+        return self.cells[key]
+
+    def get(self, category: str, time_key: str) -> Optional[PctStats]:
+        return self.cells.get((category, time_key))
+
+    def add(self, category: str, time_key: str, values: Sequence[float]) -> None:
+        self.cell(category, time_key).add(values)
+
+    def merge(self, other: 'PctStatsTable') -> None:
+        for (category, time_key), stats in other.cells.items():
+            self.cell(category, time_key).merge(stats)
+
+    def save(self, file_path: str) -> None:
+        keys = list(self.cells)
+        cells = [self.cells[key] for key in keys]
+
+        def stack(name: str, dtype) -> np.ndarray:
+            shape = (0, len(PCT_METRICS), N_BINS) if name == 'hist' else (0, len(PCT_METRICS))
+            return np.stack([getattr(cell, name) for cell in cells]).astype(dtype) if cells else np.empty(shape, dtype)
+
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        tmp_path = f"{file_path}.tmp.npz"
+        # 单只股票的样本数不超过int32，直方图大部分是0，压缩后很小
+        np.savez_compressed(tmp_path, categories=np.array([key[0] for key in keys]),
+                            time_keys=np.array([key[1] for key in keys]), metrics=np.array(PCT_METRICS),
+                            edges=HIST_EDGES, count=stack('count', np.int64), sum=stack('sum', np.float64),
+                            sumsq=stack('sumsq', np.float64), min=stack('min', np.float64),
+                            max=stack('max', np.float64), hist=stack('hist', np.int32))
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path: str) -> 'PctStatsTable':
+        table = cls()
+        with np.load(file_path) as data:
+            if data['metrics'].tolist() != PCT_METRICS or not np.array_equal(data['edges'], HIST_EDGES):
+                raise ValueError("涨跌幅分布统计的格式与当前版本不一致")
+            for i, (category, time_key) in enumerate(zip(data['categories'].tolist(), data['time_keys'].tolist())):
+                stats = table.cell(category, time_key)
+                stats.count = data['count'][i].astype(np.int64)
+                stats.sum = data['sum'][i].astype(np.float64)
+                stats.sumsq = data['sumsq'][i].astype(np.float64)
+                stats.min = data['min'][i].astype(np.float64)
+                stats.max = data['max'][i].astype(np.float64)
+                stats.hist = data['hist'][i].astype(np.int64)
+        return table
+
+
+def get_stats_dir() -> str:
+    return os.path.join(os.getenv('DATA_DIR', './data'), 'pct_stats')
+
+
+def stats_file_path(ts_code: str, time_period: str) -> str:
+    """单只股票单个时间周期的分布统计文件"""
+    return os.path.join(get_stats_dir(), f"{ts_code}_{time_period}.npz")
+
+
+def merge_stats_files(time_period: str, ts_codes: Optional[Iterable[str]] = None) -> Tuple[PctStatsTable, int]:
+    """合并多只股票的分布统计，ts_codes 不指定则合并该时间周期的所有股票
+
+    Returns:
+        (合并后的统计, 合并的股票数)
+    """
+    if ts_codes is None:
+        file_paths: List[str] = glob.glob(os.path.join(get_stats_dir(), f"*_{time_period}.npz"))
+    else:
+        file_paths = [stats_file_path(ts_code, time_period) for ts_code in ts_codes]
+    merged = PctStatsTable()
+    stocks = 0
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            continue
+        try:
+            merged.merge(PctStatsTable.load(file_path))
+            stocks += 1
+        except Exception as e:
+            logger.error("读取涨跌幅分布统计%s失败: %s", file_path, e)
+    return merged, stocks
@@ -0,0 +1,176 @@
+import os
+import json
+import asyncio
+import threading
+import itertools
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from app.utils.logger import setup_logger
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 推送的概率字段，比较上次推送的值只推送变化的时间段
+PUSH_FIELDS = ['up_prob', 'down_prob', 'equal_prob', 'total']
+
+
+def format_event(event: str, data: Dict[str, Any], event_id: Optional[int] = None) -> bytes:
+    """编码成一条 Server-Sent Events 消息"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}"]
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscription:
+    """一个订阅连接: 关注的股票和待发送的消息队列"""
+
+    def __init__(self, subscription_id: int, ts_codes: Set[str], preopen: bool, queue_size: int):
+        self.id = subscription_id
+        self.ts_codes = ts_codes
+        self.preopen = preopen
+        self.queue: 'asyncio.Queue[bytes]' = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def put(self, message: bytes) -> None:
+        """放入消息，队列满（客户端读得太慢）时丢弃最旧的消息，不阻塞发布"""
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+
+class UpdatePublisher:
+    """进程内的概率更新发布器
+
+    分析线程重新计算股票结果、或生成盘前快照时调用 publish_*，发布器在事件循环中
+    按股票代码索引找到关注该股票的订阅，每条消息只编码一次后放入各订阅的队列。
+    没有订阅时发布直接返回；慢客户端的队列满后丢弃最旧的消息，不影响其他连接和REST接口。
+    概率只推送与上次推送相比有变化的 (时间周期, 涨跌幅分类, 时间段)。
+    """
+
+    def __init__(self, queue_size: Optional[int] = None, preopen_top: Optional[int] = None):
+        self.queue_size = queue_size or int(os.getenv('SUBSCRIBE_QUEUE_SIZE', '100'))
+        self.preopen_top = preopen_top if preopen_top is not None else int(os.getenv('SUBSCRIBE_PREOPEN_TOP', '20'))
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscriptions: Dict[int, Subscription] = {}
+        # 股票代码 -> 关注该股票的订阅ID
+        self.topics: Dict[str, Set[int]] = {}
+        self.preopen_subscribers: Set[int] = set()
+        # 股票代码 -> 上次推送的概率值，只保存有订阅的股票
+        self.last_values: Dict[str, Dict[Tuple[str, str, str], Tuple[Any, ...]]] = {}
+        self.ids = itertools.count(1)
+        self.event_ids = itertools.count(1)
+
+    def subscribe(self, ts_codes: Iterable[str], preopen: bool = False) -> Subscription:
+        """注册订阅，需在事件循环中调用"""
+        self.loop = asyncio.get_running_loop()
+        subscription = Subscription(next(self.ids), set(ts_codes), preopen, self.queue_size)
+        with self.lock:
+            self.subscriptions[subscription.id] = subscription
+            for ts_code in subscription.ts_codes:
+                self.topics.setdefault(ts_code, set()).add(subscription.id)
+            if preopen:
+                self.preopen_subscribers.add(subscription.id)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self.lock:
+            self.subscriptions.pop(subscription.id, None)
+            self.preopen_subscribers.discard(subscription.id)
+            for ts_code in subscription.ts_codes:
+                subscribers = self.topics.get(ts_code)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription.id)
+                if not subscribers:
+                    del self.topics[ts_code]
+                    self.last_values.pop(ts_code, None)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "subscriptions": len(self.subscriptions),
+                "stocks": len(self.topics),
+                "preopen_subscriptions": len(self.preopen_subscribers),
+                "dropped": sum(subscription.dropped for subscription in self.subscriptions.values()),
+            }
+
+    def _dispatch(self, subscription_ids: List[int], messages: Any) -> None:
+        """在事件循环中放入各订阅的队列，messages 为一条公共消息或 {订阅ID: 消息}"""
+        for subscription_id in subscription_ids:
+            subscription = self.subscriptions.get(subscription_id)
+            if subscription is None:
+                continue
+            message = messages.get(subscription_id) if isinstance(messages, dict) else messages
+            if message is not None:
+                subscription.put(message)
+
+    def _schedule(self, subscription_ids: List[int], messages: Any) -> None:
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._dispatch, subscription_ids, messages)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def publish_probability(self, ts_code: str, results: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]]) -> None:
+        """股票结果重新计算后调用，可在任意线程中调用
+
+        Args:
+            results: 重新计算的 T+1 概率 {时间周期: {涨跌幅分类: {时间段: 概率数据}}}
+        """
+        if ts_code not in self.topics:
+            return
+        try:
+            with self.lock:
+                subscription_ids = list(self.topics.get(ts_code, ()))
+                if not subscription_ids:
+                    return
+                last = self.last_values.setdefault(ts_code, {})
+                changes: Dict[str, Dict[str, Dict[str, Dict[str, Any]]]] = {}
+                for time_period, period_data in results.items():
+                    for category, time_data in period_data.items():
+                        for time_key, prob_data in time_data.items():
+                            values = tuple(prob_data.get(field, 0) for field in PUSH_FIELDS)
+                            if last.get((time_period, category, time_key)) == values:
+                                continue
+                            last[(time_period, category, time_key)] = values
+                            changes.setdefault(time_period, {}).setdefault(category, {})[time_key] = \
+                                dict(zip(PUSH_FIELDS, values))
+            if not changes:
+                return
+            message = format_event('probability', {"ts_code": ts_code, "changes": changes}, next(self.event_ids))
+            self._schedule(subscription_ids, message)
+        except Exception as e:
+            logger.error("推送股票%s的概率更新失败: %s", ts_code, e)
+
+    def publish_preopen(self, snapshot: Dict[str, Any]) -> None:
+        """盘前快照生成后调用，关注了股票的订阅收到这些股票的排名，否则收到前 preopen_top 名"""
+        if not self.preopen_subscribers:
+            return
+        try:
+            with self.lock:
+                subscriptions = [self.subscriptions[subscription_id] for subscription_id in self.preopen_subscribers
+                                 if subscription_id in self.subscriptions]
+            items = snapshot.get("items", [])
+            by_code = {item["ts_code"]: item for item in items}
+            meta = {key: value for key, value in snapshot.items() if key != "items"}
+            event_id = next(self.event_ids)
+            top_message = format_event('preopen', {**meta, "items": items[:self.preopen_top]}, event_id)
+            messages = {}
+            for subscription in subscriptions:
+                if not subscription.ts_codes:
+                    messages[subscription.id] = top_message
+                    continue
+                watched = [by_code[ts_code] for ts_code in subscription.ts_codes if ts_code in by_code]
+                watched.sort(key=lambda item: item["rank"])
+                messages[subscription.id] = format_event('preopen', {**meta, "items": watched}, event_id)
+            self._schedule(list(messages), messages)
+        except Exception as e:
+            logger.error("推送盘前快照失败: %s", e)
+
+
+# 进程内共享的发布器
+update_publisher = UpdatePublisher()
@@ -0,0 +1,127 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+from app.utils.logger import setup_logger
+
+# 配置日志
+logger = setup_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_requests (
+    token_key TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    requested_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rate_requests ON rate_requests (token_key, endpoint, requested_at);
+CREATE TABLE IF NOT EXISTS rate_cooldowns (
+    token_key TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    until REAL NOT NULL,
+    PRIMARY KEY (token_key, endpoint)
+);
+"""
+
+# 滑动窗口长度（秒），与每分钟限制一致
+WINDOW_SECONDS = 60
+
+
+def token_key(token: str) -> str:
+    """token的哈希，数据库中不保存token原文"""
+    return hashlib.sha1(token.encode('utf-8')).hexdigest()[:16]
+
+
+class RateLedger:
+    """跨进程共享的接口请求记录
+
+    保存在与任务队列相同的 SQLite 文件中（TUSHARE_RATE_DB 可单独指定），同一台机器的多个进程
+    或挂载同一数据目录的多台机器使用同一个token时，共用该token各接口每分钟的额度和超限暂停时间，
+    N个工作进程合计不会超过一个token的频率限制。低优先级请求的额度上限按所有进程的请求数计算，
+    为交互请求保留的额度在进程之间同样有效。
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._initialized = False
+        self._init_lock = threading.Lock()
+
+    def get_db_path(self) -> str:
+        return self.db_path or os.getenv('TUSHARE_RATE_DB') or os.getenv('QUEUE_DB') or \
+            os.path.join(os.getenv('DATA_DIR', './data'), 'queue', 'refresh.db')
+
+    def _connection(self) -> sqlite3.Connection:
+        """每个线程一个连接"""
+        db_path = self.get_db_path()
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and getattr(self._local, 'db_path', None) == db_path:
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # 不使用WAL，网络文件系统上WAL的共享内存不可靠
+        conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        with self._init_lock:
+            if not self._initialized:
+                conn.executescript(SCHEMA)
+                self._initialized = True
+        self._local.conn = conn
+        self._local.db_path = db_path
+        return conn
+
+    def try_acquire(self, key: str, endpoint: str, limit: int, consume: bool = True) -> float:
+        """所有进程最近一分钟的请求数小于limit时记录一次请求并返回0，否则返回还需要等待的秒数
+
+        token该接口在暂停中时返回剩余的暂停时间
+        """
+        conn = self._connection()
+        now = time.time()
+        if consume:
+            conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT until FROM rate_cooldowns WHERE token_key = ? AND endpoint = ?",
+                               (key, endpoint)).fetchone()
+            if row and row[0] > now:
+                wait_time = row[0] - now
+            else:
+                times: List[float] = [r[0] for r in conn.execute(
+                    "SELECT requested_at FROM rate_requests WHERE token_key = ? AND endpoint = ? "
+                    "AND requested_at > ? ORDER BY requested_at", (key, endpoint, now - WINDOW_SECONDS))]
+                if len(times) < limit:
+                    wait_time = 0.0
+                    if consume:
+                        conn.execute("DELETE FROM rate_requests WHERE token_key = ? AND endpoint = ? "
+                                     "AND requested_at <= ?", (key, endpoint, now - WINDOW_SECONDS))
+                        conn.execute("INSERT INTO rate_requests VALUES (?, ?, ?)", (key, endpoint, now))
+                elif limit <= 0:
+                    wait_time = float(WINDOW_SECONDS)
+                else:
+                    wait_time = max(WINDOW_SECONDS - (now - times[len(times) - limit]), 0.001)
+            if consume:
+                conn.execute('COMMIT')
+            return wait_time
+        except Exception:
+            if consume:
+                conn.execute('ROLLBACK')
+            raise
+
+    def recent_count(self, key: str, endpoint: str) -> int:
+        """所有进程最近一分钟的请求数"""
+        row = self._connection().execute(
+            "SELECT COUNT(*) FROM rate_requests WHERE token_key = ? AND endpoint = ? AND requested_at > ?",
+            (key, endpoint, time.time() - WINDOW_SECONDS)).fetchone()
+        return row[0]
+
+    def set_cooldown(self, key: str, endpoint: str, until: float) -> None:
+        """token该接口超出限制，所有进程暂停到until"""
+        self._connection().execute(
+            "INSERT INTO rate_cooldowns VALUES (?, ?, ?) ON CONFLICT (token_key, endpoint) "
+            "DO UPDATE SET until = MAX(until, excluded.until)", (key, endpoint, until))
+
+
+def shared_limits_enabled() -> bool:
+    return os.getenv('TUSHARE_SHARED_LIMITS', 'true').lower() == 'true'
+
+
+# 进程内共享的请求记录
+rate_ledger = RateLedger()
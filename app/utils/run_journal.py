@@ -0,0 +1,137 @@
+import os
+import json
+import datetime
+import threading
+from typing import Dict, Any, Optional, Set, Tuple
+from app.utils.logger import setup_logger
+from app.utils.day_summary import DaySummaryTable
+
+# 配置日志
+logger = setup_logger(__name__)
+
+
+class RunJournal:
+    """全量刷新任务日志
+
+    以 JSON Lines 追加写入 {DATA_DIR}/journal/{run_id}.jsonl，记录:
+    - done: 已完成的股票
+    - gap: 请求失败的 (ts_code, trade_date, endpoint)，失败不再被当作"没有数据"
+    - filled: 之前失败、重新请求成功的缺口
+    进程中断后用同一个 run_id 重新打开即可从断点继续，并只补拉缺口数据。
+    有缺口的股票会把已获取数据的汇总保存到 {run_id}/ 目录，补拉时复用。
+    """
+
+    def __init__(self, run_id: Optional[str] = None, journal_dir: Optional[str] = None):
+        self.run_id = run_id or f"refresh_{datetime.datetime.now().strftime('%Y%m%d')}"
+        self.journal_dir = journal_dir or os.path.join(os.getenv('DATA_DIR', './data'), 'journal')
+        os.makedirs(self.journal_dir, exist_ok=True)
+        self.path = os.path.join(self.journal_dir, f"{self.run_id}.jsonl")
+        self.cache_dir = os.path.join(self.journal_dir, self.run_id)
+        self.lock = threading.Lock()
+        self.completed: Set[str] = set()
+        self.gaps: Dict[str, Set[Tuple[str, str]]] = {}
+        # 已回放到的文件位置
+        self.offset = 0
+        self._load()
+
+    def _load(self) -> None:
+        """回放已有日志，恢复断点状态"""
+        if not self._replay():
+            return
+        logger.info("恢复刷新任务%s: 已完成%s只股票，%s只股票有缺口",
+                    self.run_id, len(self.completed), len(self.gaps))
+
+    def _replay(self) -> bool:
+        """从上次回放的位置继续回放日志，返回是否有新记录"""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # 只回放完整的行，没写完的最后一行留到下次
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 进程中断时最后一行可能没有写完整
+                continue
+            self._apply(record)
+        self.offset += end
+        return end > 0
+
+    def refresh(self) -> None:
+        """读取其他进程追加的记录，多个进程共用同一个任务日志时使用"""
+        with self.lock:
+            self._replay()
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        event = record.get('event')
+        ts_code = record.get('ts_code')
+        if event == 'done':
+            self.completed.add(ts_code)
+        elif event == 'gap':
+            self.gaps.setdefault(ts_code, set()).add((record['trade_date'], record['endpoint']))
+        elif event == 'filled':
+            stock_gaps = self.gaps.get(ts_code)
+            if stock_gaps:
+                stock_gaps.discard((record['trade_date'], record['endpoint']))
+                if not stock_gaps:
+                    del self.gaps[ts_code]
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        record['time'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock:
+            self._apply(record)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def is_done(self, ts_code: str) -> bool:
+        return ts_code in self.completed
+
+    def gaps_for(self, ts_code: str) -> Set[Tuple[str, str]]:
+        """获取股票未补齐的缺口 {(trade_date, endpoint)}"""
+        with self.lock:
+            return set(self.gaps.get(ts_code, ()))
+
+    def mark_done(self, ts_code: str) -> None:
+        self._append({'event': 'done', 'ts_code': ts_code})
+
+    def record_gap(self, ts_code: str, trade_date: str, endpoint: str, error: str) -> None:
+        """记录请求失败的数据"""
+        self._append({'event': 'gap', 'ts_code': ts_code, 'trade_date': trade_date,
+                      'endpoint': endpoint, 'error': error})
+
+    def record_success(self, ts_code: str, trade_date: str, endpoint: str) -> None:
+        """请求成功，如果之前是缺口则记录为已补齐"""
+        with self.lock:
+            is_gap = (trade_date, endpoint) in self.gaps.get(ts_code, ())
+        if is_gap:
+            self._append({'event': 'filled', 'ts_code': ts_code, 'trade_date': trade_date, 'endpoint': endpoint})
+
+    def save_fetch_cache(self, ts_code: str, summary: DaySummaryTable) -> None:
+        """保存有缺口股票已获取的数据，补拉时只请求缺口"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            summary.save(os.path.join(self.cache_dir, f"{ts_code}.npz"))
+        except Exception as e:
+            logger.error("保存股票%s已获取数据失败: %s", ts_code, e)
+
+    def load_fetch_cache(self, ts_code: str) -> Optional[DaySummaryTable]:
+        file_path = os.path.join(self.cache_dir, f"{ts_code}.npz")
+        if not os.path.exists(file_path):
+            return None
+        try:
+            return DaySummaryTable.load(file_path)
+        except Exception as e:
+            logger.error("读取股票%s已获取数据失败: %s", ts_code, e)
+            return None
+
+    def summary(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'run_id': self.run_id,
+                'completed': len(self.completed),
+                'stocks_with_gaps': len(self.gaps),
+                'gaps': sum(len(g) for g in self.gaps.values()),
+            }
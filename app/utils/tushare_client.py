@@ -0,0 +1,564 @@
+import os
+import re
+import time
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from app.utils.logger import setup_logger
+from app.utils.rate_ledger import RateLedger, rate_ledger, token_key, shared_limits_enabled
+
+# 配置日志
+logger = setup_logger(__name__)
+
+# 每个token各接口每分钟的请求限制，未列出的接口不限制
+ENDPOINT_LIMITS = {
+    'stk_mins': 500,
+    'stk_auction_o': 500,
+}
+
+# 超出频率限制的错误，暂停该token该接口一分钟
+MINUTE_QUOTA_ERROR = re.compile(r'每分钟最多访问')
+# 超出每天次数或没有接口权限的错误，暂停更长时间
+DAILY_QUOTA_ERROR = re.compile(r'每天最多访问|每日最多访问|没有接口访问权限|积分不足')
+
+# 请求优先级和权重: 交互请求（接口调用）、预热、后台批量刷新
+PRIORITY_CLASSES = ('interactive', 'warmup', 'bulk')
+DEFAULT_PRIORITY_WEIGHTS = 'interactive:8,warmup:3,bulk:1'
+
+# 当前线程（协程）发出请求的优先级，未设置时为交互请求
+_request_priority: contextvars.ContextVar[str] = contextvars.ContextVar('tushare_request_priority',
+                                                                       default='interactive')
+
+
+@contextmanager
+def request_priority(priority: str) -> Iterator[None]:
+    """在with块内以指定优先级请求接口
+
+    优先级保存在contextvars中，新建的线程不会继承，提交到线程池时用
+    contextvars.copy_context().run 传递。
+    """
+    if priority not in PRIORITY_CLASSES:
+        raise ValueError(f"不支持的请求优先级: {priority}")
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+def current_priority() -> str:
+    return _request_priority.get()
+
+
+def parse_priority_weights(value: str) -> Dict[str, float]:
+    """解析 interactive:8,warmup:3,bulk:1 格式的权重，未配置的优先级权重为1"""
+    weights = {priority: 1.0 for priority in PRIORITY_CLASSES}
+    for item in value.split(','):
+        if ':' in item:
+            priority, weight = item.split(':', 1)
+            if priority.strip() in weights:
+                weights[priority.strip()] = max(float(weight), 0.01)
+    return weights
+
+
+class RequestLimiter:
+    """请求限制器，用于限制API请求频率"""
+
+    def __init__(self, max_requests_per_minute=500):
+        self.max_requests = max_requests_per_minute
+        self.request_times = []
+        self.lock = threading.Lock()
+
+    def try_acquire(self, limit: Optional[int] = None, consume: bool = True) -> float:
+        """没有超过限制时记录一次请求并返回0，否则返回还需要等待的秒数
+
+        Args:
+            limit: 本次请求可用的额度，默认为全部额度，低优先级请求不能使用为交互请求保留的额度
+            consume: 为False时只检查不记录
+        """
+        limit = self.max_requests if limit is None else min(limit, self.max_requests)
+        with self.lock:
+            now = time.time()
+            # 清理一分钟前的请求记录
+            self.request_times = [t for t in self.request_times if now - t < 60]
+            if len(self.request_times) < limit:
+                if consume:
+                    self.request_times.append(now)
+                return 0.0
+            if limit <= 0:
+                return 60.0
+            return max(60 - (now - self.request_times[len(self.request_times) - limit]), 0.001)
+
+    def recent_count(self) -> int:
+        """最近一分钟的请求数"""
+        with self.lock:
+            now = time.time()
+            return sum(1 for t in self.request_times if now - t < 60)
+
+    def wait_if_needed(self):
+        """如果需要，等待一段时间以确保不超过请求限制"""
+        while True:
+            wait_time = self.try_acquire()
+            if not wait_time:
+                return
+            time.sleep(wait_time)
+
+
+class SharedRequestLimiter(RequestLimiter):
+    """按所有进程的请求记录限制频率（见 RateLedger）
+
+    共享记录读写失败时退回只按本进程的请求限制，不影响接口调用。
+    """
+
+    def __init__(self, ledger: RateLedger, key: str, endpoint: str, max_requests_per_minute: int = 500):
+        super().__init__(max_requests_per_minute)
+        self.ledger = ledger
+        self.key = key
+        self.endpoint = endpoint
+        self.shared = True
+
+    def _fallback(self, e: Exception) -> None:
+        if self.shared:
+            self.shared = False
+            logger.error("共享请求记录%s不可用，接口%s改为按进程限制频率: %s",
+                         self.ledger.get_db_path(), self.endpoint, e)
+
+    def try_acquire(self, limit: Optional[int] = None, consume: bool = True) -> float:
+        if not self.shared:
+            return super().try_acquire(limit, consume)
+        limit = self.max_requests if limit is None else min(limit, self.max_requests)
+        try:
+            return self.ledger.try_acquire(self.key, self.endpoint, limit, consume)
+        except Exception as e:
+            self._fallback(e)
+            return super().try_acquire(limit, consume)
+
+    def recent_count(self) -> int:
+        if not self.shared:
+            return super().recent_count()
+        try:
+            return self.ledger.recent_count(self.key, self.endpoint)
+        except Exception as e:
+            self._fallback(e)
+            return super().recent_count()
+
+    def set_cooldown(self, until: float) -> None:
+        if not self.shared:
+            return
+        try:
+            self.ledger.set_cooldown(self.key, self.endpoint, until)
+        except Exception as e:
+            self._fallback(e)
+
+
+class TokenSlot:
+    """token池中的一个token: 自己的客户端、各接口限制器、进行中的请求数和暂停时间
+
+    ledger 不为空时各接口的额度和暂停时间与其他进程共享
+    """
+
+    def __init__(self, token: str, ledger: Optional[RateLedger] = None):
+        self.token = token
+        self.api = None
+        self.lock = threading.Lock()
+        self.limiters: Dict[str, RequestLimiter] = {
+            endpoint: SharedRequestLimiter(ledger, token_key(token), endpoint, limit) if ledger is not None
+            else RequestLimiter(limit)
+            for endpoint, limit in ENDPOINT_LIMITS.items()
+        }
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+        # 接口 -> 暂停到的时间
+        self.cooldown_until: Dict[str, float] = {}
+
+    @property
+    def masked_token(self) -> str:
+        return f"{self.token[:4]}****{self.token[-4:]}" if len(self.token) > 8 else '****'
+
+    def get_api(self) -> Any:
+        if self.api is None:
+            with self.lock:
+                if self.api is None:
+                    import tushare as ts
+                    try:
+                        self.api = ts.pro_api(self.token)
+                        logger.info("Tushare API初始化成功: %s", self.masked_token)
+                    except Exception as e:
+                        logger.error("Tushare API初始化失败: %s", e)
+                        raise
+        return self.api
+
+    def cooldown_left(self, endpoint: str, now: float) -> float:
+        return max(self.cooldown_until.get(endpoint, 0) - now, 0)
+
+    def load(self, endpoint: str) -> int:
+        """负载: 进行中的请求数 + 该接口最近一分钟的请求数"""
+        limiter = self.limiters.get(endpoint)
+        return self.in_flight + (limiter.recent_count() if limiter else 0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "token": self.masked_token,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "quota_errors": self.quota_errors,
+            "recent": {endpoint: limiter.recent_count() for endpoint, limiter in self.limiters.items()},
+            "cooldown": {endpoint: round(until - now, 1) for endpoint, until in self.cooldown_until.items()
+                         if until > now},
+        }
+
+
+class ConcurrencyController:
+    """按AIMD调整一个接口同时进行的请求数（窗口）
+
+    - 请求成功且耗时不超过基准耗时的 latency_tolerance 倍: 窗口加 1/窗口，约每轮请求加1
+    - 超出频率限制: 窗口减半
+    - 其他错误或耗时明显变长: 窗口乘以 0.75
+    同一轮请求（约一个平均耗时）内最多减小一次，避免并发的多个失败把窗口连续减到最小。
+    窗口只限制同时进行的请求数，等待窗口的请求按与额度排队相同的优先级权重加权公平排队（FairScheduler），
+    交互请求多得窗口，后台批量请求也不会被持续的交互请求饿死。
+    """
+
+    def __init__(self, endpoint: str, initial: float, minimum: float, maximum: float,
+                 latency_tolerance: float, weights: Optional[Dict[str, float]] = None):
+        self.endpoint = endpoint
+        self.window = min(max(initial, minimum), maximum)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.scheduler = FairScheduler(weights or parse_priority_weights(DEFAULT_PRIORITY_WEIGHTS))
+        # 耗时的指数移动平均和基准（缓慢上升的最小值）
+        self.latency = 0.0
+        self.base_latency = 0.0
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+
+    def acquire(self, priority: str) -> None:
+        with self.cond:
+            entry = self.scheduler.push(self.endpoint, priority)
+            granted = False
+            try:
+                while self.in_flight >= int(self.window) or \
+                        self.scheduler.winner(self.endpoint, lambda p: True) is not entry:
+                    self.cond.wait(1.0)
+                granted = True
+                self.in_flight += 1
+            finally:
+                self.scheduler.remove(self.endpoint, entry, granted)
+                self.cond.notify_all()
+
+    def release(self, latency: Optional[float], throttled: bool = False, failed: bool = False) -> None:
+        """请求结束，latency为接口耗时（秒），没有调用接口时为None"""
+        with self.cond:
+            self.in_flight -= 1
+            now = time.time()
+            # 失败的请求通常很快返回，不计入耗时
+            if latency is not None and not throttled and not failed:
+                self.latency = latency if not self.latency else self.latency * 0.8 + latency * 0.2
+                if not self.base_latency or latency < self.base_latency:
+                    self.base_latency = latency
+                else:
+                    # 基准缓慢上升，接口整体变慢后不会一直减小窗口
+                    self.base_latency += (latency - self.base_latency) * 0.01
+            slow = latency is not None and self.base_latency and latency > self.base_latency * self.latency_tolerance
+            if throttled or failed or slow:
+                if now - self.last_decrease > max(self.latency, 0.1):
+                    self.window = max(self.window * (0.5 if throttled else 0.75), self.minimum)
+                    self.last_decrease = now
+                    self.decreases += 1
+                    logger.debug("接口%s并发窗口减小到%.1f", self.endpoint, self.window)
+            elif latency is not None:
+                self.window = min(self.window + 1 / self.window, self.maximum)
+                self.increases += 1
+            self.cond.notify_all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.cond:
+            return {
+                "window": round(self.window, 2),
+                "in_flight": self.in_flight,
+                "waiting": len(self.scheduler.waiting.get(self.endpoint, ())),
+                "latency_ms": round(self.latency * 1000, 1),
+                "base_latency_ms": round(self.base_latency * 1000, 1),
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class FairScheduler:
+    """加权公平排队
+
+    每个等待的请求按优先级权重计算虚拟完成时间 max(系统虚拟时间, 该优先级上一个请求的完成时间) + 1/权重，
+    有额度时先放行完成时间最小的请求，高权重的优先级得到更多额度，低权重的优先级也不会被饿死。
+    调用方需要持有外部锁。
+    """
+
+    def __init__(self, weights: Dict[str, float]):
+        self.weights = weights
+        self.virtual_time = 0.0
+        self.last_finish: Dict[str, float] = {}
+        self.sequence = itertools.count()
+        # 接口 -> 等待中的请求 [(完成时间, 序号, 优先级, 开始等待时间)]
+        self.waiting: Dict[str, List[Tuple[float, int, str, float]]] = {}
+        self.granted = {priority: 0 for priority in weights}
+        self.wait_seconds = {priority: 0.0 for priority in weights}
+        self.max_wait = {priority: 0.0 for priority in weights}
+
+    def push(self, endpoint: str, priority: str) -> Tuple[float, int, str, float]:
+        finish = max(self.virtual_time, self.last_finish.get(priority, 0.0)) + 1 / self.weights[priority]
+        self.last_finish[priority] = finish
+        entry = (finish, next(self.sequence), priority, time.time())
+        self.waiting.setdefault(endpoint, []).append(entry)
+        return entry
+
+    def waiting_priorities(self, endpoint: str) -> set:
+        return {entry[2] for entry in self.waiting.get(endpoint, ())}
+
+    def winner(self, endpoint: str, eligible: Callable[[str], bool]) -> Optional[Tuple[float, int, str, float]]:
+        """当前有额度的优先级中完成时间最小的请求"""
+        return min((entry for entry in self.waiting.get(endpoint, ()) if eligible(entry[2])), default=None)
+
+    def remove(self, endpoint: str, entry: Tuple[float, int, str, float], granted: bool) -> None:
+        self.waiting[endpoint].remove(entry)
+        if not granted:
+            return
+        finish, _, priority, queued_at = entry
+        self.virtual_time = max(self.virtual_time, finish - 1 / self.weights[priority])
+        waited = time.time() - queued_at
+        self.granted[priority] += 1
+        self.wait_seconds[priority] += waited
+        self.max_wait[priority] = max(self.max_wait[priority], waited)
+
+    def to_dict(self) -> Dict[str, Any]:
+        waiting = [entry[2] for entries in self.waiting.values() for entry in entries]
+        return {
+            priority: {
+                "weight": self.weights[priority],
+                "waiting": waiting.count(priority),
+                "granted": self.granted[priority],
+                "avg_wait": round(self.wait_seconds[priority] / self.granted[priority], 3) if self.granted[priority] else 0,
+                "max_wait": round(self.max_wait[priority], 3),
+            } for priority in self.weights
+        }
+
+
+class TushareClient:
+    """Tushare pro 接口的延迟初始化封装，支持多个token
+
+    导入本模块不会导入 tushare，第一次调用接口时才导入 tushare 并创建 pro_api 客户端，
+    用法与 pro_api 返回的对象相同:
+
+        pro = TushareClient()
+        pro.daily(ts_code='000001.SZ', start_date='20180701', end_date='20180718')
+
+    TUSHARE_TOKENS 配置多个token（逗号分隔，未配置时使用 TUSHARE_TOKEN），每个token有自己的
+    接口频率限制，请求分配给负载最低的token。返回超出频率或次数限制的错误时，
+    该token的该接口暂停一段时间，请求改用其他token重试。
+
+    有频率限制的接口按优先级（request_priority）加权公平排队，并为交互请求保留
+    TUSHARE_INTERACTIVE_RESERVE（默认0.2）比例的额度，后台批量刷新占满其余额度时，
+    接口请求不需要排在几千个批量请求之后。
+
+    TUSHARE_SHARED_LIMITS（默认true）时有频率限制的接口的额度和暂停时间记录在共享的 SQLite 文件中
+    （见 RateLedger），多个工作进程、多台机器和接口服务使用相同的token时合计不超过限制，
+    保留的额度也按所有进程的请求数计算。
+    """
+
+    def __init__(self, token: Optional[str] = None, ledger: Optional[RateLedger] = None):
+        self._token = token
+        self.ledger = ledger if ledger is not None else (rate_ledger if shared_limits_enabled() else None)
+        self._slots: Optional[List[TokenSlot]] = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition()
+        self.interactive_reserve = min(max(float(os.getenv('TUSHARE_INTERACTIVE_RESERVE', '0.2')), 0.0), 1.0)
+        self.scheduler = FairScheduler(parse_priority_weights(
+            os.getenv('TUSHARE_PRIORITY_WEIGHTS', DEFAULT_PRIORITY_WEIGHTS)))
+        # 接口 -> 并发窗口
+        self.controllers: Dict[str, ConcurrencyController] = {}
+
+    @property
+    def token(self) -> str:
+        # 每次读取环境变量，保证 load_dotenv 在导入之后执行也能生效
+        return self._token if self._token is not None else os.getenv('TUSHARE_TOKEN', '')
+
+    @property
+    def tokens(self) -> List[str]:
+        if self._token is not None:
+            return [self._token]
+        tokens = [token.strip() for token in os.getenv('TUSHARE_TOKENS', '').split(',') if token.strip()]
+        return tokens or [self.token]
+
+    @property
+    def slots(self) -> List[TokenSlot]:
+        if self._slots is None:
+            with self._lock:
+                if self._slots is None:
+                    self._slots = [TokenSlot(token, self.ledger) for token in self.tokens]
+                    logger.info("Tushare token池共%s个token", len(self._slots))
+        return self._slots
+
+    @property
+    def size(self) -> int:
+        return len(self.slots)
+
+    @property
+    def is_initialized(self) -> bool:
+        return self._slots is not None and any(slot.api is not None for slot in self._slots)
+
+    @property
+    def max_concurrency(self) -> int:
+        """单个接口同时进行的请求数上限，随token数增加"""
+        return int(os.getenv('TUSHARE_MAX_CONCURRENCY', '32')) * self.size
+
+    def controller(self, endpoint: str) -> ConcurrencyController:
+        controller = self.controllers.get(endpoint)
+        if controller is None:
+            size = self.size
+            with self._lock:
+                controller = self.controllers.get(endpoint)
+                if controller is None:
+                    controller = ConcurrencyController(
+                        endpoint,
+                        initial=float(os.getenv('TUSHARE_INITIAL_CONCURRENCY', '10')) * size,
+                        minimum=1,
+                        maximum=int(os.getenv('TUSHARE_MAX_CONCURRENCY', '32')) * size,
+                        latency_tolerance=float(os.getenv('TUSHARE_LATENCY_TOLERANCE', '3')),
+                        weights=self.scheduler.weights)
+                    self.controllers[endpoint] = controller
+        return controller
+
+    def get_api(self) -> Any:
+        """获取第一个token的 pro_api 客户端，首次调用时初始化，初始化失败会抛出异常，下次调用重试"""
+        return self.slots[0].get_api()
+
+    def _priority_limit(self, limiter: RequestLimiter, priority: str) -> int:
+        """该优先级可以使用的每分钟额度，交互请求可以使用保留额度"""
+        if priority == 'interactive':
+            return limiter.max_requests
+        return int(limiter.max_requests * (1 - self.interactive_reserve))
+
+    def _try_take(self, endpoint: str, priority: str, consume: bool) -> Tuple[Optional[TokenSlot], float]:
+        """在负载最低的可用token上占用一次额度，没有额度时返回最短等待时间"""
+        now = time.time()
+        waits = []
+        for slot in sorted(self.slots, key=lambda s: s.load(endpoint)):
+            cooldown = slot.cooldown_left(endpoint, now)
+            if cooldown:
+                waits.append(cooldown)
+                continue
+            limiter = slot.limiters.get(endpoint)
+            wait_time = limiter.try_acquire(self._priority_limit(limiter, priority), consume) if limiter else 0.0
+            if not wait_time:
+                if consume:
+                    with slot.lock:
+                        slot.in_flight += 1
+                        slot.requests += 1
+                return slot, 0.0
+            waits.append(wait_time)
+        return None, min(waits)
+
+    def _acquire(self, endpoint: str) -> TokenSlot:
+        """选择可用且负载最低的token，并占用该token该接口的一次请求额度"""
+        if endpoint not in ENDPOINT_LIMITS:
+            # 没有频率限制的接口不排队，只等待暂停的token恢复
+            while True:
+                slot, wait_time = self._try_take(endpoint, current_priority(), True)
+                if slot is not None:
+                    return slot
+                time.sleep(wait_time)
+
+        priority = current_priority()
+        with self._cond:
+            entry = self.scheduler.push(endpoint, priority)
+            granted = False
+            try:
+                while True:
+                    waits = {p: self._try_take(endpoint, p, False)[1]
+                             for p in self.scheduler.waiting_priorities(endpoint)}
+                    if self.scheduler.winner(endpoint, lambda p: not waits[p]) is entry:
+                        slot, _ = self._try_take(endpoint, priority, True)
+                        if slot is not None:
+                            granted = True
+                            return slot
+                    # 没有额度时等到最早有额度的时间，有额度但排在后面时等待放行通知
+                    self._cond.wait(waits[priority] or 1.0)
+            finally:
+                self.scheduler.remove(endpoint, entry, granted)
+                self._cond.notify_all()
+
+    def _release(self, slot: TokenSlot, endpoint: str, error: Optional[Exception] = None) -> bool:
+        """释放请求，返回是否是额度错误（需要换token重试）"""
+        with slot.lock:
+            slot.in_flight -= 1
+            if error is None:
+                return False
+            slot.errors += 1
+            message = str(error)
+            if MINUTE_QUOTA_ERROR.search(message):
+                cooldown = float(os.getenv('TUSHARE_QUOTA_COOLDOWN', '60'))
+            elif DAILY_QUOTA_ERROR.search(message):
+                cooldown = float(os.getenv('TUSHARE_DAILY_QUOTA_COOLDOWN', '3600'))
+            else:
+                return False
+            slot.quota_errors += 1
+            slot.cooldown_until[endpoint] = time.time() + cooldown
+        limiter = slot.limiters.get(endpoint)
+        if isinstance(limiter, SharedRequestLimiter):
+            limiter.set_cooldown(slot.cooldown_until[endpoint])
+        logger.warning("token %s 接口%s超出限制，暂停%s秒: %s", slot.masked_token, endpoint, cooldown, message)
+        return True
+
+    def call(self, endpoint: str, *args, **kwargs) -> Any:
+        """调用接口，遇到额度错误时换其他token重试，所有token都超出额度时抛出最后一个错误
+
+        同时进行的请求数由该接口的并发窗口控制，窗口根据耗时、错误和频率限制自动调整
+        """
+        controller = self.controller(endpoint)
+        priority = current_priority()
+        attempts = 0
+        while True:
+            # 先占用额度再占用窗口，等待额度的请求不占窗口，交互请求不会排在等待额度的批量请求后面
+            slot = self._acquire(endpoint)
+            controller.acquire(priority)
+            latency, throttled, failed = None, False, False
+            try:
+                start_time = time.time()
+                try:
+                    result = getattr(slot.get_api(), endpoint)(*args, **kwargs)
+                except Exception as e:
+                    latency = time.time() - start_time
+                    attempts += 1
+                    throttled = self._release(slot, endpoint, e)
+                    failed = not throttled
+                    if failed or attempts >= self.size:
+                        raise
+                    continue
+                latency = time.time() - start_time
+                self._release(slot, endpoint)
+                return result
+            finally:
+                controller.release(latency, throttled, failed)
+
+    def stats(self) -> Dict[str, Any]:
+        """各token和各优先级的请求统计"""
+        with self._cond:
+            priorities = self.scheduler.to_dict()
+        return {
+            "tokens": [slot.to_dict() for slot in self.slots],
+            "priorities": priorities,
+            "concurrency": {endpoint: controller.to_dict() for endpoint, controller in list(self.controllers.items())},
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args, **kwargs: self.call(name, *args, **kwargs)
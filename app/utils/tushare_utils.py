@@ -1,135 +1,89 @@
 import os
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
+import numpy as np
 import pandas as pd
-import tushare as ts
 import datetime
 import time
 import traceback
 import logging
 import threading
 import glob
+import bisect
+import contextvars
 import concurrent.futures
-from app.utils.logger import setup_logger
+from app.utils.logger import setup_logger, ProgressLogger
+from app.utils.tushare_client import TushareClient
+from app.utils.pct_buckets import PctBuckets
+from app.utils.run_journal import RunJournal
+from app.utils.bar_store import bar_store, DAILY_FIELDS, BASIC_FIELDS
+from app.utils.fetch_planner import fetch_planner, period_start_date, required_start_date
+from app.utils.day_summary import DaySummaryTable, WINDOW_KEYS, WINDOW_PRICE_FIELDS, HIGH, LOW, LAST_CLOSE, AMOUNT
+from app.utils.horizons import HORIZONS
+from app.utils.minute_archive import minute_archive, window_summaries
+from app.utils.intraday_windows import INTRADAY_WINDOWS, format_minute
+from app.utils.pct_stats import PctStatsTable, DISTRIBUTION_FIELDS, stats_file_path
+from app.utils.fingerprint import fingerprint_store, make_fingerprint, config_hash, frame_hash
+from app.utils.publisher import update_publisher
 
 # 配置日志
 logger = setup_logger(__name__)
 
 
-# 创建一个请求限制器类
-class RequestLimiter:
-    """请求限制器，用于限制API请求频率"""
-    
-    def __init__(self, max_requests_per_minute=500):
-        self.max_requests = max_requests_per_minute
-        self.request_times = []
-        self.lock = threading.Lock()
-    
-    def wait_if_needed(self):
-        """如果需要，等待一段时间以确保不超过请求限制"""
-        with self.lock:
-            now = time.time()
-            # 清理一分钟前的请求记录
-            self.request_times = [t for t in self.request_times if now - t < 60]
-            
-            # 如果当前请求数已经达到最大值，则等待
-            if len(self.request_times) >= self.max_requests:
-                # 计算需要等待的时间
-                oldest_request = self.request_times[0]
-                wait_time = 60 - (now - oldest_request)
-                if wait_time > 0:
-                    # logger.info("已达到每分钟%s次请求限制，等待%s秒", self.max_requests, wait_time)
-                    time.sleep(wait_time)
-                    # 重新开始计时
-                    now = time.time()
-                    self.request_times = [t for t in self.request_times if now - t < 60]
-            
-            # 记录当前请求时间
-            self.request_times.append(now)
+# Tushare客户端，第一次调用接口时才导入tushare并初始化
+# 支持多个token（TUSHARE_TOKENS），stk_mins、stk_auction_o 按token分别限制每分钟500次
+pro = TushareClient()
 
-# 创建请求限制器实例
-stk_mins_limiter = RequestLimiter(max_requests_per_minute=500)
-stk_auction_limiter = RequestLimiter(max_requests_per_minute=500)
+# 涨跌幅分档，可通过 PCT_BUCKETS_FILE 配置
+PCT_BUCKETS = PctBuckets.from_env()
 
-# 获取Tushare Token
-TUSHARE_TOKEN = os.getenv('TUSHARE_TOKEN', '')
+# 定义常量
+LIST_RANGE_MAP = PCT_BUCKETS.display_map()
 
-# 初始化Tushare
-try:
-    pro = ts.pro_api(TUSHARE_TOKEN)
-    logger.info("Tushare API初始化成功")
-except Exception as e:
-    logger.error("Tushare API初始化失败: %s", e)
-    pro = None
+# 分钟时间段对应的分钟偏移范围（09:30起，闭区间），可通过 INTRADAY_WINDOWS_FILE 配置
+MINUTE_WINDOWS = INTRADAY_WINDOWS.offsets()
 
-# 定义常量
-LIST_RANGE_MAP = {
-    'range_1_3p': '1-3',
-    'range_3_5p': '3-5',
-    'range_5_7p': '5-7',
-    'range_7_9p': '7-9',
-    'range_10_19p': '10-19',
-    'limit_up': '涨停'
-}
+# 用第一条收盘价判断涨跌、只统计涨跌次数的分钟时间段
+FIRST_CLOSE_WINDOWS = INTRADAY_WINDOWS.first_close_keys()
 
-TIME_PERIOD_MAP = {
-    # 'm1': '近1月',
-    # 'm3': '3月',
-    # 'm6': '6月',
-    # 'y1': '1年',
+# 支持的时间周期
+ALL_TIME_PERIODS = {
+    'm1': '近1月',
+    'm3': '3月',
+    'm6': '6月',
+    'y1': '1年',
     'y2': '2年',
-    # 数据量太大，暂时不分析
-    # 'y3': '3年',
-    # 'y4': '4年',
-    # 'y5': '5年'
+    'y3': '3年',
+    'y4': '4年',
+    'y5': '5年',
 }
 
+# 启用的时间周期，ENABLED_TIME_PERIODS 逗号分隔，默认只分析2年
+# 分钟线保存在本地归档中，启用 y3~y5 时重叠的交易日不会重复请求
+TIME_PERIOD_MAP = {
+    key: ALL_TIME_PERIODS[key]
+    for key in (item.strip() for item in os.getenv('ENABLED_TIME_PERIODS', 'y2').split(','))
+    if key in ALL_TIME_PERIODS
+} or {'y2': '2年'}
+
 TIME_FREQ_MAP = {
     'auction': '竞价',
-    '1min': '1分钟',
-    '5min': '5分钟',
-    '15min': '15分钟',
-    '30min': '30分钟',
-    '60min': '1小时',
+    **INTRADAY_WINDOWS.display_map(),
 }
 
+# 概率计算逻辑的版本，修改计算方式时加1，已有的结果会在下次分析时重新计算
+CALC_VERSION = 2
+
 # 涨跌幅分类
-PRICE_CHANGE_CATEGORIES = {
-    'micro_up': '微涨(涨幅<1%)',
-    'small_up': '小涨(涨幅<3%)',
-    'medium_up': '中涨(涨幅<5%)',
-    'large_up': '大涨(涨幅<7%)',
-    'limit_up': '涨停(涨幅>=7%)',
-    'flat': '平开(涨幅=0%)',
-    'small_down': '小跌(跌幅<-1%)',
-    'medium_down': '中跌(跌幅<-3%)',
-    'large_down': '大跌(跌幅<-5%)',
-    'limit_down': '跌停(跌幅<=-5%)'
-}
+PRICE_CHANGE_CATEGORIES = PCT_BUCKETS.category_names()
 
 # 涨跌幅场景描述
-SCENARIO_DESCRIPTIONS = {
-    'micro_up': '今天微涨(0 ~ 1%)，明天概率情况',
-    'small_up': '今天小涨(1% ~ 3%)，明天概率情况',
-    'medium_up': '今天中涨(3% ~ 5%)，明天概率情况',
-    'large_up': '今天大涨(7% ~ 涨停)，明天概率情况',
-    'limit_up': '今天涨停()涨停，明天概率情况',
-    'flat': '今天平开(涨幅=0%)  ，明天概率情况',
-    'small_down': '今天小跌(-1% ~ 0)，明天概率情况',
-    'medium_down': '今天中跌(-3% ~ -1%)，明天概率情况',
-    'large_down': '今天大跌(-5% ~ -3%)，明天概率情况',
-    'limit_down': '今天跌停(-5% ~ -7%)，明天概率情况',
-    'range_1_3p': '今天1-3%，明天概率情况',
-    'range_3_5p': '今天3-5%，明天概率情况',
-    'range_5_7p': '今天5-7%，明天概率情况',
-    'range_7_9p': '今天7-9%，明天概率情况',
-    'range_10_19p': '今天10-19%，明天概率情况'
-}
+SCENARIO_DESCRIPTIONS = PCT_BUCKETS.scenario_descriptions()
 
-def get_stock_list() -> pd.DataFrame:
-    """获取所有股票列表"""
+def get_stock_list(list_status: str = 'L') -> pd.DataFrame:
+    """获取股票列表，list_status: L上市 D退市 P暂停上市"""
     try:
-        # 获取所有上市股票
-        stocks = pro.stock_basic(exchange='', list_status='L', 
+        # 默认获取所有上市股票
+        stocks = pro.stock_basic(exchange='', list_status=list_status, 
                                 fields='ts_code,symbol,name,area,industry,market,list_date')
         logger.info("获取股票列表成功，共%s条记录", len(stocks))
         return stocks
@@ -137,472 +91,565 @@ def get_stock_list() -> pd.DataFrame:
         logger.error(f"获取股票列表失败: {e}")
         return pd.DataFrame()
 
-def filter_stocks(stocks: pd.DataFrame) -> pd.DataFrame:
-    """过滤股票列表
-    
-    过滤条件:
-    1. 排除北交所股票(ts_code以.BJ结尾)
-    2. 市值在10亿到1000亿之间
+# namechange 接口每次最多返回的记录数
+NAME_CHANGE_PAGE_SIZE = 10000
+
+def get_name_changes() -> pd.DataFrame:
+    """获取全市场股票的历史名称（含ST、*ST等特别处理的名称变更），按页请求直到取完
+
+    每条记录为股票在 [start_date, end_date] 期间使用的名称，当前名称的end_date为空，失败时返回空DataFrame
     """
     try:
-        # 排除北交所股票
-        filtered_stocks = stocks[~stocks['ts_code'].str.endswith('.BJ')]
-        logger.info("排除北交所股票后，剩余%s条记录", len(filtered_stocks))
-        # 排除科创板 ts_code 688开头
-        filtered_stocks = filtered_stocks[~filtered_stocks['ts_code'].str.startswith('688')]
-        logger.info("排除科创板后，剩余%s条记录", len(filtered_stocks))
-        # 排除 st *st *st
-        filtered_stocks = filtered_stocks[~filtered_stocks['name'].str.contains('ST')]
-        logger.info("排除ST后，剩余%s条记录", len(filtered_stocks))
-        
-        # 获取最新交易日期
-        latest_trade_date = pro.trade_cal(exchange='', start_date=datetime.datetime.now().strftime('%Y%m%d'), 
-                                         end_date=datetime.datetime.now().strftime('%Y%m%d'), 
-                                         is_open='1')['cal_date'].values
-        
-        if len(latest_trade_date) == 0:
-            # 如果今天不是交易日，获取最近的交易日
-            latest_trade_date = pro.trade_cal(exchange='', end_date=datetime.datetime.now().strftime('%Y%m%d'), 
-                                             is_open='1')['cal_date'].iloc[-1]
-        else:
-            latest_trade_date = latest_trade_date[0]
+        frames = []
+        offset = 0
+        while True:
+            page = pro.namechange(fields='ts_code,name,start_date,end_date',
+                                  limit=NAME_CHANGE_PAGE_SIZE, offset=offset)
+            if page is None or page.empty:
+                break
+            frames.append(page)
+            if len(page) < NAME_CHANGE_PAGE_SIZE:
+                break
+            offset += len(page)
+        changes = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+            columns=['ts_code', 'name', 'start_date', 'end_date'])
+        logger.info("获取股票历史名称成功，共%s条记录", len(changes))
+        return changes
+    except Exception as e:
+        logger.error("获取股票历史名称失败: %s", e)
+        return pd.DataFrame()
+
+# 交易日历内存缓存，每天刷新一次
+_trade_calendar_cache = {'date': None, 'dates': []}
+_trade_calendar_lock = threading.Lock()
 
-        # !!! 取 20250307
-        latest_trade_date = '20250307'
+def get_trade_calendar(refresh: bool = False) -> List[str]:
+    """获取交易日历
+    
+    返回升序的开市日期列表(YYYYMMDD)，结果缓存在内存和数据目录下的trade_cal.csv，每天最多请求一次接口
+    """
+    today = datetime.datetime.now().strftime('%Y%m%d')
+    with _trade_calendar_lock:
+        if not refresh and _trade_calendar_cache['date'] == today:
+            return _trade_calendar_cache['dates']
         
+        data_dir = os.getenv('DATA_DIR', './data')
+        cache_file = os.path.join(data_dir, 'trade_cal.csv')
+        dates = []
+        cache_is_fresh = (os.path.exists(cache_file) and
+                          datetime.datetime.fromtimestamp(os.path.getmtime(cache_file)).strftime('%Y%m%d') == today)
         
-        try:
-            # 检查是否有足够的积分调用daily_basic接口
-            # 如果没有足够的积分，我们将使用stock_basic接口的数据
-            # 注意：这种情况下我们将无法获取市值数据，但至少可以获取股票列表
-            
-            # 尝试获取市值数据
-            market_values = []
-            # 分批获取，避免一次性请求过多
-            batch_size = 1000
-            for i in range(0, len(filtered_stocks), batch_size):
-                batch = filtered_stocks.iloc[i:i+batch_size]
-                ts_codes = ','.join(batch['ts_code'].tolist())
-                try:
-                    logger.info("尝试获取第%s批股票的市值数据，共%s只股票", i//batch_size + 1, len(batch))
-                    mv_data = pro.daily_basic(ts_code=ts_codes, trade_date=latest_trade_date)
-                    
-                    if mv_data.empty:
-                        logger.warning("第%s批股票的市值数据为空", i//batch_size + 1)
-                    else:
-                        logger.info("成功获取第%s批股票的市值数据，共%s条记录", i//batch_size + 1, len(mv_data))
-                        market_values.append(mv_data)
-                    
-                    # 避免频繁请求
-                    time.sleep(0.01)
-                except Exception as e:
-                    logger.error("获取第%s批股票的市值数据失败: %s", i//batch_size + 1, e)
-                    continue
-            
-            if not market_values:
-                logger.warning("未获取到市值数据，可能是因为Tushare积分不足（需要至少2000积分）")
-                logger.warning("将使用股票基本信息，不包含市值数据")
-                # 如果无法获取市值数据，我们将使用原始的股票列表
-                result = filtered_stocks
-            else:
-                # 过滤掉空的DataFrame，避免FutureWarning
-                non_empty_market_values = [df for df in market_values if not df.empty]
-                if not non_empty_market_values:
-                    logger.warning("所有市值数据都为空")
-                    result = filtered_stocks
-                else:
-                    market_value_df = pd.concat(non_empty_market_values, ignore_index=True)
-                    
-                    # 合并股票信息和市值数据
-                    merged_df = pd.merge(filtered_stocks, market_value_df, on='ts_code', how='left')
-                    
-                    # 保存合并后的数据到CSV文件，方便调试
-                    # merged_df.to_csv('data/merged_stocks.csv', index=False, encoding='utf-8-sig')
-                    logger.info("已将合并后的数据保存到data/merged_stocks.csv，共%s条记录", len(merged_df))
-                    
-                    # 过滤市值在10 * 10000到5000 * 10000 之间的股票单位 万元 10亿到 300亿
-                    low_mv = 30 * 10000
-                    high_mv = 222 * 10000
-                    # 注意：total_mv和circ_mv单位为万元，需要转换
-                    # 只有在市值数据不为空的情况下才进行过滤
-                    if 'total_mv' in merged_df.columns and not merged_df['total_mv'].isna().all():
-                        # 保存过滤前的数据
-                        # merged_df.to_csv('data/before_filter.csv', index=False, encoding='utf-8-sig')
-                        
-                        # 过滤市值
-                        result = merged_df[(merged_df['total_mv'] >= low_mv) & (merged_df['total_mv'] <= high_mv)]
-                        
-                        # 保存过滤后的数据
-                        # result.to_csv('data/after_filter.csv', index=False, encoding='utf-8-sig')
-                        
-                        logger.info("过滤市值后，剩余%s条记录", len(result))
-                       
-                        
-                        # 保存被过滤掉的数据
-                        filtered_out = merged_df[~merged_df.index.isin(result.index)]
-                        filtered_out.to_csv('data/市值小于30亿或者大于222亿之间的股票.csv', index=False, encoding='utf-8-sig')
-                        logger.info("被过滤掉的记录已保存到data/市值小于30亿或者大于222亿之间的股票.csv，共%s条记录", len(filtered_out))
-                        # 过滤流通性 保留流通市值/总市值 > 0.7 小于的 则过滤掉
-                        result = result[result['circ_mv'] / result['total_mv'] > 0.7]
-                        logger.info("过滤流通性后，剩余%s条记录", len(result))
-                        # 保存过滤后的数据
-                        result.to_csv('data/市值30亿_222亿之间流通性大于70%的股票.csv', index=False, encoding='utf-8-sig')
-                        logger.info("过滤后数据已保存到data/市值30亿_222亿之间流通性大于70%的股票.csv，共%s条记录", len(result))
-                        # 过滤掉特定股票 比如 负面新闻
-                        bad_ts_codes = ["600811.SH"]
-                        # 存在于 bad_ts_codes 的 则过滤掉
-                        result = result[~result['ts_code'].isin(bad_ts_codes)]
-                        logger.info("过滤特定股票后，剩余%s条记录", len(result))
-                       
-                    else:
-                        logger.warning("市值数据为空，无法进行市值过滤")
-                        result = merged_df
-            
-            # 如果结果为空，则返回原始的股票列表
-            if result.empty:
-                logger.warning("过滤后的结果为空，将返回原始的股票列表")
-                result = filtered_stocks
-            
-            logger.info("最终返回%s条股票记录", len(result))
-            return result
-        except Exception as e:
-            logger.error("过滤股票失败: %s", e)
-            # 如果发生错误，至少返回原始的股票列表
-            return filtered_stocks
+        if refresh or not cache_is_fresh:
+            try:
+                # 多取一个月，盘前也能拿到当天及之后的交易日
+                end_date = (datetime.datetime.now() + datetime.timedelta(days=31)).strftime('%Y%m%d')
+                calendar = pro.trade_cal(exchange='', start_date='20150101', end_date=end_date, is_open='1')
+                dates = sorted(calendar['cal_date'].astype(str).unique().tolist())
+                os.makedirs(data_dir, exist_ok=True)
+                pd.DataFrame({'cal_date': dates}).to_csv(cache_file, index=False)
+                logger.info("获取交易日历成功，共%s个交易日", len(dates))
+            except Exception as e:
+                logger.error("获取交易日历失败: %s", e)
+        
+        if not dates and os.path.exists(cache_file):
+            dates = pd.read_csv(cache_file, dtype={'cal_date': str})['cal_date'].tolist()
+        
+        if dates:
+            _trade_calendar_cache.update(date=today, dates=dates)
+        return dates
+
+def get_latest_trade_date(date: Optional[str] = None) -> Optional[str]:
+    """获取不晚于date(默认今天)的最近一个交易日"""
+    date = date or datetime.datetime.now().strftime('%Y%m%d')
+    dates = get_trade_calendar()
+    i = bisect.bisect_right(dates, date)
+    return dates[i - 1] if i else None
+
+def get_previous_trade_date(date: str) -> Optional[str]:
+    """获取早于date的上一个交易日"""
+    dates = get_trade_calendar()
+    i = bisect.bisect_left(dates, date)
+    return dates[i - 1] if i else None
+
+def get_daily_end_date() -> Optional[str]:
+    """获取日线已经发布的最近交易日
+    
+    当天的日线和每日指标收盘后才发布，DAILY_PUBLISH_TIME(默认17:00)之前使用上一个交易日，
+    盘中分析股票时不再每次请求当天还没有发布的日线
+    """
+    now = datetime.datetime.now()
+    today = now.strftime('%Y%m%d')
+    latest = get_latest_trade_date(today)
+    if latest == today and now.strftime('%H:%M') < os.getenv('DAILY_PUBLISH_TIME', '17:00'):
+        return get_previous_trade_date(today)
+    return latest
+
+def get_daily_by_date(trade_date: str) -> pd.DataFrame:
+    """一次获取某个交易日全市场的日线行情，失败时返回空DataFrame"""
+    try:
+        data = pro.daily(trade_date=trade_date, fields='ts_code,trade_date,open,high,low,close,pre_close,pct_chg,vol,amount')
+        logger.info("获取%s全市场日线行情成功，共%s条记录", trade_date, len(data))
+        return data
+    except Exception as e:
+        logger.error("获取%s全市场日线行情失败: %s", trade_date, e)
+        return pd.DataFrame()
+
+def get_auction_by_date(trade_date: str) -> pd.DataFrame:
+    """一次获取某个交易日全市场的开盘竞价数据，失败时返回空DataFrame"""
+    try:
+        data = pro.stk_auction_o(trade_date=trade_date)
+        logger.info("获取%s全市场竞价数据成功，共%s条记录", trade_date, len(data))
+        return data
+    except Exception as e:
+        logger.error("获取%s全市场竞价数据失败: %s", trade_date, e)
+        return pd.DataFrame()
+
+def get_daily_basic_by_date(trade_date: str) -> pd.DataFrame:
+    """一次获取某个交易日全市场的每日指标（市值、换手率等）
+
+    需要至少2000积分，失败时返回空DataFrame
+    """
+    try:
+        data = pro.daily_basic(trade_date=trade_date)
+        logger.info("获取%s全市场每日指标成功，共%s条记录", trade_date, len(data))
+        return data
+    except Exception as e:
+        logger.error("获取%s全市场每日指标失败: %s", trade_date, e)
+        return pd.DataFrame()
+
+# 股票池过滤规则，市值单位万元
+UNIVERSE_RULES = {
+    'min_total_mv': 30 * 10000,
+    'max_total_mv': 222 * 10000,
+    # 流通市值/总市值
+    'min_float_ratio': 0.7,
+    'exclude_st': True,
+    # 排除北交所
+    'exclude_suffixes': ['.BJ'],
+    # 排除科创板
+    'exclude_prefixes': ['688'],
+    # 特定股票，比如负面新闻
+    'blacklist': ['600811.SH'],
+}
+
+def universe_mask(stocks: pd.DataFrame, rules: Optional[Dict[str, Any]] = None) -> np.ndarray:
+    """按股票池过滤规则计算布尔掩码，所有规则一次向量化求值
+
+    没有市值数据（total_mv全为空）时跳过市值和流通性规则
+    """
+    rules = rules or UNIVERSE_RULES
+    ts_codes = stocks['ts_code'].astype(str)
+    mask = np.ones(len(stocks), dtype=bool)
+    if rules.get('exclude_suffixes'):
+        mask &= ~ts_codes.str.endswith(tuple(rules['exclude_suffixes'])).to_numpy()
+    if rules.get('exclude_prefixes'):
+        mask &= ~ts_codes.str.startswith(tuple(rules['exclude_prefixes'])).to_numpy()
+    if rules.get('exclude_st') and 'name' in stocks.columns:
+        mask &= ~stocks['name'].astype(str).str.contains('ST', regex=False).to_numpy()
+    if rules.get('blacklist'):
+        mask &= ~ts_codes.isin(rules['blacklist']).to_numpy()
+
+    if 'total_mv' in stocks.columns and not stocks['total_mv'].isna().all():
+        total_mv = stocks['total_mv'].to_numpy(dtype=np.float64)
+        circ_mv = stocks['circ_mv'].to_numpy(dtype=np.float64)
+        # NaN参与比较结果为False，没有市值数据的股票会被排除
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mask &= (total_mv >= rules['min_total_mv']) & (total_mv <= rules['max_total_mv'])
+            mask &= circ_mv / total_mv > rules['min_float_ratio']
+    else:
+        logger.warning("市值数据为空，无法进行市值过滤")
+    return mask
+
+def filter_stocks(stocks: pd.DataFrame, rules: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
+    """过滤股票列表
+
+    stocks 为股票基本信息与当日每日指标合并后的数据，过滤条件见 UNIVERSE_RULES:
+    1. 排除北交所、科创板、ST股票和黑名单股票
+    2. 总市值在30亿到222亿之间
+    3. 流通市值/总市值大于0.7
+    """
+    try:
+        if stocks.empty:
+            return stocks
+        result = stocks[universe_mask(stocks, rules)]
+        logger.info("过滤股票完成，%s条记录中保留%s条", len(stocks), len(result))
+        return result
     except Exception as e:
         logger.error("过滤股票失败: %s", e)
         return pd.DataFrame()
 
-def get_stock_daily_data(ts_code: str, start_date: str = '20150101', end_date: Optional[str] = None) -> pd.DataFrame:
-    """获取股票日线数据"""
+# 日线接口请求的字段
+DAILY_BASIC_FIELDS = 'ts_code,trade_date,close,turnover_rate,volume_ratio,pe,pb,total_mv,circ_mv,pct_chg'
+DAILY_PRICE_FIELDS = 'ts_code,trade_date,open,high,low,close,pre_close,change,pct_chg,vol,amount'
+
+def _fetch_daily_range(ts_code: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """请求一个日期范围的每日指标和日线行情并合并"""
+    daily_data = pro.daily_basic(ts_code=ts_code, start_date=start_date, end_date=end_date, fields=DAILY_BASIC_FIELDS)
+    daily_price = pro.daily(ts_code=ts_code, start_date=start_date, end_date=end_date, fields=DAILY_PRICE_FIELDS)
+    return pd.merge(daily_data, daily_price, on=['ts_code', 'trade_date'], how='left', suffixes=('', '_price'))
+
+def get_stock_daily_data(ts_code: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+    """获取股票日线数据
+    
+    只请求启用的时间周期需要、且本地行情库还没有的日期范围（见 FetchPlanner），
+    请求到的数据写入本地行情库，返回 [start_date, end_date] 内的全部日线。
+    
+    Args:
+        start_date: 开始日期，不指定则按 TIME_PERIOD_MAP 中最长的时间周期计算
+        end_date: 结束日期，不指定则为日线已经发布的最近交易日
+    """
     try:
+        calendar = get_trade_calendar()
         if end_date is None:
-            end_date = datetime.datetime.now().strftime('%Y%m%d')
+            end_date = get_daily_end_date() or datetime.datetime.now().strftime('%Y%m%d')
+        start_date = start_date or required_start_date(end_date, TIME_PERIOD_MAP) or '20150101'
         
-        # 获取每日指标数据
-        daily_data = pro.daily_basic(ts_code=ts_code, start_date=start_date, end_date=end_date,
-                                    fields='ts_code,trade_date,close,turnover_rate,volume_ratio,pe,pb,total_mv,circ_mv,pct_chg')
-        
-        # 获取日线行情数据
-        daily_price = pro.daily(ts_code=ts_code, start_date=start_date, end_date=end_date,
-                               fields='ts_code,trade_date,open,high,low,close,pre_close,change,pct_chg,vol,amount')
-        
-        # 合并数据
-        result = pd.merge(daily_data, daily_price, on=['ts_code', 'trade_date'], how='left', suffixes=('', '_price'))
+        cached = bar_store.load(ts_code)
+        covered = [tuple(interval) for interval in cached[0]['covered']] if cached is not None else []
+        if calendar:
+            ranges = fetch_planner.missing_ranges(start_date, end_date, calendar, covered)
+        else:
+            ranges = [(start_date, end_date)]
+        
+        today = datetime.datetime.now().strftime('%Y%m%d')
+        frames, fetched_ranges = [], []
+        for range_start, range_end in ranges:
+            frame = _fetch_daily_range(ts_code, range_start, range_end)
+            frames.append(frame)
+            # 今天的数据收盘后才发布，只把已经返回的日期记为已覆盖
+            if range_end >= today:
+                returned = frame['trade_date'].astype(str)
+                range_end = returned.max() if not returned.empty else None
+            if range_end and range_end >= range_start:
+                fetched_ranges.append((range_start, range_end))
+        if frames:
+            fetched = pd.concat(frames, ignore_index=True)
+            bar_store.save(ts_code, fetched, covered=fetched_ranges)
+            logger.debug("股票%s请求%s段日线数据，共%s条记录", ts_code, len(ranges), len(fetched))
+        else:
+            fetched = pd.DataFrame()
+        
+        # 本地已有的日线和新请求的合并，同一交易日以新数据为准
+        parts = [fetched]
+        if cached is not None:
+            daily = cached[0]
+            old = pd.DataFrame({field: daily[field].astype(np.float64) for field in DAILY_FIELDS + BASIC_FIELDS})
+            old.insert(0, 'trade_date', daily['trade_date'].astype(str))
+            old.insert(0, 'ts_code', ts_code)
+            parts.append(old)
+        result = pd.concat([part for part in parts if not part.empty], ignore_index=True) \
+            if any(not part.empty for part in parts) else pd.DataFrame()
+        if result.empty:
+            return result
+        result['trade_date'] = result['trade_date'].astype(str)
+        result = result.drop_duplicates('trade_date')
+        result = result[(result['trade_date'] >= start_date) & (result['trade_date'] <= end_date)]
         
-        logger.info("获取股票%s日线数据成功，共%s条记录", ts_code, len(result))
-        return result
+        logger.debug("获取股票%s日线数据成功，共%s条记录", ts_code, len(result))
+        return result.sort_values('trade_date', ascending=False, ignore_index=True)
     except Exception as e:
         logger.error("获取股票%s日线数据失败: %s", ts_code, e)
         return pd.DataFrame()
 
-def categorize_pct_change(pct_chg: float) -> str:
-    """根据涨跌幅分类"""
-    if pct_chg >= 9.5:  # 涨停通常为10%，但考虑到一些误差
-        return 'limit_up'
-    elif 7 <= pct_chg < 9.5:
-        return 'range_7_9p'
-    elif 5 <= pct_chg < 7:
-        return 'range_5_7p'
-    elif 3 <= pct_chg < 5:
-        return 'range_3_5p'
-    elif 1 <= pct_chg < 3:
-        return 'range_1_3p'
-    elif 0 < pct_chg < 1:
-        return 'micro_up'
-    elif pct_chg == 0:
-        return 'flat'
-    elif -1 < pct_chg < 0:
-        return 'small_down'
-    elif -3 < pct_chg <= -1:
-        return 'medium_down'
-    elif -5 < pct_chg <= -3:
-        return 'large_down'
-    else:  # pct_chg <= -5
-        return 'limit_down'
-
-def get_auction_data(ts_code: str, trade_date: str) -> pd.DataFrame:
-    """获取股票竞价数据"""
+def categorize_pct_change(pct_chg: float, ts_code: Optional[str] = None) -> str:
+    """根据涨跌幅分类，指定ts_code时按所属板块的涨跌停规则分档"""
+    return PCT_BUCKETS.categorize_one(pct_chg, ts_code)
+
+def get_auction_data(ts_code: str, trade_date: str, journal: Optional[RunJournal] = None) -> Optional[pd.DataFrame]:
+    """获取股票竞价数据
+    
+    请求失败时返回None，并在journal中记录缺口，便于之后补拉
+    """
     try:
-        # 使用请求限制器，确保不超过API限制
-        stk_auction_limiter.wait_if_needed()
-        
+        # 请求频率由 pro 按token限制
         auction_data = pro.stk_auction_o(ts_code=ts_code, trade_date=trade_date)
+        if journal is not None:
+            journal.record_success(ts_code, trade_date, 'stk_auction_o')
         return auction_data
     except Exception as e:
         logger.error("获取股票%s竞价数据失败: %s", ts_code, e)
-        return pd.DataFrame()
+        if journal is not None:
+            journal.record_gap(ts_code, trade_date, 'stk_auction_o', str(e))
+        return None
 
-def get_minutes_data(ts_code: str, trade_date: str, freq: int = 1) -> pd.DataFrame:
-    """获取股票分钟行情数据"""
+def get_minutes_data(ts_code: str, trade_date: str, journal: Optional[RunJournal] = None) -> Optional[pd.DataFrame]:
+    """获取股票一个交易日09:30到最晚的分钟时间段结束的1分钟行情，各分钟时间段都从中汇总
+    
+    请求失败时返回None，并在journal中记录各分钟时间段的缺口，便于之后补拉
+    """
+    endpoints = [f"stk_mins:{time_key}" for time_key in MINUTE_WINDOWS]
     try:
-        # 使用请求限制器，确保不超过API限制
-        stk_mins_limiter.wait_if_needed()
-        
-        # 转换日期格式
+        # 请求频率由 pro 按token限制
         date_obj = datetime.datetime.strptime(trade_date, '%Y%m%d')
         start_time = f"{date_obj.strftime('%Y-%m-%d')} 09:30:00"
-        end_time = '';
-        if freq == 1:
-            end_time = f"{date_obj.strftime('%Y-%m-%d')} 09:30:00"
-        elif freq == 5:
-            start_time = f"{date_obj.strftime('%Y-%m-%d')} 09:30:00"
-            end_time = f"{date_obj.strftime('%Y-%m-%d')} 09:35:00"
-        elif freq == 15:
-            start_time = f"{date_obj.strftime('%Y-%m-%d')} 09:35:00"
-            end_time = f"{date_obj.strftime('%Y-%m-%d')} 09:45:00"
-        elif freq == 30:
-            start_time = f"{date_obj.strftime('%Y-%m-%d')} 09:45:00"
-            end_time = f"{date_obj.strftime('%Y-%m-%d')} 10:15:00"
-        elif freq == 60:
-            start_time = f"{date_obj.strftime('%Y-%m-%d')} 10:15:00"
-            end_time = f"{date_obj.strftime('%Y-%m-%d')} 11:30:00"
+        end_time = f"{date_obj.strftime('%Y-%m-%d')} {format_minute(INTRADAY_WINDOWS.fetch_end)}"
         minute_data = pro.stk_mins(ts_code=ts_code, freq='1min', start_date=start_time, end_date=end_time)
+        if journal is not None:
+            for endpoint in endpoints:
+                journal.record_success(ts_code, trade_date, endpoint)
         return minute_data
     except Exception as e:
         logger.error("获取股票%s分钟行情数据失败: %s", ts_code, e)
-        return pd.DataFrame()
+        if journal is not None:
+            for endpoint in endpoints:
+                journal.record_gap(ts_code, trade_date, endpoint, str(e))
+        return None
+
 
-def calculate_probability(stock_data: pd.DataFrame, time_period: str, circ_mv: float) -> Dict[str, Dict[str, Dict[str, float]]]:
+def _fetch_dates(ts_code: str, label: str, endpoint: str, fetch_dates: List[str], fetch) -> Dict[str, Any]:
+    """并行获取多个交易日的数据，返回 {交易日: 数据}
+    
+    同时进行的请求数由 pro 的并发窗口按耗时、错误和频率限制自动调整（AIMD），
+    线程数只是上限，不再固定10个线程、每批100个交易日后等待1秒。
+    请求优先级通过context传给线程。
+    """
+    results = {}
+    if not fetch_dates:
+        return results
+    # 每次批量获取一个限流器，最后一条总是输出
+    progress = ProgressLogger(logger)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(pro.max_concurrency, len(fetch_dates))) as executor:
+        future_to_date = {executor.submit(contextvars.copy_context().run, fetch, date): date for date in fetch_dates}
+        for i, future in enumerate(concurrent.futures.as_completed(future_to_date)):
+            date = future_to_date[future]
+            try:
+                results[date] = future.result()
+            except Exception as e:
+                logger.error("获取交易日%s的%s数据失败: %s", date, label, e)
+            progress.info("股票%s获取%s数据 %s/%s，并发窗口: %s", ts_code, label, i + 1,
+                          len(fetch_dates), round(pro.controller(endpoint).window, 1),
+                          force=i + 1 == len(fetch_dates))
+    return results
+
+def fetch_intraday_data(ts_code: str, trade_dates, journal: Optional[RunJournal] = None,
+                        prefetched: Optional[DaySummaryTable] = None) -> DaySummaryTable:
+    """批量获取竞价和分钟数据
+    
+    数据到达时立即汇总到 DaySummaryTable，不保留原始的分钟数据DataFrame
+    
+    Args:
+        ts_code: 股票代码
+        trade_dates: 交易日期列表
+        journal: 刷新任务日志，用于记录和补拉缺口
+        prefetched: 之前已获取的数据，只重新请求其中缺失或记录为缺口的日期
+    
+    Returns:
+        按交易日汇总的竞价和分钟数据，请求失败的 (交易日, 时间段) 记录在 failures 中
+    """
+    if prefetched is not None and prefetched.windows == WINDOW_KEYS:
+        summary = prefetched
+        summary.add_dates(trade_dates)
+    elif prefetched is not None:
+        # 分钟时间段配置变化过，新增的时间段从归档重新汇总
+        summary = DaySummaryTable(trade_dates)
+        summary.merge(prefetched)
+    else:
+        summary = DaySummaryTable(trade_dates)
+    gaps = journal.gaps_for(ts_code) if journal is not None else set()
+    
+    def dates_to_fetch(time_key: str, endpoint: str):
+        return [date for date in trade_dates if not summary.is_fetched(date, time_key) or (date, endpoint) in gaps]
+    
+    # 获取竞价数据
+    batch_start_time = time.time()
+    auction_dates = dates_to_fetch('auction', 'stk_auction_o')
+    auctions = _fetch_dates(ts_code, 'auction', 'stk_auction_o', auction_dates,
+                            lambda date: get_auction_data(ts_code, date, journal))
+    for date, data in auctions.items():
+        if data is not None:
+            summary.record(date, 'auction', data)
+    summary.record_failures([date for date in auction_dates if auctions.get(date) is None], 'auction')
+    logger.debug("批量获取竞价数据完成，耗时: %s秒", time.time() - batch_start_time)
+    
+    # 分钟数据: 每个交易日一次请求覆盖所有分钟时间段的1分钟线写入本地归档，已归档的交易日不再请求
+    batch_start_time = time.time()
+    minute_dates = sorted({date for time_key in MINUTE_WINDOWS for date in dates_to_fetch(time_key, f"stk_mins:{time_key}")})
+    if minute_dates:
+        archived = minute_archive.archived_days(ts_code, INTRADAY_WINDOWS.fetch_end)
+        fetch_dates = [date for date in minute_dates if date not in archived or
+                       any((date, f"stk_mins:{time_key}") in gaps for time_key in MINUTE_WINDOWS)]
+        minutes = _fetch_dates(ts_code, 'minutes', 'stk_mins', fetch_dates,
+                               lambda date: get_minutes_data(ts_code, date, journal))
+        # 请求失败的交易日不归档，下次重新请求
+        minute_archive.write(ts_code, {date: data for date, data in minutes.items() if data is not None},
+                             INTRADAY_WINDOWS.fetch_end)
+        
+        # 从归档一次汇总所有交易日的各分钟时间段
+        bars = minute_archive.read(ts_code, minute_dates)
+        archived_dates = [str(day) for day in bars.days]
+        for time_key, (day_rows, values) in window_summaries(bars, MINUTE_WINDOWS).items():
+            summary.record_many([archived_dates[i] for i in day_rows], time_key, values, archived_dates)
+        # 失败的交易日记为已请求（没有数据）并记录为失败，缺口记录在journal中
+        failed_dates = [date for date in fetch_dates if minutes.get(date) is None]
+        for time_key in MINUTE_WINDOWS:
+            summary.record_failures(failed_dates, time_key)
+    logger.debug("批量获取分钟数据完成，耗时: %s秒", time.time() - batch_start_time)
+    
+    # 有缺口时保存已获取的数据，补拉时只请求缺口
+    if journal is not None and journal.gaps_for(ts_code):
+        journal.save_fetch_cache(ts_code, summary)
+    
+    return summary
+
+def calculate_probability(stock_data: pd.DataFrame, time_period: str, circ_mv: float,
+                          journal: Optional[RunJournal] = None,
+                          prefetched: Optional[DaySummaryTable] = None,
+                          stats: Optional[PctStatsTable] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
     """计算不同涨幅区间对应的第二天涨跌概率
     
     Args:
         stock_data: 股票数据
         time_period: 时间周期，如'm1', 'm3', 'm6', 'y1'等
+        journal: 刷新任务日志，用于记录和补拉缺口
+        prefetched: 之前已获取的竞价和分钟数据
+        stats: 传入时把各 (分类, 时间段) 的涨跌幅分布累加到其中，可与其他股票、时间周期的统计合并
     
     Returns:
         概率统计结果
     """
+    return calculate_horizon_probability(stock_data, time_period, circ_mv, journal, prefetched, stats,
+                                         horizons=[1]).get(1, {})
+
+def calculate_horizon_probability(stock_data: pd.DataFrame, time_period: str, circ_mv: float,
+                                  journal: Optional[RunJournal] = None,
+                                  prefetched: Optional[DaySummaryTable] = None,
+                                  stats: Optional[PctStatsTable] = None,
+                                  horizons: Optional[List[int]] = None,
+                                  fetch_state: Optional[Dict[str, Any]] = None) -> Dict[int, Dict[str, Dict[str, Dict[str, float]]]]:
+    """计算不同涨幅区间对应的之后第N个交易日（T+N）的涨跌概率
+    
+    T+N 的各时间段价格与当天收盘价比较。所有间隔的交易日都在时间周期内，竞价和分钟数据只获取一次，
+    按 (行, 间隔, 时间段) 的数组一次计算，不再逐行遍历。
+    
+    Args:
+        stats: 传入时把 T+1 各 (分类, 时间段) 的涨跌幅分布累加到其中
+        horizons: 间隔交易日，不指定则使用 HORIZONS
+        fetch_state: 传入时写入竞价和分钟数据请求失败的 (交易日, 时间段) 数 failures，有失败时结果不完整
+    
+    Returns:
+        {间隔交易日: 概率统计结果}
+    """
     try:
+        horizons = sorted(set(horizons or HORIZONS))
         # 根据时间周期筛选数据
         end_date = stock_data['trade_date'].max()
-        if time_period.startswith('m'):
-            months = int(time_period[1:])
-            start_date = (datetime.datetime.strptime(end_date, '%Y%m%d') - 
-                          datetime.timedelta(days=30*months)).strftime('%Y%m%d')
-        elif time_period.startswith('y'):
-            years = int(time_period[1:])
-            start_date = (datetime.datetime.strptime(end_date, '%Y%m%d') - 
-                          datetime.timedelta(days=365*years)).strftime('%Y%m%d')
-        else:
+        start_date = period_start_date(end_date, time_period)
+        if start_date is None:
             logger.error("不支持的时间周期: %s", time_period)
             return {}
         
-        period_data = stock_data[stock_data['trade_date'] >= start_date].copy()
+        # 接口返回的日线是按日期降序的，按日期升序排列后 shift(-N) 才是之后第N个交易日
+        period_data = stock_data[stock_data['trade_date'] >= start_date].sort_values('trade_date', ignore_index=True)
         
         if period_data.empty:
             logger.warning("时间周期%s内没有数据", time_period)
             return {}
         
-        # 按涨跌幅分类
-        period_data['pct_chg_category'] = period_data['pct_chg'].apply(categorize_pct_change)
-        
-        # 计算第二天的数据
-        period_data['next_trade_date'] = period_data['trade_date'].shift(-1)
-        
-        # 初始化结果字典
-        result = {}
-        
-        # 获取唯一的交易日期和股票代码
-        next_trade_dates = period_data['next_trade_date'].dropna().unique()
         ts_code = period_data['ts_code'].iloc[0]  # 假设所有行的ts_code都相同
+        # 按涨跌幅分类，分类编号按第一次出现的顺序，没有分类的为-1
+        category_codes, category_keys = pd.factorize(
+            pd.Series(PCT_BUCKETS.categorize(period_data['pct_chg'].to_numpy(), ts_code)))
         
-        logger.info("预先批量获取竞价和分钟数据，共%s个交易日", len(next_trade_dates))
-        
-        # 使用线程安全的字典
-        auction_cache = {}
-        minute_data_cache = {
-            '1min': {},
-            '5min': {},
-            '15min': {},
-            '30min': {},
-            '60min': {}
-        }
-        
-        # 批量处理，每批100个交易日
-        batch_size = 100
-        
-        # 批量获取竞价数据
-        batch_start_time = time.time()
-        for i in range(0, len(next_trade_dates), batch_size):
-            batch_dates = next_trade_dates[i:i+batch_size]
-            logger.info("批量获取竞价数据，批次%s/%s，共%s个交易日", 
-                       i//batch_size + 1, (len(next_trade_dates) + batch_size - 1)//batch_size, len(batch_dates))
-            
-            # 使用多线程并行获取该批次的竞价数据
-            with concurrent.futures.ThreadPoolExecutor(max_workers=min(10, len(batch_dates))) as executor:
-                future_to_date = {executor.submit(get_auction_data, ts_code, date): date for date in batch_dates}
-                for future in concurrent.futures.as_completed(future_to_date):
-                    date = future_to_date[future]
-                    try:
-                        auction_cache[date] = future.result()
-                    except Exception as e:
-                        logger.error("获取交易日%s的竞价数据失败: %s", date, e)
-            
-            # 添加延迟，避免请求过快
-            time.sleep(1)
-        
-        logger.info("批量获取竞价数据完成，耗时: %s秒", time.time() - batch_start_time)
+        # 各间隔的交易日 [行, 间隔]，之后没有交易日的为 NaN
+        target_dates = np.column_stack([period_data['trade_date'].shift(-h).to_numpy(dtype=object) for h in horizons])
+        fetch_dates = pd.unique(pd.Series(target_dates.ravel()).dropna()).tolist()
         
-        # 批量获取分钟数据
-        batch_start_time = time.time()
-        for freq, time_key in [(1, '1min'), (5, '5min'), (15, '15min'), (30, '30min'), (60, '60min')]:
-            logger.info("开始获取%s分钟数据", time_key)
-            
-            for i in range(0, len(next_trade_dates), batch_size):
-                batch_dates = next_trade_dates[i:i+batch_size]
-                logger.info("批量获取%s分钟数据，批次%s/%s，共%s个交易日", 
-                           time_key, i//batch_size + 1, (len(next_trade_dates) + batch_size - 1)//batch_size, len(batch_dates))
-                
-                # 使用多线程并行获取该批次的分钟数据
-                with concurrent.futures.ThreadPoolExecutor(max_workers=min(10, len(batch_dates))) as executor:
-                    future_to_date = {executor.submit(get_minutes_data, ts_code, date, freq): date for date in batch_dates}
-                    for future in concurrent.futures.as_completed(future_to_date):
-                        date = future_to_date[future]
-                        try:
-                            minute_data_cache[time_key][date] = future.result()
-                        except Exception as e:
-                            logger.error("获取交易日%s的%s分钟数据失败: %s", date, time_key, e)
-                
-                # 添加延迟，避免请求过快
-                time.sleep(1)
+        logger.debug("预先批量获取竞价和分钟数据，共%s个交易日", len(fetch_dates))
         
-        logger.info("批量获取分钟数据完成，耗时: %s秒", time.time() - batch_start_time)
+        summary = fetch_intraday_data(ts_code, fetch_dates, journal, prefetched)
+        if fetch_state is not None:
+            fetch_state['failures'] = len(summary.failures)
+        # 保存到本地行情库，供回测使用
+        bar_store.save(ts_code, stock_data, summary)
         
         # 检查数据获取情况
-        logger.info("竞价数据获取情况: 共%s/%s个交易日有数据", 
-                   sum(1 for d in auction_cache.values() if not d.empty), len(next_trade_dates))
+        logger.debug("竞价数据获取情况: 共%s/%s个交易日有数据，汇总数据占用%s字节",
+                     summary.count('auction'), len(fetch_dates), summary.nbytes)
         
-        for time_key in minute_data_cache:
-            logger.info("%s数据获取情况: 共%s/%s个交易日有数据", 
-                       time_key, sum(1 for d in minute_data_cache[time_key].values() if not d.empty), len(next_trade_dates))
+        for time_key in MINUTE_WINDOWS:
+            logger.debug("%s数据获取情况: 共%s/%s个交易日有数据",
+                         time_key, summary.count(time_key), len(fetch_dates))
         
-        # 遍历每个涨跌幅分类
-        for category in period_data['pct_chg_category'].unique():
-            category_data = period_data[period_data['pct_chg_category'] == category]
-            
-            # 初始化该分类的结果
-            result[category] = {
-                'auction': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'volume_ratio': 0},
-                '1min': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'max_pct': 0, 'min_pct': 0, 'close_pct': 0, 'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0},
-                '5min': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'max_pct': 0, 'min_pct': 0, 'close_pct': 0, 'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0},
-                '15min': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'max_pct': 0, 'min_pct': 0, 'close_pct': 0, 'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0},
-                '30min': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'max_pct': 0, 'min_pct': 0, 'close_pct': 0, 'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0},
-                '60min': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'max_pct': 0, 'min_pct': 0, 'close_pct': 0, 'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0}
-            }
-            
-            # 遍历该分类的每一天
-            iterrows = category_data.iterrows()
-            iterrows_count = 0
-            
-            for _, row in iterrows:
-                iterrows_count += 1
-                if pd.isna(row['next_trade_date']):
-                    continue
-                
-                next_trade_date = row['next_trade_date']
-                prev_close = row['close']
-                
-                # 使用缓存的竞价数据
-                auction_data = auction_cache.get(next_trade_date, pd.DataFrame())
-                
-                if not auction_data.empty:
-                    # 计算竞价涨跌
-                    auction_open = auction_data['open'].iloc[0]
-                    
-                    if auction_open > prev_close:
-                        result[category]['auction']['up'] += 1
-                    elif auction_open < prev_close:
-                        result[category]['auction']['down'] += 1
-                    else:
-                        result[category]['auction']['equal'] += 1
-                    
-                    result[category]['auction']['total'] += 1
-                    # 计算集合竞价最大涨幅
-                    result[category]['auction']['max_pct'] = round((auction_data['high'].iloc[0] - prev_close) / prev_close * 100, 2)
-                    # 计算集合竞价最小涨幅
-                    result[category]['auction']['min_pct'] = round((auction_data['low'].iloc[0] - prev_close) / prev_close * 100, 2)
-                    # 计算集合竞价收盘涨幅
-                    result[category]['auction']['close_pct'] = round((auction_data['close'].iloc[0] - prev_close) / prev_close * 100, 2)
-                    # 计算该时间区间内 成交量占据流通市值的百分比 保留 2位小数
-                    result[category]['auction']['volume_ratio'] = round(auction_data['amount'].iloc[0] / circ_mv, 2)
-                
-                # 使用缓存的分钟数据
-                for time_key in ['1min', '5min', '15min', '30min', '60min']:
-                    minute_data = minute_data_cache[time_key].get(next_trade_date, pd.DataFrame())
-                    calculate_minutes_data(minute_data, category, time_key, result, row)
-            
-            
-            
-            # 计算概率
-            for time_key in result[category]:
-                total = result[category][time_key]['total']
-                if total > 0:
-                    result[category][time_key]['up_prob'] = round(result[category][time_key]['up'] / total * 100, 2)
-                    result[category][time_key]['down_prob'] = round(result[category][time_key]['down'] / total * 100, 2)
-                    result[category][time_key]['equal_prob'] = round(result[category][time_key]['equal'] / total * 100, 2)
-                    
-                    # 计算平均涨跌幅（仅对非1min和非auction的数据）
-                    if time_key not in ['1min', 'auction'] and 'max_pct_sum' in result[category][time_key]:
-                        result[category][time_key]['max_pct'] = round(result[category][time_key]['max_pct_sum'] / total, 2)
-                        result[category][time_key]['min_pct'] = round(result[category][time_key]['min_pct_sum'] / total, 2)
-                        result[category][time_key]['close_pct'] = round(result[category][time_key]['close_pct_sum'] / total, 2)
+        # 汇总值 [行, 间隔, 时间段, 字段]，没有数据的为 NaN
+        rows = pd.Index(summary.dates).get_indexer(target_dates.ravel()).reshape(target_dates.shape)
+        values = np.full(rows.shape + summary.values.shape[1:], np.nan, dtype=np.float32)
+        values[rows >= 0] = summary.values[rows[rows >= 0]]
+        # 汇总数据是float32，前收盘价也转换为float32再比较，避免精度误差导致持平判断为涨跌
+        prev_close = period_data['close'].to_numpy(dtype=np.float32)
         
-        return result
+        results = {}
+        for h_index, horizon in enumerate(horizons):
+            horizon_stats = stats if stats is not None and horizon == 1 else PctStatsTable()
+            results[horizon] = _horizon_result(values[:, h_index], prev_close, category_codes, category_keys,
+                                               summary.window_index, circ_mv, horizon_stats)
+        return results
     except Exception as e:
         logger.error("计算概率失败: %s", e)
         traceback.print_exc()  # 打印完整的堆栈跟踪
         return {}
 
-def calculate_minutes_data(minute_data: pd.DataFrame, category: str, time_key: str, result: Dict[str, Dict[str, Dict[str, float]]], row: pd.Series) -> pd.DataFrame:
-    """计算分钟数据"""
-    try:
-        if not minute_data.empty:   
-            max_price = minute_data['high'].max()
-            min_price = minute_data['low'].min()
-            
-            # 计算1分钟数据的涨跌, 取最后一条数据
-            # 如果是1min 则取第一条
-            if time_key == '1min':
-                minute_close = minute_data['close'].iloc[0]
-            else:
-                minute_close = minute_data['close'].iloc[-1]
-                # 计算最大涨幅、最小涨幅和收盘涨幅
-                prev_close = row['close']
-                
-                # 计算最大涨幅（使用high列的最大值）
-                
-                max_pct_change = (max_price - prev_close) / prev_close * 100
-                
-                # 计算最小涨幅（使用low列的最小值）
-                
-                min_pct_change = (min_price - prev_close) / prev_close * 100
-                
-                # 计算收盘涨幅
-                close_pct_change = (minute_close - prev_close) / prev_close * 100
-                
-                # 累加涨跌幅，用于后续计算平均值
-                result[category][time_key]['max_pct_sum'] =  max(result[category][time_key]['max_pct_sum'], max_pct_change)
-                result[category][time_key]['min_pct_sum'] =  min(result[category][time_key]['min_pct_sum'], min_pct_change)
-                result[category][time_key]['close_pct_sum'] = max(result[category][time_key]['close_pct_sum'], close_pct_change)
-
-            prev_close = row['close']
-            
-            if minute_close > prev_close:
-                result[category][time_key]['up'] += 1
-               
-            elif minute_close < prev_close:
-                result[category][time_key]['down'] += 1
+def _horizon_result(values: np.ndarray, prev_close: np.ndarray, category_codes: np.ndarray, category_keys,
+                    window_index: Dict[str, int], circ_mv: float,
+                    stats: PctStatsTable) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """一个间隔的概率统计
+    
+    Args:
+        values: 各行对应交易日的汇总值 [行, 时间段, 字段]
+        prev_close: 各行当天的收盘价
+        category_codes: 各行的涨跌幅分类编号，-1为没有分类
+        category_keys: 分类编号对应的分类
+    """
+    n_categories = len(category_keys)
+    result = {category: {} for category in category_keys}
+    for time_key in ['auction'] + list(MINUTE_WINDOWS):
+        window = values[:, window_index[time_key]]
+        valid = ~np.isnan(window[:, LAST_CLOSE]) & (category_codes >= 0)
+        codes = category_codes[valid]
+        price = window[valid, WINDOW_PRICE_FIELDS[time_key]]
+        close = prev_close[valid]
+        up = np.bincount(codes[price > close], minlength=n_categories)
+        down = np.bincount(codes[price < close], minlength=n_categories)
+        total = np.bincount(codes, minlength=n_categories)
+        
+        # 最大涨幅、最小涨幅、收盘涨幅（%），close 为 first 的时间段只统计涨跌次数
+        with_pct = time_key not in FIRST_CLOSE_WINDOWS
+        if with_pct:
+            pcts = (window[valid][:, [HIGH, LOW, LAST_CLOSE]] - close[:, None]) / close[:, None] * 100
+            sums = [np.bincount(codes, weights=pcts[:, m].astype(np.float64), minlength=n_categories) for m in range(3)]
+            for i in np.unique(codes):
+                stats.cell(category_keys[i], time_key).add_many(pcts[codes == i].astype(np.float64))
+        if time_key == 'auction':
+            # 成交量占流通市值的百分比，取该分类最后一个交易日
+            last_row = {code: row for row, code in zip(np.flatnonzero(valid), codes)}
+        
+        for i, category in enumerate(category_keys):
+            n = int(total[i])
+            data = {'up': int(up[i]), 'down': int(down[i]), 'equal': n - int(up[i]) - int(down[i]), 'total': n}
+            if time_key == 'auction':
+                data['volume_ratio'] = round(float(window[last_row[i], AMOUNT] / circ_mv), 2) if i in last_row else 0
             else:
-                result[category][time_key]['equal'] += 1
-            
-            result[category][time_key]['total'] += 1
-    except Exception as e:
-        logger.error("计算分钟数据失败: %s", e)
-        return pd.DataFrame()
+                data.update({'max_pct': 0, 'min_pct': 0, 'close_pct': 0})
+            data.update({
+                'max_pct_sum': float(sums[0][i]) if with_pct and n else 0,
+                'min_pct_sum': float(sums[1][i]) if with_pct and n else 0,
+                'close_pct_sum': float(sums[2][i]) if with_pct and n else 0,
+            })
+            if n > 0:
+                data['up_prob'] = round(data['up'] / n * 100, 2)
+                data['down_prob'] = round(data['down'] / n * 100, 2)
+                data['equal_prob'] = round(data['equal'] / n * 100, 2)
+                # 计算平均涨跌幅和分布（仅对用最后一条收盘价的时间段）
+                if with_pct:
+                    data['max_pct'] = round(data['max_pct_sum'] / n, 2)
+                    data['min_pct'] = round(data['min_pct_sum'] / n, 2)
+                    data['close_pct'] = round(data['close_pct_sum'] / n, 2)
+                    summary_values = stats.cell(category, time_key).summary()
+                    data.update({field: summary_values.get(field, 0) for field in DISTRIBUTION_FIELDS})
+            result[category][time_key] = data
+    return result
     
-def save_probability_to_csv(ts_code: str, probability_data: Dict[str, Dict[str, Dict[str, float]]], time_period: str, stock_name: str):
-    """将概率数据保存到CSV文件"""
+def save_probability_to_csv(ts_code: str, horizon_data: Dict[int, Dict[str, Dict[str, Dict[str, float]]]], time_period: str, stock_name: str):
+    """将各间隔交易日的概率数据保存到CSV文件，"间隔交易日"列为 T+N 的 N"""
     try:
         # 创建数据目录
         data_dir = os.getenv('DATA_DIR', './data')
@@ -613,50 +660,138 @@ def save_probability_to_csv(ts_code: str, probability_data: Dict[str, Dict[str,
         
         # 准备数据
         rows = []
-        for category, time_data in probability_data.items():
-            for time_key, prob_data in time_data.items():
-             
-                row = {
-                    '股票代码': ts_code,
-                    '股票名称': stock_name,
-                    '当日涨幅': LIST_RANGE_MAP.get(category, category),
-                    '场景描述': SCENARIO_DESCRIPTIONS.get(category, f"今天{category}，明天概率情况"),
-                    '时间段': TIME_FREQ_MAP.get(time_key, time_key),
-                    '涨概率': prob_data.get('up_prob', 0),
-                    '跌概率': prob_data.get('down_prob', 0),
-                    '平概率': prob_data.get('equal_prob', 0),
-                    '最大涨幅': prob_data.get('max_pct', 0),
-                    '最小涨幅': prob_data.get('min_pct', 0),
-                    '收盘涨幅': prob_data.get('close_pct', 0),   
-                    # 计算该时间区间内 成交量占据流通市值的百分比
-                    '成交量占比': prob_data.get('volume_ratio', 0),
-                    '样本数': prob_data.get('total', 0),
-                }
-                
-                rows.append(row)
+        for horizon, probability_data in horizon_data.items():
+            for category, time_data in probability_data.items():
+                for time_key, prob_data in time_data.items():
+
+                    row = {
+                        '间隔交易日': horizon,
+                        '股票代码': ts_code,
+                        '股票名称': stock_name,
+                        '当日涨幅': LIST_RANGE_MAP.get(category, category),
+                        '场景描述': SCENARIO_DESCRIPTIONS.get(category, f"今天{category}，明天概率情况"),
+                        '时间段': TIME_FREQ_MAP.get(time_key, time_key),
+                        '涨概率': prob_data.get('up_prob', 0),
+                        '跌概率': prob_data.get('down_prob', 0),
+                        '平概率': prob_data.get('equal_prob', 0),
+                        '最大涨幅': prob_data.get('max_pct', 0),
+                        '最小涨幅': prob_data.get('min_pct', 0),
+                        '收盘涨幅': prob_data.get('close_pct', 0),   
+                        # 计算该时间区间内 成交量占据流通市值的百分比
+                        '成交量占比': prob_data.get('volume_ratio', 0),
+                        '样本数': prob_data.get('total', 0),
+                    }
+                    # 涨跌幅分布: 中位数、分位数、标准差
+                    row.update({column: prob_data.get(field, 0) for field, column in DISTRIBUTION_FIELDS.items()})
+
+                    rows.append(row)
         
         # 创建DataFrame并保存
         df = pd.DataFrame(rows)
         df.to_csv(file_path, index=False, encoding='utf-8-sig')
-        logger.info("概率数据已保存到%s", file_path)
+        logger.debug("概率数据已保存到%s", file_path)
         
         return file_path
     except Exception as e:
         logger.error("保存概率数据失败: %s", e)
         return None
 
-def analyze_stock(ts_code: str, stock_name: str, circ_mv: float) -> Dict[str, Any]:
-    """分析股票数据，计算不同时间维度的涨跌概率"""
+def save_pct_stats(ts_code: str, stats: PctStatsTable, time_period: str) -> Optional[str]:
+    """保存涨跌幅分布统计到 {DATA_DIR}/pct_stats/{ts_code}_{time_period}.npz"""
     try:
+        file_path = stats_file_path(ts_code, time_period)
+        stats.save(file_path)
+        logger.debug("涨跌幅分布统计已保存到%s", file_path)
+        return file_path
+    except Exception as e:
+        logger.error("保存涨跌幅分布统计失败: %s", e)
+        return None
+
+def load_probability_csv(file_path: str, horizon: int = 1) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """读取保存的概率数据中 T+horizon 的部分，转换为字典格式"""
+    df = pd.read_csv(file_path, encoding='utf-8-sig')
+    # 旧的概率文件只有 T+1，没有"间隔交易日"列
+    if '间隔交易日' in df.columns:
+        df = df[df['间隔交易日'] == horizon]
+    elif horizon != 1:
+        return {}
+    
+    period_result = {}
+    for category in df['当日涨幅'].unique():
+        category_data = df[df['当日涨幅'] == category]
+        period_result[category] = {}
+        
+        for _, row in category_data.iterrows():
+            time_key = next((k for k, v in TIME_FREQ_MAP.items() if v == row['时间段']), row['时间段'])
+            period_result[category][time_key] = {
+                'up_prob': row['涨概率'],
+                'down_prob': row['跌概率'],
+                'equal_prob': row['平概率'],
+                'max_pct': row['最大涨幅'],
+                'min_pct': row['最小涨幅'],
+                'close_pct': row['收盘涨幅'],
+                'total': row['样本数']
+            }
+            # 旧的概率文件没有分布列
+            period_result[category][time_key].update(
+                {field: row[column] for field, column in DISTRIBUTION_FIELDS.items() if column in row.index})
+    return period_result
+
+def result_fingerprint(stock_data: pd.DataFrame, time_period: str, circ_mv: float) -> str:
+    """概率结果的输入指纹
+    
+    包括时间周期、间隔交易日、时间周期内的最后一个交易日和日线内容的哈希、时间周期内已归档的分钟线交易日、
+    涨跌幅分档和分钟时间段配置、流通市值（竞价成交量占比）和计算逻辑版本，任何一项变化都需要重新计算。
+    """
+    end_date = stock_data['trade_date'].max()
+    start_date = period_start_date(end_date, time_period) or end_date
+    period_data = stock_data[stock_data['trade_date'] >= start_date].sort_values('trade_date')
+    ts_code = period_data['ts_code'].iloc[0] if 'ts_code' in period_data.columns and len(period_data) else ''
+    archived = minute_archive.archived_days(ts_code, INTRADAY_WINDOWS.fetch_end) if ts_code else set()
+    minute_days = sorted(archived.intersection(period_data['trade_date'].astype(str)))
+    return make_fingerprint(
+        version=CALC_VERSION,
+        time_period=time_period,
+        horizons=HORIZONS,
+        last_bar_date=end_date,
+        bars=frame_hash(period_data, ['trade_date', 'close', 'pct_chg']),
+        minute_days=config_hash(minute_days),
+        buckets=config_hash(PCT_BUCKETS.config),
+        windows=config_hash(INTRADAY_WINDOWS.config),
+        circ_mv=round(float(circ_mv or 0), 2),
+    )
+
+def analyze_stock(ts_code: str, stock_name: str, circ_mv: float, journal: Optional[RunJournal] = None,
+                  reuse_existing: bool = False, horizon: int = 1,
+                  progress: Optional[ProgressLogger] = None) -> Dict[str, Any]:
+    """分析股票数据，计算不同时间维度的涨跌概率
+    
+    Args:
+        journal: 刷新任务日志，股票有缺口时只补拉缺口数据并重新计算
+        reuse_existing: 为True时直接复用已有的分析结果，不检查输入是否变化
+        horizon: 返回 T+horizon 的概率，所有 HORIZONS 一次计算并保存
+        progress: 批量分析时调用方循环的进度日志限流器，耗时日志与循环的进度日志一起限流，不指定则不限流
+    
+    结果按输入指纹（见 result_fingerprint）复用: 日线没有新数据、配置和计算逻辑没有变化时
+    不重新计算，非交易日和停牌的股票只读取本地行情库。
+    """
+    try:
+        if horizon not in HORIZONS:
+            return {"error": f"不支持的间隔交易日: {horizon}，可选 {','.join(map(str, HORIZONS))}"}
         # 检查本地是否已有分析结果
         data_dir = os.getenv('DATA_DIR', './data')
         results = {}
         
-        # 获取股票日线数据
-        stock_data = get_stock_daily_data(ts_code)
+        # 有缺口的股票需要补拉数据后重新计算
+        gaps = journal.gaps_for(ts_code) if journal is not None else set()
+        prefetched = journal.load_fetch_cache(ts_code) if gaps else None
+        if gaps:
+            logger.info("股票%s有%s个缺口，补拉缺口数据后重新计算", ts_code, len(gaps))
         
-        if stock_data.empty:
-            return {"error": f"获取股票{ts_code}数据失败"}
+        # 日线数据只在需要计算时获取
+        stock_data = None
+        # 重新计算的 T+1 概率，推送给订阅了该股票的客户端
+        updated = {}
         
         # 计算不同时间维度的概率
         for time_period in TIME_PERIOD_MAP.keys():
@@ -665,43 +800,48 @@ def analyze_stock(ts_code: str, stock_name: str, circ_mv: float) -> Dict[str, An
             # 检查本地是否已有该时间维度的分析结果
             file_path = os.path.join(data_dir, f"{ts_code}_{time_period}_probability.csv")
             
-            if os.path.exists(file_path):
-                # 如果文件存在且是今天生成的，直接读取
-                file_time = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
-                if file_time.date() == datetime.datetime.now().date():
-                    df = pd.read_csv(file_path, encoding='utf-8-sig')
-                   
-                    # 转换为字典格式
-                    period_result = {}
-                    for category in df['当日涨幅'].unique():
-                        category_data = df[df['当日涨幅'] == category]
-                        period_result[category] = {}
-                        
-                        for _, row in category_data.iterrows():
-                            time_key = next((k for k, v in TIME_FREQ_MAP.items() if v == row['时间段']), row['时间段'])
-                            period_result[category][time_key] = {
-                                'up_prob': row['涨概率'],
-                                'down_prob': row['跌概率'],
-                                'equal_prob': row['平概率'],
-                                'max_pct': row['最大涨幅'],
-                                'min_pct': row['最小涨幅'],
-                                'close_pct': row['收盘涨幅'],
-                                'total': row['样本数']
-                            }
-                    
-                    results[time_period] = period_result
-                    continue
+            if not gaps and reuse_existing and os.path.exists(file_path):
+                results[time_period] = load_probability_csv(file_path, horizon)
+                continue
+            
+            # 获取股票日线数据，本地行情库已覆盖到最近交易日时不请求接口
+            if stock_data is None:
+                stock_data = get_stock_daily_data(ts_code)
+                
+                if stock_data.empty:
+                    return {"error": f"获取股票{ts_code}数据失败"}
+            
+            # 输入指纹没有变化时直接读取已有结果
+            fingerprint = result_fingerprint(stock_data, time_period, circ_mv)
+            if not gaps and os.path.exists(file_path) and fingerprint_store.get(ts_code, time_period) == fingerprint:
+                results[time_period] = load_probability_csv(file_path, horizon)
+                continue
             
             # 计算概率
-            probability = calculate_probability(stock_data, time_period, circ_mv)
+            stats = PctStatsTable()
+            fetch_state = {}
+            horizon_probability = calculate_horizon_probability(stock_data, time_period, circ_mv, journal, prefetched,
+                                                                stats, fetch_state=fetch_state)
             
-            if probability:
+            if horizon_probability:
                 # 保存到CSV
-                save_probability_to_csv(ts_code, probability, time_period, stock_name)
-                results[time_period] = probability
+                save_probability_to_csv(ts_code, horizon_probability, time_period, stock_name)
+                # 保存涨跌幅分布统计，用于跨股票合并
+                save_pct_stats(ts_code, stats, time_period)
+                # 有请求失败或还有缺口时不保存指纹，下次分析时重新计算；
+                # 指纹在计算后重新生成，包含本次归档的分钟线交易日
+                if fetch_state.get('failures'):
+                    logger.warning("股票%s %s有%s个竞价或分钟数据请求失败，不保存结果指纹",
+                                   ts_code, time_period, fetch_state['failures'])
+                elif journal is None or not journal.gaps_for(ts_code):
+                    fingerprint_store.set(ts_code, time_period, result_fingerprint(stock_data, time_period, circ_mv))
+                results[time_period] = horizon_probability[horizon]
+                updated[time_period] = horizon_probability[1]
             # 计算分析耗时, 猜测加粗打印
             end_time = time.time()
-            logger.info("分析股票%s %s 耗时: %s秒", ts_code, time_period, end_time - start_time)
+            (progress or logger).info("分析股票%s %s 耗时: %s秒", ts_code, time_period, end_time - start_time)
+        if updated:
+            update_publisher.publish_probability(ts_code, updated)
         return results
     except Exception as e:
         # 打印完成错误堆栈
@@ -709,20 +849,21 @@ def analyze_stock(ts_code: str, stock_name: str, circ_mv: float) -> Dict[str, An
         logger.error("分析股票%s失败: %s", ts_code, e)
         return {"error": str(e)}
 
-def get_stock_probability_by_pct(ts_code: str, pct_chg: float) -> Dict[str, Dict[str, float]]:
+def get_stock_probability_by_pct(ts_code: str, pct_chg: float, horizon: int = 1) -> Dict[str, Dict[str, float]]:
     """
     获取特定股票在特定涨幅范围内的平均概率
     
     Args:
         ts_code: 股票代码
         pct_chg: 涨跌幅百分比，例如4.75
+        horizon: 间隔交易日，1为第二天
         
     Returns:
         所有时间段的平均概率数据
     """
     try:
         # 根据涨跌幅确定对应的分类
-        category = categorize_pct_change(pct_chg)
+        category = categorize_pct_change(pct_chg, ts_code)
         
         # 获取对应的涨幅区间显示值
         display_range = LIST_RANGE_MAP.get(category, category)
@@ -753,8 +894,12 @@ def get_stock_probability_by_pct(ts_code: str, pct_chg: float) -> Dict[str, Dict
                 # 读取CSV文件
                 df = pd.read_csv(file_path)
                 
-                # 筛选特定涨幅区间的数据
+                # 筛选特定涨幅区间、间隔交易日的数据，旧的概率文件只有 T+1
                 filtered_df = df[df['当日涨幅'] == display_range]
+                if '间隔交易日' in filtered_df.columns:
+                    filtered_df = filtered_df[filtered_df['间隔交易日'] == horizon]
+                elif horizon != 1:
+                    continue
                 
                 if filtered_df.empty:
                     logger.warning("文件%s中没有涨幅为%s的数据", file_path, display_range)
@@ -0,0 +1,75 @@
+"""
+服务冷启动耗时基准
+
+启动 python app.py 子进程，轮询根路由直到返回200，统计从启动进程到服务可用的耗时，
+并检查启动后 pandas、tushare 是否被提前导入。
+
+用法: python benchmarks/startup_bench.py [--runs 5] [--port 18765]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只导入 app.py，检查重量级模块是否被导入
+IMPORT_CHECK = """
+import importlib.util, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('main_app', 'app.py')
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+print('%.3f %s %s' % (elapsed, 'pandas' in sys.modules, 'tushare' in sys.modules))
+"""
+
+
+def wait_until_healthy(url: str, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=0.2) as response:
+                if response.status == 200:
+                    return True
+        except Exception:
+            time.sleep(0.01)
+    return False
+
+
+def measure_cold_start(port: int, timeout: float) -> float:
+    env = dict(os.environ, API_PORT=str(port), API_HOST='127.0.0.1', API_DEBUG='false')
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_until_healthy(f'http://127.0.0.1:{port}/', timeout):
+            raise RuntimeError(f'服务在{timeout}秒内没有启动')
+        return time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务冷启动耗时基准')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--port', type=int, default=18765)
+    parser.add_argument('--timeout', type=float, default=30)
+    args = parser.parse_args()
+
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_CHECK], cwd=ROOT_DIR, text=True,
+                                     stderr=subprocess.DEVNULL)
+    import_time, pandas_loaded, tushare_loaded = output.split()
+    print(f'导入app.py耗时: {float(import_time):.3f}秒, pandas已导入: {pandas_loaded}, tushare已导入: {tushare_loaded}')
+
+    timings = [measure_cold_start(args.port, args.timeout) for _ in range(args.runs)]
+    print(f'冷启动到根路由可用: 最小{min(timings):.3f}秒, 中位数{statistics.median(timings):.3f}秒, '
+          f'最大{max(timings):.3f}秒 ({args.runs}次)')
+
+
+if __name__ == '__main__':
+    main()
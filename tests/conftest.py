@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+# 日志和数据写到临时目录，需在导入 app 模块之前设置
+_tmp_dir = tempfile.mkdtemp(prefix='stock_tests_')
+os.environ.setdefault('LOG_DIR', os.path.join(_tmp_dir, 'logs'))
+os.environ.setdefault('DATA_DIR', os.path.join(_tmp_dir, 'data'))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """stk_mins 每分钟10次，为交互请求保留2次"""
+    from app.utils import tushare_client as tc
+
+    monkeypatch.setattr(tc, 'ENDPOINT_LIMITS', {'stk_mins': 10})
+    monkeypatch.setenv('TUSHARE_INTERACTIVE_RESERVE', '0.2')
+
+
+@pytest.fixture
+def fake_pro(monkeypatch, tmp_path):
+    """tushare_utils 使用 FakePro，数据目录为临时目录，不限制频率"""
+    from app.utils import tushare_client as tc
+    from app.utils import tushare_utils as tu
+    from tests.tushare_fakes import TOKEN, FakePro
+
+    monkeypatch.setenv('DATA_DIR', str(tmp_path))
+    monkeypatch.setenv('TUSHARE_QUOTA_COOLDOWN', '0.01')
+    monkeypatch.setattr(tc, 'ENDPOINT_LIMITS', {})
+    monkeypatch.setitem(tu._trade_calendar_cache, 'date', None)
+    fake = FakePro()
+    client = tc.TushareClient(token=TOKEN)
+    client.slots[0].api = fake
+    monkeypatch.setattr(tu, 'pro', client)
+    return fake
@@ -0,0 +1,66 @@
+import shutil
+import datetime
+from app.utils import tushare_utils as tu
+from app.utils.fingerprint import fingerprint_store
+
+TS_CODE = '000006.SZ'
+
+
+def analyze(fake):
+    before = dict(fake.calls)
+    result = tu.analyze_stock(TS_CODE, '测试', 8e5)
+    assert 'error' not in result
+    return {name: count - before.get(name, 0) for name, count in fake.calls.items()}
+
+
+def test_result_reused_when_inputs_unchanged(fake_pro):
+    first = analyze(fake_pro)
+    assert first['stk_auction_o'] > 0 and first['stk_mins'] > 0
+    assert fingerprint_store.get(TS_CODE, 'y2') is not None
+    assert not any(analyze(fake_pro).values())
+
+
+def test_failed_fetch_does_not_freeze_result(fake_pro):
+    fake_pro.fail_dates = {'20250103', '20250210'}
+    analyze(fake_pro)
+    # 没有任务日志时请求失败也不保存指纹
+    assert fingerprint_store.get(TS_CODE, 'y2') is None
+
+    fake_pro.fail_dates = set()
+    calls = analyze(fake_pro)
+    # 失败的分钟数据没有归档，只重新请求这两天
+    assert calls['stk_mins'] == 2
+    assert fingerprint_store.get(TS_CODE, 'y2') is not None
+    assert not any(analyze(fake_pro).values())
+
+
+def test_minute_archive_change_invalidates_result(fake_pro, tmp_path):
+    analyze(fake_pro)
+    shutil.rmtree(tmp_path / 'minutes')
+    calls = analyze(fake_pro)
+    assert calls['stk_mins'] > 0
+
+
+def freeze_now(monkeypatch, now):
+    class FrozenDatetime(datetime.datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls.fromisoformat(now)
+
+    monkeypatch.setattr(datetime, 'datetime', FrozenDatetime)
+
+
+def test_unpublished_daily_not_requested_intraday(fake_pro, monkeypatch):
+    # 交易日盘中，当天的日线还没有发布
+    fake_pro.unpublished = {'20250307'}
+    freeze_now(monkeypatch, '2025-03-07 10:00:00')
+    analyze(fake_pro)
+    calls = analyze(fake_pro)
+    assert calls.get('daily', 0) == 0 and calls.get('daily_basic', 0) == 0
+
+    # 发布时间之后请求一次当天的日线
+    fake_pro.unpublished = set()
+    freeze_now(monkeypatch, '2025-03-07 17:30:00')
+    assert analyze(fake_pro)['daily'] == 1
+    calls = analyze(fake_pro)
+    assert calls.get('daily', 0) == 0 and calls.get('daily_basic', 0) == 0
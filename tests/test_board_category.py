@@ -0,0 +1,27 @@
+from app.services.stock_service import StockService
+from app.services.probability_store import rollup_cube
+from app.utils.tushare_utils import PCT_BUCKETS
+
+
+def board_of(ts_code):
+    return int(PCT_BUCKETS.board_index([ts_code])[0])
+
+
+def test_category_uses_requested_board():
+    assert StockService._board_category(-6, [board_of('300001.SZ')]) == 'sharp_down_5_7p'
+    assert StockService._board_category(-6, [board_of('600000.SH')]) == 'limit_down'
+    # 各板块分类相同时不需要指定板块
+    assert StockService._board_category(2) == 'range_1_3p'
+    assert StockService._board_category(-6) is None
+
+
+def test_rollup_rejects_ambiguous_pct_chg(monkeypatch):
+    monkeypatch.setattr(rollup_cube, 'boards', lambda *args, **kwargs: [0, 1])
+    assert 'error' in StockService.get_rollup([], pct_chg=-6)
+
+
+def test_distribution_uses_board_of_ts_codes(monkeypatch, tmp_path):
+    monkeypatch.setenv('DATA_DIR', str(tmp_path))
+    assert 'error' in StockService.get_pct_distribution(pct_chg=-6, ts_codes=['300001.SZ', '600000.SH'])
+    result = StockService.get_pct_distribution(pct_chg=-6, ts_codes=['300001.SZ', '300750.SZ'])
+    assert 'error' not in result
@@ -0,0 +1,88 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from app.utils import tushare_utils as tu
+from app.utils.day_summary import OPEN, HIGH, LOW, FIRST_CLOSE, LAST_CLOSE, AMOUNT
+from app.utils.pct_stats import PctStatsTable, DISTRIBUTION_FIELDS
+from app.utils.fetch_planner import period_start_date
+
+
+def reference_probability(stock_data, time_period, circ_mv, summary, horizon=1):
+    """逐行计算的参考实现，horizon=1 时与向量化之前的 calculate_probability 相同"""
+    end_date = stock_data['trade_date'].max()
+    period_data = stock_data[stock_data['trade_date'] >= period_start_date(end_date, time_period)] \
+        .sort_values('trade_date', ignore_index=True)
+    period_data['pct_chg_category'] = tu.PCT_BUCKETS.categorize(period_data['pct_chg'].to_numpy(),
+                                                                period_data['ts_code'].iloc[0])
+    period_data['next_trade_date'] = period_data['trade_date'].shift(-horizon)
+    stats = PctStatsTable()
+    result = {}
+    for category in period_data['pct_chg_category'].dropna().unique():
+        result[category] = {
+            'auction': {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'volume_ratio': 0,
+                        'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0},
+            **{time_key: {'up': 0, 'down': 0, 'equal': 0, 'total': 0, 'max_pct': 0, 'min_pct': 0, 'close_pct': 0,
+                          'max_pct_sum': 0, 'min_pct_sum': 0, 'close_pct_sum': 0}
+               for time_key in tu.MINUTE_WINDOWS}
+        }
+        for _, row in period_data[period_data['pct_chg_category'] == category].iterrows():
+            if pd.isna(row['next_trade_date']):
+                continue
+            prev_close = np.float32(row['close'])
+            auction = summary.get(row['next_trade_date'], 'auction')
+            if auction is not None:
+                cell = result[category]['auction']
+                cell['up' if auction[OPEN] > prev_close else 'down' if auction[OPEN] < prev_close else 'equal'] += 1
+                cell['total'] += 1
+                pcts = [float((auction[field] - prev_close) / prev_close * 100) for field in (HIGH, LOW, LAST_CLOSE)]
+                cell['max_pct_sum'] += pcts[0]
+                cell['min_pct_sum'] += pcts[1]
+                cell['close_pct_sum'] += pcts[2]
+                stats.add(category, 'auction', pcts)
+                cell['volume_ratio'] = round(float(auction[AMOUNT] / circ_mv), 2)
+            for time_key in tu.MINUTE_WINDOWS:
+                minute = summary.get(row['next_trade_date'], time_key)
+                if minute is None:
+                    continue
+                cell = result[category][time_key]
+                if time_key in tu.FIRST_CLOSE_WINDOWS:
+                    close = minute[FIRST_CLOSE]
+                else:
+                    close = minute[LAST_CLOSE]
+                    pcts = [(minute[field] - prev_close) / prev_close * 100 for field in (HIGH, LOW, LAST_CLOSE)]
+                    cell['max_pct_sum'] += float(pcts[0])
+                    cell['min_pct_sum'] += float(pcts[1])
+                    cell['close_pct_sum'] += float(pcts[2])
+                    stats.add(category, time_key, pcts)
+                cell['up' if close > prev_close else 'down' if close < prev_close else 'equal'] += 1
+                cell['total'] += 1
+        for time_key, cell in result[category].items():
+            total = cell['total']
+            if total > 0:
+                cell['up_prob'] = round(cell['up'] / total * 100, 2)
+                cell['down_prob'] = round(cell['down'] / total * 100, 2)
+                cell['equal_prob'] = round(cell['equal'] / total * 100, 2)
+                if time_key not in tu.FIRST_CLOSE_WINDOWS:
+                    cell['max_pct'] = round(cell['max_pct_sum'] / total, 2)
+                    cell['min_pct'] = round(cell['min_pct_sum'] / total, 2)
+                    cell['close_pct'] = round(cell['close_pct_sum'] / total, 2)
+                    summary_values = stats.get(category, time_key).summary()
+                    cell.update({field: summary_values.get(field, 0) for field in DISTRIBUTION_FIELDS})
+    return result
+
+
+def dump(result):
+    return json.dumps(result, sort_keys=True, default=float)
+
+
+@pytest.mark.parametrize('ts_code', ['000006.SZ', '300001.SZ'])
+def test_matches_row_loop(fake_pro, ts_code):
+    fake_pro.fail_dates = {'20241105', '20241203', '20250106', '20250210'}
+    stock_data = tu.get_stock_daily_data(ts_code)
+    summary = tu.fetch_intraday_data(ts_code, [])
+    results = tu.calculate_horizon_probability(stock_data, 'y2', 8e5, prefetched=summary)
+    assert results and summary.failures
+    for horizon in tu.HORIZONS:
+        assert dump(results[horizon]) == dump(reference_probability(stock_data, 'y2', 8e5, summary, horizon))
+    assert dump(tu.calculate_probability(stock_data, 'y2', 8e5, prefetched=summary)) == dump(results[1])
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+from app.utils import minute_archive as ma
+from app.utils.minute_archive import MinuteArchive, window_summary, window_summaries, MORNING_MINUTES
+
+TS_CODE = '000001.SZ'
+
+
+def minute_frame(day, minutes, seed):
+    """接口格式的1分钟线，价格为整分，times 为 09:30 起的分钟偏移"""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp(f'{day} 09:30')
+    times = [start + pd.Timedelta(minutes=int(m) + (90 if m > MORNING_MINUTES else 0)) for m in minutes]
+    close = np.round(10 + np.cumsum(rng.integers(-3, 4, len(minutes))) / 100, 2)
+    return pd.DataFrame({
+        'ts_code': TS_CODE,
+        'trade_time': [t.strftime('%Y-%m-%d %H:%M:%S') for t in times],
+        'open': np.round(close - 0.01, 2), 'high': np.round(close + 0.02, 2), 'low': np.round(close - 0.02, 2),
+        'close': close, 'vol': rng.integers(100, 1000, len(minutes)).astype(float),
+        'amount': rng.integers(10000, 99999, len(minutes)).astype(float),
+    })
+
+
+def assert_day(bars, day, frame):
+    index = list(bars.days).index(int(day))
+    rows = slice(bars.starts[index], bars.starts[index] + bars.counts[index])
+    for name in ('open', 'high', 'low', 'close'):
+        np.testing.assert_allclose(bars.prices(name)[rows], frame[name].to_numpy())
+    np.testing.assert_array_equal(bars.columns['amount'][rows], frame['amount'].to_numpy(dtype=np.int64))
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return MinuteArchive(str(tmp_path))
+
+
+def test_write_merge_read(archive):
+    frames = {
+        '20250103': minute_frame('20250103', range(0, 121), 1),
+        '20250106': minute_frame('20250106', range(0, 121), 2),
+        '20250205': minute_frame('20250205', range(0, 121), 3),
+    }
+    archive.write(TS_CODE, frames)
+    # 同一交易日以新数据为准，其他交易日保留，没有数据的交易日记录为0行
+    newer = minute_frame('20250103', range(0, 61), 4)
+    archive.write(TS_CODE, {'20250103': newer, '20250107': pd.DataFrame()})
+
+    bars = archive.read(TS_CODE)
+    assert list(bars.days) == [20250103, 20250106, 20250107, 20250205]
+    assert list(bars.counts) == [61, 121, 0, 121]
+    assert_day(bars, '20250103', newer)
+    assert_day(bars, '20250106', frames['20250106'])
+    assert_day(bars, '20250205', frames['20250205'])
+
+    subset = archive.read(TS_CODE, ['20250106', '20250205'])
+    assert list(subset.days) == [20250106, 20250205]
+    assert_day(subset, '20250205', frames['20250205'])
+
+
+def test_read_mba1_block(archive, tmp_path):
+    frame = minute_frame('20240502', range(0, 121), 5)
+    columns = MinuteArchive._to_columns(frame)
+    block = ma._encode_block(np.array([20240502]), np.array([len(columns)]), np.array([MORNING_MINUTES]),
+                             {name: columns[name].to_numpy() for name in ma.DELTA_COLUMNS + ma.RAW_COLUMNS})
+    # MBA1 没有每天的请求范围
+    _, n_days, n_rows = ma.HEADER.unpack_from(block)
+    header_end = ma.HEADER.size + 8 * n_days
+    v1 = ma.HEADER.pack(ma.MAGIC_V1, n_days, n_rows) + block[ma.HEADER.size:header_end] + block[header_end + 4 * n_days:]
+    (tmp_path / TS_CODE).mkdir()
+    (tmp_path / TS_CODE / '202405.mba').write_bytes(v1)
+
+    bars = archive.read(TS_CODE)
+    assert list(bars.days) == [20240502]
+    assert_day(bars, '20240502', frame)
+    assert archive.archived_days(TS_CODE, MORNING_MINUTES) == {'20240502'}
+    assert archive.archived_days(TS_CODE, MORNING_MINUTES + 1) == set()
+
+    # 追加交易日后改写为 MBA2，原有交易日保留上午的请求范围
+    archive.write(TS_CODE, {'20240506': minute_frame('20240506', range(0, 241), 6)}, until=240)
+    assert (tmp_path / TS_CODE / '202405.mba').read_bytes()[:4] == ma.MAGIC
+    assert_day(archive.read(TS_CODE), '20240502', frame)
+    assert archive.archived_days(TS_CODE, 240) == {'20240506'}
+
+
+def test_archived_days_until(archive):
+    archive.write(TS_CODE, {'20250103': minute_frame('20250103', range(0, 121), 7)})
+    archive.write(TS_CODE, {'20250106': minute_frame('20250106', range(0, 241), 8),
+                            '20250303': pd.DataFrame()}, until=240)
+    assert archive.archived_days(TS_CODE) == {'20250103', '20250106', '20250303'}
+    assert archive.archived_days(TS_CODE, 121) == {'20250106', '20250303'}
+    assert archive.archived_days('000002.SZ') == set()
+
+
+def test_window_summary_matches_pandas(archive):
+    frames = {day: minute_frame(day, sorted(set(np.random.default_rng(i).integers(0, 241, 150))), i)
+              for i, day in enumerate(['20250102', '20250103', '20250106', '20250107'])}
+    archive.write(TS_CODE, frames, until=240)
+    bars = archive.read(TS_CODE)
+    data = pd.concat([MinuteArchive._to_columns(frame) for frame in frames.values()], ignore_index=True)
+
+    windows = {'5min': (0, 5), 'morning': (1, 120), 'afternoon': (121, 240), 'empty': (300, 310)}
+    summaries = window_summaries(bars, windows)
+    for key, (start, end) in windows.items():
+        selected = data[(data['minute'] >= start) & (data['minute'] <= end)]
+        expected = selected.groupby('day').agg(open=('open', 'first'), high=('high', 'max'), low=('low', 'min'),
+                                               first_close=('close', 'first'), last_close=('close', 'last'),
+                                               amount=('amount', 'sum'))
+        day_index, values = summaries[key]
+        np.testing.assert_array_equal(bars.days[day_index], expected.index.to_numpy())
+        expected_values = expected.to_numpy(dtype=np.float64)
+        expected_values[:, :5] /= ma.PRICE_SCALE
+        np.testing.assert_allclose(values, expected_values.astype(np.float32), rtol=1e-6)
+        day_index_single, values_single = window_summary(bars, start, end)
+        np.testing.assert_array_equal(day_index_single, day_index)
+        np.testing.assert_array_equal(values_single, values)
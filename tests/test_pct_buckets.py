@@ -0,0 +1,35 @@
+import copy
+import pytest
+from app.utils.pct_buckets import DEFAULT_BUCKET_CONFIG, PctBuckets
+
+
+@pytest.fixture
+def buckets():
+    return PctBuckets(DEFAULT_BUCKET_CONFIG)
+
+
+def test_boards_use_own_limits(buckets):
+    values = [-6, 8, -20, 20, -19, 9.5, -5]
+    assert list(buckets.categorize(values, '300001.SZ')) == [
+        'sharp_down_5_7p', 'range_7_10p', 'limit_down_20p', 'limit_up_20p', 'sharp_down_10_19p',
+        'range_7_10p', 'sharp_down_5_7p']
+    assert list(buckets.categorize(values, '600000.SH')) == [
+        'limit_down', 'range_7_9p', 'limit_down', 'limit_up', 'limit_down', 'limit_up', 'limit_down']
+
+
+def test_displays_follow_board_edges(buckets):
+    display = buckets.display_map()
+    assert display['range_7_9p'] == '7-9'
+    assert display['range_7_10p'] == '7-10'
+    assert display['range_10_19p'] == '10-19'
+    assert len(set(display.values())) == len(display)
+    names = buckets.category_names()
+    assert names['limit_up'] == '涨停(>=9.5%)'
+    assert names['limit_up_20p'] == '涨停(>=19.5%)'
+
+
+def test_shared_key_must_have_same_interval():
+    config = copy.deepcopy(DEFAULT_BUCKET_CONFIG)
+    config['boards'][0]['down_keys'][-1] = 'limit_down'
+    with pytest.raises(ValueError):
+        PctBuckets(config)
@@ -0,0 +1,51 @@
+import pandas as pd
+from app.services.probability_store import ProbabilityTable
+from app.services.stock_service import StockService
+from app.services import probability_store
+
+
+def write_probability(data_dir, ts_code, up_prob):
+    pd.DataFrame({
+        '股票名称': [ts_code], '当日涨幅': ['1-3'], '时间段': ['auction'], '间隔交易日': [1], '样本数': [10],
+        '涨概率': [up_prob], '跌概率': [100 - up_prob], '平概率': [0], '最大涨幅': [1], '最小涨幅': [-1],
+        '收盘涨幅': [0.5], '成交量占比': [1],
+    }).to_csv(data_dir / f'{ts_code}_y2_probability.csv', index=False, encoding='utf-8-sig')
+
+
+def test_lookup_uses_one_snapshot(tmp_path):
+    table = ProbabilityTable(str(tmp_path))
+    write_probability(tmp_path, '000002.SZ', 60)
+    table.ensure_loaded(force=True)
+    snapshot = table.snapshot()
+
+    # 重建后行号变化，旧快照的行号仍对应旧快照的列
+    write_probability(tmp_path, '000001.SZ', 30)
+    table.ensure_loaded(force=True)
+    columns = snapshot[0]
+    rows = table.lookup_rows('000002.SZ', 'y2', snapshot=snapshot)
+    assert list(columns['up_prob'][rows]) == [60]
+    rows = table.lookup_rows('000002.SZ', 'y2')
+    assert list(table.columns['up_prob'][rows]) == [60]
+
+
+def test_batch_probability_survives_reload(monkeypatch, tmp_path):
+    table = ProbabilityTable(str(tmp_path))
+    write_probability(tmp_path, '000002.SZ', 60)
+    table.ensure_loaded(force=True)
+    monkeypatch.setattr(probability_store, 'probability_table', table)
+    monkeypatch.setattr(StockService, 'get_stock_index', staticmethod(lambda: {}))
+
+    lookup_rows = table.lookup_rows
+    calls = []
+
+    def reload_then_lookup(*args, **kwargs):
+        # 取结果时概率表被其他线程重建，000001排在000002之前，行号变化
+        calls.append(args)
+        if len(calls) == 2:
+            write_probability(tmp_path, '000001.SZ', 30)
+            table.ensure_loaded(force=True)
+        return lookup_rows(*args, **kwargs)
+
+    monkeypatch.setattr(table, 'lookup_rows', reload_then_lookup)
+    result = StockService.get_batch_probability([{'ts_code': '000002.SZ'}], 'y2', fetch_missing=False)
+    assert result[0]['categories']['range_1_3p']['auction']['up_prob'] == 60
@@ -0,0 +1,25 @@
+import logging
+from app.utils.logger import ProgressLogger
+from app.utils import tushare_utils as tu
+
+
+def test_fetch_loops_log_their_last_line(monkeypatch, caplog, fake_pro):
+    monkeypatch.setenv('LOG_PROGRESS_INTERVAL', '3600')
+    with caplog.at_level(logging.INFO, logger=tu.logger.name):
+        tu._fetch_dates('000001.SZ', '竞价', 'stk_auction_o', ['20250102', '20250103', '20250106'], lambda date: date)
+        tu._fetch_dates('000002.SZ', '竞价', 'stk_auction_o', ['20250102', '20250103'], lambda date: date)
+    lines = [record.getMessage() for record in caplog.records if '获取竞价数据' in record.getMessage()]
+    # 每个循环首条和最后一条都输出，第二只股票不会被第一只股票的限流吞掉
+    assert lines[0].startswith('股票000001.SZ获取竞价数据 1/3')
+    assert lines[1].startswith('股票000001.SZ获取竞价数据 3/3') and '省略1条' in lines[1]
+    assert lines[2].startswith('股票000002.SZ获取竞价数据 1/2')
+    assert lines[3].startswith('股票000002.SZ获取竞价数据 2/2')
+
+
+def test_force_flushes_skipped_count(caplog):
+    logger = logging.getLogger('tests.progress')
+    progress = ProgressLogger(logger, interval=3600)
+    with caplog.at_level(logging.INFO, logger='tests.progress'):
+        for i in range(5):
+            progress.info("进度 %s", i, force=i == 4)
+    assert [record.getMessage() for record in caplog.records] == ['进度 0', '进度 4（省略3条进度日志）']
@@ -0,0 +1,35 @@
+import multiprocessing
+from app.utils.rate_ledger import RateLedger, token_key
+from tests.tushare_fakes import TOKEN, make_client
+
+
+def _take_bulk(db_path, attempts, results):
+    ledger = RateLedger(db_path)
+    results.put(sum(1 for _ in range(attempts) if not ledger.try_acquire(token_key(TOKEN), 'stk_mins', 8)))
+
+
+def test_limit_shared_between_processes(tmp_path):
+    db_path = str(tmp_path / 'rate.db')
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_take_bulk, args=(db_path, 10, results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+    assert sum(results.get(timeout=5) for _ in processes) == 8
+
+
+def test_cooldown_shared_between_clients(tmp_path, limits):
+    first, second = make_client(tmp_path / 'rate.db'), make_client(tmp_path / 'rate.db')
+    first.slots[0].in_flight += 1
+    first._release(first.slots[0], 'stk_mins', Exception('抱歉，您每分钟最多访问该接口10次'))
+    slot, wait_time = second._try_take('stk_mins', 'interactive', False)
+    assert slot is None and wait_time > 50
+
+
+def test_ledger_falls_back_to_local_limit(tmp_path, limits):
+    client = make_client(tmp_path / 'missing' / 'file' / 'rate.db')
+    client.ledger.db_path = str(tmp_path)  # 目录不能作为数据库打开
+    assert client.call('stk_mins') == 'ok'
+    assert client.slots[0].limiters['stk_mins'].shared is False
@@ -0,0 +1,112 @@
+import time
+import threading
+import multiprocessing
+from app.utils import tushare_client as tc
+from app.utils.rate_ledger import RateLedger
+from tests.tushare_fakes import FakeApi, TOKEN, make_client
+
+
+def _bulk_refresh(db_path, progress):
+    """另一个进程中的全量刷新，一直请求到额度用完"""
+    tc.ENDPOINT_LIMITS = {'stk_mins': 10}
+    client = tc.TushareClient(token=TOKEN, ledger=RateLedger(db_path))
+    client.slots[0].api = FakeApi()
+    with tc.request_priority('bulk'):
+        while True:
+            client.call('stk_mins')
+            progress.put(1)
+
+
+def test_interactive_fast_while_other_process_refreshes(tmp_path, limits):
+    db_path = str(tmp_path / 'rate.db')
+    context = multiprocessing.get_context('spawn')
+    progress = context.Queue()
+    worker = context.Process(target=_bulk_refresh, args=(db_path, progress), daemon=True)
+    worker.start()
+    try:
+        # 批量刷新用完除保留额度外的全部额度（10 * 0.8）后阻塞
+        for _ in range(8):
+            progress.get(timeout=30)
+        client = make_client(db_path)
+        assert client._try_take('stk_mins', 'bulk', False)[1] > 0
+        start_time = time.time()
+        assert client.call('stk_mins') == 'ok'
+        assert time.time() - start_time < 0.5
+    finally:
+        worker.terminate()
+        worker.join()
+
+
+def test_interactive_fast_while_refresh_thread_waits(tmp_path, limits):
+    client = make_client(tmp_path / 'rate.db')
+    done = []
+
+    def refresh():
+        with tc.request_priority('bulk'):
+            for _ in range(9):
+                client.call('stk_mins')
+                done.append(1)
+
+    thread = threading.Thread(target=refresh, daemon=True)
+    thread.start()
+    deadline = time.time() + 5
+    while len(done) < 8 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(done) == 8
+    start_time = time.time()
+    assert client.call('stk_mins') == 'ok'
+    assert time.time() - start_time < 0.5
+    # 第9个批量请求仍在等待额度
+    assert len(done) == 8 and thread.is_alive()
+
+
+def test_window_shares_slots_by_weight():
+    """窗口满时持续有交互请求等待，批量请求仍按权重得到窗口"""
+    controller = tc.ConcurrencyController('stk_mins', initial=1, minimum=1, maximum=1, latency_tolerance=3)
+    order = []
+    order_lock = threading.Lock()
+
+    def run(priority, times):
+        for _ in range(times):
+            with tc.request_priority(priority):
+                controller.acquire(tc.current_priority())
+            with order_lock:
+                order.append(priority)
+            time.sleep(0.002)
+            controller.release(None)
+
+    threads = [threading.Thread(target=run, args=('interactive', 40)) for _ in range(4)]
+    threads.append(threading.Thread(target=run, args=('bulk', 5)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 权重 8:1，前100次里批量请求至少得到几次，严格优先时要等交互请求全部结束
+    assert order[:100].count('bulk') >= 3
+
+
+def test_interactive_fast_while_bulk_threads_fill_window(tmp_path, limits, monkeypatch):
+    """等待额度的批量请求比窗口多时，不占用窗口，交互请求不用排在它们后面"""
+    monkeypatch.setenv('TUSHARE_INITIAL_CONCURRENCY', '2')
+    monkeypatch.setenv('TUSHARE_MAX_CONCURRENCY', '2')
+    client = make_client(tmp_path / 'rate.db')
+    done = []
+
+    def refresh():
+        with tc.request_priority('bulk'):
+            while True:
+                client.call('stk_mins')
+                done.append(1)
+
+    threads = [threading.Thread(target=refresh, daemon=True) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 5
+    while len(done) < 8 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(done) == 8
+    time.sleep(0.1)
+    start_time = time.time()
+    assert client.call('stk_mins') == 'ok'
+    assert time.time() - start_time < 0.5
+    assert len(done) == 8
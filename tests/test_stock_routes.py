@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+import httpx
+from fastapi import FastAPI
+from app.routes import stock_routes
+from app.services.stock_service import StockService
+from app.utils.compression import CompressionMiddleware
+
+STOCKS = [{'ts_code': f'{i:06d}.SZ', 'name': f'股票{i}', 'industry': '银行'} for i in range(1, 101)]
+
+
+def request(app, path, headers=None):
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.get(path, headers=headers or {})
+    return asyncio.run(send())
+
+
+def make_app(monkeypatch):
+    monkeypatch.setattr(StockService, 'get_filtered_stocks', staticmethod(lambda trade_date=None: STOCKS))
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+    app.include_router(stock_routes.router, prefix='/api/stocks')
+    return app
+
+
+def test_list_total_is_full_count(monkeypatch):
+    app = make_app(monkeypatch)
+    body = request(app, '/api/stocks/list?limit=30').json()
+    assert body['total'] == 100
+    assert body['count'] == 30
+    assert body['next_cursor']
+
+
+def test_not_modified_keeps_vary(monkeypatch):
+    app = make_app(monkeypatch)
+    response = request(app, '/api/stocks/list', {'Accept-Encoding': 'gzip'})
+    assert response.headers['content-encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['vary']
+    etag = response.headers['etag']
+    response = request(app, '/api/stocks/list', {'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert response.status_code == 304
+    assert 'Accept-Encoding' in response.headers['vary']
+    assert response.headers['etag'] == etag
+
+
+@pytest.mark.parametrize('path', ['/api/stocks/000001.SZ/probability?horizon=4',
+                                  '/api/stocks/000001.SZ/probability/pct?pct_chg=2&horizon=99'])
+def test_unsupported_horizon_is_rejected(monkeypatch, path):
+    app = make_app(monkeypatch)
+    monkeypatch.setattr(StockService, 'get_stock_probability', staticmethod(lambda *args, **kwargs: {}))
+    monkeypatch.setattr(StockService, 'get_stock_probability_by_pct', staticmethod(lambda *args, **kwargs: {}))
+    response = request(app, path)
+    assert response.status_code == 400
+    assert '不支持的间隔交易日' in response.json()['detail']
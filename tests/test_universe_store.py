@@ -0,0 +1,29 @@
+import pandas as pd
+from app.services import universe_store as us
+
+
+def test_snapshot_uses_names_as_of_trade_date(monkeypatch, tmp_path):
+    basic = pd.DataFrame({'ts_code': ['000001.SZ', '000002.SZ', '000003.SZ'],
+                          'symbol': ['000001', '000002', '000003'],
+                          'name': ['ST甲', '乙', '丙'], 'industry': '', 'market': '主板', 'list_date': '20000101'})
+    changes = pd.DataFrame({
+        'ts_code': ['000001.SZ', '000001.SZ', '000002.SZ', '000002.SZ'],
+        'name': ['甲', 'ST甲', 'ST乙', '乙'],
+        'start_date': ['20000101', '20240601', '20230101', '20240301'],
+        'end_date': ['20240531', None, '20240229', None],
+    })
+    daily_basic = pd.DataFrame({'ts_code': basic['ts_code'], 'trade_date': '20240102',
+                                'total_mv': 50 * 10000.0, 'circ_mv': 50 * 10000.0})
+    monkeypatch.setattr(us, 'get_stock_list', lambda status: basic if status == 'L' else pd.DataFrame())
+    monkeypatch.setattr(us, 'get_name_changes', lambda: changes)
+    monkeypatch.setattr(us, 'get_daily_basic_by_date', lambda trade_date: daily_basic.assign(trade_date=trade_date))
+    store = us.UniverseStore(str(tmp_path))
+
+    snapshot = store.build_snapshot('20240102').set_index('ts_code')
+    # 当时000001还不是ST，000002当时是ST
+    assert snapshot.loc['000001.SZ', 'name'] == '甲'
+    assert snapshot.loc['000002.SZ', 'name'] == 'ST乙'
+    assert snapshot['selected'].to_dict() == {'000001.SZ': True, '000002.SZ': False, '000003.SZ': True}
+
+    snapshot = store.build_snapshot('20240603').set_index('ts_code')
+    assert snapshot['selected'].to_dict() == {'000001.SZ': False, '000002.SZ': True, '000003.SZ': True}
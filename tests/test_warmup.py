@@ -0,0 +1,44 @@
+import time
+import asyncio
+import threading
+from app.services import warmup
+
+
+def test_stop_skips_remaining_tasks(monkeypatch):
+    stop = threading.Event()
+
+    def first():
+        # 执行第一个任务时服务关闭
+        stop.set()
+        return 'ok'
+
+    monkeypatch.setattr(warmup, 'WARMUP_TASKS', {'first': first, 'second': lambda: 'ok'})
+    monkeypatch.setenv('WARMUP_TASKS', 'first,second')
+    state = warmup.run_warmup(stop)
+    assert state['ready']
+    assert state['tasks']['first']['status'] == 'done'
+    assert state['tasks']['second']['status'] == 'skipped'
+
+
+def test_shutdown_does_not_wait_for_running_task(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(warmup, 'WARMUP_TASKS', {'slow': lambda: release.wait(5) and 'ok'})
+    monkeypatch.setenv('WARMUP_TASKS', 'slow')
+
+    async def serve():
+        stop = threading.Event()
+        task = warmup.start_warmup(stop)
+        await asyncio.sleep(0.05)
+        stop.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=0.1)
+        except asyncio.TimeoutError:
+            pass
+        return task
+
+    start_time = time.time()
+    task = asyncio.run(serve())
+    # 事件循环关闭时不等待预热线程
+    assert time.time() - start_time < 1
+    assert not task.done()
+    release.set()
@@ -0,0 +1,94 @@
+import zlib
+import threading
+import numpy as np
+import pandas as pd
+from app.utils import tushare_client as tc
+from app.utils.rate_ledger import RateLedger
+
+TOKEN = 'token-1234567890'
+
+
+class FakeApi:
+    """只实现测试用到的接口"""
+
+    def stk_mins(self, **kwargs):
+        return 'ok'
+
+
+def make_client(db_path) -> tc.TushareClient:
+    """使用指定共享额度文件的客户端，相同文件的客户端相当于不同进程"""
+    client = tc.TushareClient(token=TOKEN, ledger=RateLedger(str(db_path)))
+    client.slots[0].api = FakeApi()
+    return client
+
+
+class FakePro:
+    """确定性的 tushare pro 接口，fail_dates 中的交易日竞价和分钟数据请求失败
+
+    日线到 2025-03-07 共 n_days 个工作日，随机数按 (股票, 交易日, 接口) 生成，与调用顺序无关；
+    unpublished 中的交易日还没有发布日线，日线接口不返回这些日期
+    """
+
+    def __init__(self, fail_dates=(), n_days: int = 120):
+        self.fail_dates = set(fail_dates)
+        self.unpublished = set()
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.dates = [day.strftime('%Y%m%d') for day in pd.bdate_range(end='2025-03-07', periods=n_days)]
+
+    def _count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    @staticmethod
+    def _rng(*key):
+        return np.random.default_rng(zlib.crc32(repr(key).encode('utf-8')))
+
+    def _dates(self, start_date=None, end_date=None):
+        return [d for d in self.dates if (not start_date or d >= start_date) and (not end_date or d <= end_date)]
+
+    def trade_cal(self, exchange='', start_date=None, end_date=None, is_open='1'):
+        self._count('trade_cal')
+        return pd.DataFrame({'cal_date': self._dates(start_date, end_date)})
+
+    def daily_basic(self, ts_code=None, start_date=None, end_date=None, trade_date=None, fields=None):
+        self._count('daily_basic')
+        dates = self._dates(start_date, end_date)
+        close = 10 * np.cumprod(1 + self._rng(ts_code, 'daily').normal(0, 0.03, len(dates)))
+        published = np.array([d not in self.unpublished for d in dates], dtype=bool)
+        close, dates = close[published], [d for d, keep in zip(dates, published) if keep]
+        return pd.DataFrame({'ts_code': ts_code, 'trade_date': dates[::-1], 'close': close[::-1],
+                             'turnover_rate': 1.0, 'volume_ratio': 1.0, 'pe': 1.0, 'pb': 1.0,
+                             'total_mv': 1e6, 'circ_mv': 8e5})
+
+    def daily(self, ts_code=None, start_date=None, end_date=None, trade_date=None, fields=None):
+        self._count('daily')
+        basic = self.daily_basic(ts_code, start_date, end_date).iloc[::-1].reset_index(drop=True)
+        pre_close = basic['close'].shift(1).fillna(basic['close'].iloc[0] if len(basic) else 0.0)
+        frame = pd.DataFrame({'ts_code': ts_code, 'trade_date': basic['trade_date'], 'open': pre_close,
+                              'high': basic['close'] * 1.01, 'low': basic['close'] * 0.99, 'close': basic['close'],
+                              'pre_close': pre_close, 'change': basic['close'] - pre_close,
+                              'pct_chg': ((basic['close'] / pre_close - 1) * 100).round(2),
+                              'vol': 1000.0, 'amount': 1e4})
+        return frame.iloc[::-1].reset_index(drop=True)
+
+    def stk_auction_o(self, ts_code=None, trade_date=None):
+        self._count('stk_auction_o')
+        if trade_date in self.fail_dates:
+            raise RuntimeError('抱歉，您每分钟最多访问该接口500次')
+        price = 10 * (1 + self._rng(ts_code, trade_date, 'auction').normal(0, 0.02))
+        return pd.DataFrame({'ts_code': [ts_code], 'trade_date': [trade_date], 'open': [price],
+                             'high': [price * 1.001], 'low': [price * 0.999], 'close': [price],
+                             'vol': [100.0], 'amount': [1e5], 'vwap': [price]})
+
+    def stk_mins(self, ts_code=None, freq='1min', start_date=None, end_date=None):
+        self._count('stk_mins')
+        day = start_date[:10].replace('-', '')
+        if day in self.fail_dates:
+            raise RuntimeError('timeout')
+        times = pd.date_range(pd.Timestamp(start_date), pd.Timestamp(end_date), freq='1min')
+        times = times[times.time <= pd.Timestamp('11:30').time()]
+        close = 10 * np.cumprod(1 + self._rng(ts_code, day, 'minutes').normal(0, 0.002, len(times)))
+        return pd.DataFrame({'ts_code': ts_code, 'trade_time': times.strftime('%Y-%m-%d %H:%M:%S'),
+                             'open': close, 'close': close, 'high': close * 1.001, 'low': close * 0.999,
+                             'vol': 100.0, 'amount': 1000.0})